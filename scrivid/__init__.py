@@ -1,11 +1,15 @@
-from . import adjustments, errors, file_access, motion_tree, properties, qualms
+from . import adjustments, caches, errors, file_access, motion_tree, properties, qualms
 from ._file_objects import create_image_reference, ImageFileReference, ImageReference
 from ._version import __version__, __version_tuple__
-from ._video_crafting import compile_video
-from .metadata import Metadata
+from ._video_crafting import (
+    CancelToken, compile_video, iter_frames, Preview, render_frame, RenderProgress, RenderStats, Scratch, StageStats
+)
+from .metadata import EncoderProfile, Metadata
 
 
 __all__ = [
-    "__version__", "__version_tuple__", "adjustments", "compile_video", "create_image_reference", "errors",
-    "file_access", "ImageFileReference", "ImageReference", "Metadata", "motion_tree", "properties", "qualms"
+    "__version__", "__version_tuple__", "adjustments", "caches", "CancelToken", "compile_video",
+    "create_image_reference", "EncoderProfile", "errors", "file_access", "ImageFileReference", "ImageReference",
+    "iter_frames", "Metadata", "motion_tree", "Preview", "properties", "qualms", "render_frame", "RenderProgress",
+    "RenderStats", "Scratch", "StageStats"
 ]
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from .. import errors, properties
+from .. import caches, errors, properties
 from .._utils.sentinel_objects import sentinel
 from ..file_access import call_close, FileAccess
 
@@ -41,6 +41,16 @@ class ImageFileReference:
             + ")"
         )
 
+    def __getstate__(self):
+        # The decoded image isn't sent along when pickled (such as to another
+        # process). It's opened again from the file when it's needed.
+        return self._file
+
+    def __setstate__(self, state):
+        self._file = state
+        self._file_handler = None
+        self._pixel_handler = None
+
     @property
     def is_opened(self):
         return self._file_handler is not None
@@ -57,6 +67,15 @@ class ImageFileReference:
         else:
             return self._file_handler.width
 
+    def get_image(self) -> Optional[Image.Image]:
+        # Hands over the decoded image as a whole, so that it can be drawn as
+        # one region instead of pixel-by-pixel. The image is shared through
+        # `caches.decoded_images`, so it must not be modified.
+        if not self.is_opened:
+            return None
+        else:
+            return self._file_handler
+
     def get_pixel_value(self, coordinates: Tuple[int, int]):
         if not self.is_opened:
             return None
@@ -66,13 +85,14 @@ class ImageFileReference:
     def open(self):
         if self._file_handler is not None:
             return
-        self._file_handler = Image.open(self._file)
+        self._file_handler = caches.decoded_images.open(self._file)
         self._pixel_handler = self._file_handler.load()
 
     def close(self):
+        # The decoded image may be shared with other references, so it's only
+        # let go of here, instead of being closed.
         if self._file_handler is None:
             return
-        self._file_handler.close()
         self._file_handler = None
         self._pixel_handler = None
 
@@ -161,6 +181,14 @@ class ImageReference:
         self._file: ImageFileReference
         return self._file.get_image_width()
 
+    def get_image(self) -> Optional[Image.Image]:
+        # Not every FileAccess-like class is able to hand over its image as a
+        # whole. Those that can't are drawn through `get_pixel_value` instead.
+        get_image = getattr(self._file, "get_image", None)
+        if get_image is None:
+            return None
+        return get_image()
+
     def get_pixel_value(self, coordinates: Tuple[int, int]):
         self._file: ImageFileReference
         return self._file.get_pixel_value(coordinates)
@@ -1,5 +1,8 @@
+from .scaling import quantise_scale, scale_dimensions
 from .sentinel_objects import sentinel, SentinelBase
 from .temporary import TemporaryAttribute, TemporaryDirectory
 
 
-__all__ = ["sentinel", "SentinelBase", "TemporaryAttribute", "TemporaryDirectory"]
+__all__ = [
+    "quantise_scale", "scale_dimensions", "sentinel", "SentinelBase", "TemporaryAttribute", "TemporaryDirectory"
+]
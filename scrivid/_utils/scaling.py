@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Tuple, Union
+
+
+# Scales are rounded to this many decimal places, so that a scale that drifts
+# through floating point arithmetic (like 0.1 + 0.2) still counts as the same
+# scale as the one it's meant to be.
+SCALE_PRECISION = 2
+
+
+def quantise_scale(scale) -> Union[float, int]:
+    # A scale that was never specified is drawn at the image's own size.
+    if not isinstance(scale, (float, int)):
+        return 1
+    return round(scale, SCALE_PRECISION)
+
+
+def scale_dimensions(width: int, height: int, scale) -> Tuple[int, int]:
+    scale = quantise_scale(scale)
+    if scale == 1:
+        return width, height
+    return max(round(width * scale), 0), max(round(height * scale), 0)
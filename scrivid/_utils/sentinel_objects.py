@@ -1,3 +1,6 @@
+import sys
+
+
 class SentinelBase(type):
     def __new__(mcs, *_, **__):
         raise TypeError(f"{mcs!r} is not callable")
@@ -9,4 +12,11 @@ class SentinelBase(type):
 def sentinel(name):
     cls = type.__new__(SentinelBase, name, (SentinelBase,), {})
     cls.__class__ = cls
+    # Sentinels are pickled by reference (the same as classes are), which
+    # needs the module they're assigned in, so they keep their identity when
+    # sent to another process. Borrowed from `collections.namedtuple`.
+    try:
+        cls.__module__ = sys._getframe(1).f_globals.get("__name__", "__main__")
+    except (AttributeError, ValueError):
+        pass
     return cls
@@ -1,12 +1,12 @@
 from __future__ import annotations
 
-import os
+from pathlib import Path
 import shutil
+import tempfile
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
-    from pathlib import Path
-    from typing import Callable, TypeVar
+    from typing import Callable, Optional, TypeVar
 
     T = TypeVar("T")
     CLEANUP_CALLABLE = Callable[[T], None]
@@ -39,11 +39,19 @@ class TemporaryAttribute:
 
 
 class TemporaryDirectory:
-    def __init__(self, dir: Path):
-        self.dir = dir
+    # The directory is given a name of its own inside of `location`, starting
+    # with `prefix`, so that any number of them can be there at once.
+    __slots__ = ("dir", "location", "prefix")
+
+    dir: Optional[Path]
+
+    def __init__(self, location: Path, prefix: str):
+        self.dir = None
+        self.location = location
+        self.prefix = prefix
 
     def __enter__(self):
-        os.mkdir(self.dir)
+        self.dir = Path(tempfile.mkdtemp(prefix=self.prefix, dir=self.location))
         return self
 
     def __exit__(self, *_):
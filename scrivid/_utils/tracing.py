@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pathlib import Path
+    from typing import List, Optional, Union
+
+
+# The tracer of this process, which is only set while a trace is being
+# recorded. Everything that records spans checks it first, so that nothing
+# else is done while it isn't set.
+tracer: Optional[Tracer] = None
+
+
+def now() -> float:
+    # In microseconds. The clock is shared by every process, so spans from
+    # worker processes line up with those of the process that started them.
+    return time.perf_counter_ns() / 1000
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *_):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("_args", "_category", "_name", "_start", "_tracer")
+
+    def __init__(self, tracer_: Tracer, name: str, category: str, args: Optional[dict]):
+        self._args = args
+        self._category = category
+        self._name = name
+        self._tracer = tracer_
+
+    def __enter__(self):
+        self._start = now()
+
+    def __exit__(self, *_):
+        self._tracer.add(self._name, self._category, self._start, now(), self._args)
+
+
+class Tracer:
+    """
+    Records spans of time as Chrome trace events, which can be opened in a
+    trace viewer (such as Perfetto, or `chrome://tracing`).
+    """
+
+    __slots__ = ("_events", "_pid")
+
+    _events: List[dict]
+
+    def __init__(self):
+        self._events = []
+        self._pid = os.getpid()
+
+    def add(
+            self,
+            name: str,
+            category: str,
+            start: float,
+            end: float,
+            args: Optional[dict] = None,
+            *,
+            thread: Optional[int] = None
+    ):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start,
+            "dur": end - start,
+            "pid": self._pid,
+            "tid": threading.get_ident() if thread is None else thread,
+        }
+        if args:
+            event["args"] = args
+        self._events.append(event)
+
+    def extend(self, events: List[dict]):
+        # For the events recorded by another process.
+        self._events.extend(events)
+
+    def name_thread(self, thread: int, name: str):
+        self._events.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": thread, "args": {"name": name}})
+
+    def take_events(self) -> List[dict]:
+        events = self._events
+        self._events = []
+        return events
+
+    def write(self, file: Union[str, Path]):
+        with open(file, "w", encoding="utf-8") as trace_file:
+            # IDs can be any hashable object, so anything that isn't JSON is
+            # written as a string.
+            json.dump({"traceEvents": self._events, "displayTimeUnit": "ms"}, trace_file, default=str)
+
+
+def span(name: str, category: str, args: Optional[dict] = None):
+    """
+    Records the time spent in the `with` block that this is used in, if a trace
+    is being recorded.
+    """
+    if tracer is None:
+        return _NO_SPAN
+    return _Span(tracer, name, category, args)
+
+
+def start() -> Tracer:
+    global tracer
+    tracer = Tracer()
+    return tracer
+
+
+def stop() -> Optional[Tracer]:
+    global tracer
+    stopped, tracer = tracer, None
+    return stopped
@@ -1,4 +1,12 @@
 from .compile_video import compile_video
+from ._preview import Preview
+from ._progress import CancelToken, RenderProgress
+from ._render_stats import RenderStats, StageStats
+from ._scratch import Scratch
+from .iter_frames import iter_frames, render_frame
 
 
-__all__ = ["compile_video"]
+__all__ = [
+    "CancelToken", "compile_video", "iter_frames", "Preview", "render_frame", "RenderProgress", "RenderStats",
+    "Scratch", "StageStats"
+]
@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+from .. import errors
+from .._file_objects.images import ImageFileReference, ImageReference
+from .._utils import TemporaryDirectory
+
+import contextlib
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import time
+from typing import TYPE_CHECKING
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+if TYPE_CHECKING:
+    from ..abc import Adjustment
+    from ..metadata import Metadata
+
+    from collections.abc import Sequence
+    from pathlib import Path
+    from typing import BinaryIO, Dict, FrozenSet, Iterable, List, Optional, Set, Union
+
+    INSTRUCTIONS = Union[ImageReference, Adjustment]
+
+
+_LOCK = "lock"
+_MANIFEST = "manifest.json"
+
+# Changed whenever what's kept in a resumable directory changes, so that a
+# manifest written by another version of Scrivid is never trusted.
+_VERSION = 1
+
+# How often (in seconds) the manifest is saved while frames are being
+# finished, which is about as much work as is lost if the process dies.
+_SAVE_INTERVAL = 1.0
+
+
+def _file_digest(file: Path, digests: Dict[Path, str]) -> str:
+    # Many references tend to share the same few images, which are only read
+    # once.
+    if file not in digests:
+        try:
+            digests[file] = hashlib.sha256(file.read_bytes()).hexdigest()
+        except OSError:
+            # The image can't be drawn either, which is reported once it's
+            # opened.
+            digests[file] = "missing"
+    return digests[file]
+
+
+def fingerprint(instructions: Sequence[INSTRUCTIONS]) -> str:
+    """
+    Describes the instructions well enough to tell whether they draw the same
+    video as before: every reference by its ID, its properties, and the
+    contents of its image, and every adjustment by its repr. Anything that
+    isn't described the same way twice (such as an object without a repr of
+    its own) only means that the video is started over.
+    """
+    hasher = hashlib.sha256()
+    digests = {}
+
+    for instruction in instructions:
+        if isinstance(instruction, ImageReference):
+            file = instruction._file
+            if isinstance(file, ImageFileReference):
+                file = f"{file._file.as_posix()}:{_file_digest(file._file, digests)}"
+            description = f"ImageReference({instruction.ID!r}, {file!r}, {instruction._properties!r})"
+        else:
+            description = repr(instruction)
+        hasher.update(description.encode("utf-8"))
+        hasher.update(b"\n")
+
+    return hasher.hexdigest()
+
+
+def _describe_metadata(metadata: Metadata) -> dict:
+    # Where the video is saved doesn't change what's drawn, or how it's
+    # encoded.
+    return {
+        "frame_rate": metadata.frame_rate,
+        "video_name": metadata.video_name,
+        "window_size": metadata.window_size,
+        "encoder": metadata._encoder_profile()._output_settings(),
+    }
+
+
+def _to_ranges(numbers: Iterable[int]) -> List[List[int]]:
+    # Frames tend to be finished in order, so they're listed as ranges of
+    # `[start, stop]`, which keeps the manifest small however long the video
+    # is.
+    ranges = []
+    for number in sorted(numbers):
+        if ranges and ranges[-1][1] == number:
+            ranges[-1][1] = number + 1
+        else:
+            ranges.append([number, number + 1])
+    return ranges
+
+
+def _lock(lock_file: BinaryIO) -> bool:
+    # Whether the lock was taken, without waiting for it. The operating system
+    # lets go of it once the file is closed, or the process ends, so a crash
+    # never leaves it taken.
+    try:
+        if os.name == "nt":
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def _from_ranges(ranges: List[List[int]]) -> Set[int]:
+    return set(itertools.chain.from_iterable(range(start, stop) for start, stop in ranges))
+
+
+class Checkpoint:
+    """
+    The scratch directory of a resumable video, which is kept if compiling the
+    video fails, or is cancelled, along with a manifest of what was finished
+    in it: the frames that were saved, or the segments that were compiled.
+    Compiling the video again from the same instructions, metadata and
+    settings carries on from there. Anything else starts it over, in the same
+    directory. The directory is removed once the video is compiled.
+
+    Only one render at a time can have the directory, which it holds a lock
+    file in for as long as it's compiling.
+    """
+
+    __slots__ = ("_header", "_lock_file", "_saved_at", "completed", "dir")
+
+    _lock_file: Optional[BinaryIO]
+
+    completed: Set[int]
+
+    def __init__(self, directory: Path, instructions: str, metadata: Metadata, settings: dict):
+        # The header is compared with the one in the manifest as it's read
+        # back from JSON, where tuples are lists.
+        self._header = json.loads(json.dumps({
+            "version": _VERSION,
+            "fingerprint": instructions,
+            "metadata": _describe_metadata(metadata),
+            "settings": settings,
+        }))
+        self._lock_file = None
+        self._saved_at = 0.0
+        self.completed = set()
+        self.dir = directory
+
+    def __repr__(self):
+        directory = self.dir
+        completed = len(self.completed)
+
+        return f"{self.__class__.__name__}({directory=}, {completed=})"
+
+    def __enter__(self):
+        self._take_lock()
+        try:
+            completed = self._load()
+            if completed is not None:
+                self.completed = completed
+            else:
+                # Whatever's there was compiled from something else.
+                self._clear()
+                self.save()
+        except BaseException:
+            self._release_lock()
+            raise
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is not None:
+            try:
+                self.save()
+            finally:
+                self._release_lock()
+            return
+
+        unlinked = False
+        try:
+            self._clear()
+            # Removed while it's still held where that's possible (not on
+            # Windows), so that a render that takes the lock next sees that
+            # it's gone.
+            with contextlib.suppress(OSError):
+                (self.dir / _LOCK).unlink()
+                unlinked = True
+        finally:
+            self._release_lock()
+        # Another render may have the directory by now, which is then left
+        # with it.
+        with contextlib.suppress(OSError):
+            if not unlinked:
+                (self.dir / _LOCK).unlink()
+            self.dir.rmdir()
+
+    def _clear(self):
+        # Removes everything in the directory, besides the lock file.
+        for path in self.dir.iterdir():
+            if path.name == _LOCK:
+                continue
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+
+    def _load(self) -> Optional[Set[int]]:
+        # What was completed before, if it was compiled the same way.
+        try:
+            with open(self.dir / _MANIFEST, encoding="utf-8") as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest["header"] != self._header:
+                return None
+            return _from_ranges(manifest["completed"])
+        except (OSError, ValueError, KeyError, TypeError):
+            # Either there's nothing to resume, or there's no telling what.
+            return None
+
+    def _release_lock(self):
+        self._lock_file.close()
+        self._lock_file = None
+
+    def _take_lock(self):
+        # Another render that compiled into the directory at the same time
+        # could start it over from under this one, or remove it.
+        lock = self.dir / _LOCK
+        while True:
+            self.dir.mkdir(exist_ok=True)
+            try:
+                lock_file = open(lock, "ab")
+            except FileNotFoundError:
+                # The directory was removed in the meantime.
+                continue
+            if not _lock(lock_file):
+                lock_file.close()
+                raise errors.RenderInProgress(
+                    f"`{self.dir}` is in use by another render of the same video, which has to finish first."
+                )
+            # The render that had the lock before may have removed the
+            # directory since the file was opened, along with the file.
+            with contextlib.suppress(FileNotFoundError):
+                if os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock)):
+                    self._lock_file = lock_file
+                    return
+            lock_file.close()
+
+    def complete(self, number: int):
+        # Records a frame (by its index), or a segment (by its number), once
+        # it's saved for good. The manifest is saved every so often, rather
+        # than every time.
+        self.completed.add(number)
+        if time.monotonic() - self._saved_at >= _SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        # The manifest is replaced all at once, so there's never half of one.
+        manifest = {"header": self._header, "completed": _to_ranges(self.completed)}
+        unfinished = self.dir / f"{_MANIFEST}.tmp"
+        with open(unfinished, "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(unfinished, self.dir / _MANIFEST)
+        self._saved_at = time.monotonic()
+
+
+class NoCheckpoint:
+    # The scratch directory of a video that isn't resumable, which is removed
+    # however compiling the video ends, so nothing in it is recorded.
+    __slots__ = ("_temporary_directory",)
+
+    completed: FrozenSet[int] = frozenset()
+
+    def __init__(self, location: Path, prefix: str):
+        self._temporary_directory = TemporaryDirectory(location, prefix)
+
+    def __repr__(self):
+        directory = self.dir
+
+        return f"{self.__class__.__name__}({directory=})"
+
+    def __enter__(self):
+        self._temporary_directory.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._temporary_directory.__exit__(*exc_info)
+
+    @property
+    def dir(self) -> Path:
+        return self._temporary_directory.dir
+
+    def complete(self, number: int):
+        pass
+
+    def save(self):
+        pass
@@ -1,144 +1,466 @@
 from __future__ import annotations
 
 from ._frame_info import FrameInfo
+from ._render_stats import measure
+from ._video_stitching import LISTED_FRAME_RATE
 
-from .. import adjustments, motion_tree, properties
-from .._utils import TemporaryAttribute
+from .. import caches, errors, motion_tree, properties
+from .._file_objects.images import ImageFileReference
+from .._utils import quantise_scale, scale_dimensions, tracing
 
-from copy import deepcopy
+import bisect
+import hashlib
 import itertools
 from typing import TYPE_CHECKING
 
-from PIL import Image
+from sortedcontainers import SortedDict
 
 if TYPE_CHECKING:
-    from ..abc import Adjustment
-    from .._separating_instructions import SeparatedInstructions
-
+    from ._frame_files import FrameWriter
+    from ._frame_info import _FrameCanvas, CanvasPool
+    from ._frame_states import FrameStates
+    from ._preview import PreviewView
+    from ._render_stats import RenderStats
+
+    from collections.abc import Hashable
+    from concurrent.futures import Future
     from pathlib import Path
-    from typing import List, Tuple
+    from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+    Box = Tuple[int, int, int, int]
     MotionTree = motion_tree.MotionTree
 
 
-def _call_close(value):
-    value.close()
-
-
-def _draw_on_frame(frame: FrameInfo, references_dict):
-    try:
-        highest_layer = max(references_dict) + 1
-    except ValueError:
-        return
-
-    for index in range(highest_layer):
-        if index not in references_dict:
-            continue
-
-        references = references_dict[index]
-        for reference in references:
-            if not reference.is_opened:
-                reference.open()
-
-            ref_x = reference.x
-            ref_y = reference.y
-
-            for x, y in itertools.product(
-                    range(ref_x, ref_x + reference.get_image_width()),
-                    range(ref_y, ref_y + reference.get_image_height())
-            ):
-                frame.canvas.set_pixel((x, y), reference.get_pixel_value((x - ref_x, y - ref_y)))
-
-
-def _invoke_adjustment_duration(index: int, adj: Adjustment):
-    # Assume that the `adj` has a 'duration' attribute.
-    duration = index - adj.activation_time
-    if duration > adj.duration:
-        return adj.duration
+def _bounds(reference, canvas_size: Tuple[int, int]) -> Optional[Box]:
+    # The region of the canvas that the reference covers, or None if it's
+    # entirely outside of it.
+    image = reference.get_image()
+    if image is None:
+        size = (reference.get_image_width(), reference.get_image_height())
     else:
-        return duration
-
-
-def create_frame(frame: FrameInfo, split_instructions: SeparatedInstructions):
-    index = frame.index
-    instructions = deepcopy(split_instructions)  # Avoid modifying the
-    # original objects.
-    layer_reference = {}
-    merge_settings = {"mode": properties.MergeMode.REVERSE_APPEND}
-
-    for ID, reference in instructions.references.items():
-        try:
-            relevant_adjustments = instructions.adjustments[ID]
-        except KeyError:
-            relevant_adjustments = None
-
-        while relevant_adjustments:
-            adj = relevant_adjustments.pop(0)
-
-            if adj.activation_time > index:
-                break
-
-            args = ()
-            if type(adj) is adjustments.core.MoveAdjustment:
-                args = (_invoke_adjustment_duration(index, adj),)
-
-            reference._properties = reference._properties.merge(adj._enact(*args), **merge_settings)
-
-        if reference.visibility is properties.VisibilityStatus.HIDE:
+        size = image.size
+    width, height = scale_dimensions(*size, reference.scale)
+
+    left = max(reference.x, 0)
+    top = max(reference.y, 0)
+    right = min(reference.x + width, canvas_size[0])
+    bottom = min(reference.y + height, canvas_size[1])
+    if left >= right or top >= bottom:
+        return None
+    return left, top, right, bottom
+
+
+def _damaged_regions(old_contents: Dict[Hashable, tuple], new_contents: Dict[Hashable, tuple]) -> List[Box]:
+    # The regions where a reference was drawn, or is to be drawn, for every
+    # reference that isn't drawn the same way as before. Regions that overlap
+    # are merged, so that nothing is drawn twice.
+    regions = []
+    for ID in old_contents.keys() | new_contents.keys():
+        old_state = old_contents.get(ID)
+        new_state = new_contents.get(ID)
+        if old_state == new_state:
             continue
 
+        for state in (old_state, new_state):
+            if state is not None and state[-1] is not None:
+                regions.append(state[-1])
+
+    merged = []
+    for region in regions:
+        index = 0
+        while index < len(merged):
+            other = merged[index]
+            if (
+                    region[0] < other[2] and other[0] < region[2]
+                    and region[1] < other[3] and other[1] < region[3]
+            ):
+                region = (
+                    min(region[0], other[0]), min(region[1], other[1]),
+                    max(region[2], other[2]), max(region[3], other[3])
+                )
+                del merged[index]
+                # The grown region may now overlap ones that were checked.
+                index = 0
+                continue
+            index += 1
+        merged.append(region)
+
+    return merged
+
+
+def _drawing_order(references_dict: SortedDict) -> Iterator:
+    # From the lowest layer up, over only the layers that have something on
+    # them (from `_layer_references`).
+    return itertools.chain.from_iterable(references_dict.values())
+
+
+def _draw_on_frame(canvas: _FrameCanvas, references_dict: SortedDict, box: Optional[Box] = None) -> int:
+    # Only the part of each reference inside of `box` is drawn, if it's given.
+    # Returns the number of pixels drawn, for `RenderStats.pixels_blitted`.
+    if box is None:
+        box = (0, 0, *canvas.size)
+    pixels = 0
+    # This is the innermost loop of drawing a frame, so the span of each
+    # reference is only set up while a trace is being recorded.
+    if tracing.tracer is None:
+        for reference in _drawing_order(references_dict):
+            pixels += _draw_reference(canvas, reference, box)
+        return pixels
+
+    for reference in _drawing_order(references_dict):
+        with tracing.span("blit", "draw", {"ID": reference.ID}):
+            pixels += _draw_reference(canvas, reference, box)
+    return pixels
+
+
+def _draw_reference(canvas: _FrameCanvas, reference, box: Box) -> int:
+    if not reference.is_opened:
+        reference.open()
+
+    image = reference.get_image()
+    if image is None:
+        return _draw_pixels(canvas, reference, box)
+
+    image = caches.sprites.resize(image, reference.scale)
+    if image is None:
+        return 0
+
+    x = reference.x
+    y = reference.y
+    left = max(box[0], x)
+    top = max(box[1], y)
+    right = min(box[2], x + image.width)
+    bottom = min(box[3], y + image.height)
+    if left >= right or top >= bottom:
+        return 0
+
+    if (left, top, right, bottom) != (x, y, x + image.width, y + image.height):
+        image = image.crop((left - x, top - y, right - x, bottom - y))
+    canvas.paste(image, (left, top))
+    return (right - left) * (bottom - top)
+
+
+def _draw_pixels(canvas: _FrameCanvas, reference, box: Optional[Box] = None) -> int:
+    # Fallback for FileAccess-like classes that can only be read one pixel at a
+    # time. The region is clipped to the canvas (or `box`) beforehand, matching
+    # what `_FrameCanvas.paste` does. Scaled images take the pixel of the image
+    # nearest to the centre of each pixel drawn, instead of being resampled.
+    if box is None:
+        box = (0, 0, *canvas.size)
+    image_width = reference.get_image_width()
+    image_height = reference.get_image_height()
+    width, height = scale_dimensions(image_width, image_height, reference.scale)
+    ref_x = reference.x
+    ref_y = reference.y
+    columns = range(max(ref_x, box[0]), min(ref_x + width, box[2]))
+    rows = range(max(ref_y, box[1]), min(ref_y + height, box[3]))
+
+    for x, y in itertools.product(columns, rows):
+        pixel_coordinates = (
+            (2 * (x - ref_x) + 1) * image_width // (2 * width),
+            (2 * (y - ref_y) + 1) * image_height // (2 * height)
+        )
+        canvas.set_pixel((x, y), reference.get_pixel_value(pixel_coordinates))
+    return len(columns) * len(rows)
+
+
+def _layer_references(references: Iterable) -> SortedDict:
+    # The references on each layer (which may be negative), kept in the order
+    # that they're given in, which is the order of the instructions. That's
+    # the order that they're drawn in, within a layer.
+    layer_reference = SortedDict()
+
+    for reference in references:
         layer = reference.layer
         if layer not in layer_reference:
-            layer_reference[layer] = set()
-
-        layer_reference[layer].add(reference)
+            layer_reference[layer] = []
+
+        layer_reference[layer].append(reference)
+
+    return layer_reference
+
+
+def _frame_key(frame_states: FrameStates, canvas_size: Tuple[int, int]) -> Optional[str]:
+    # The key of the frame that the states are at in `caches.frames`, from
+    # everything that decides how it's drawn, or None if any visible reference
+    # isn't drawn from a file.
+    hasher = hashlib.sha256(f"{canvas_size[0]}x{canvas_size[1]}\n".encode("utf-8"))
+    visible_references = [
+        reference for reference in frame_states.references()
+        if reference.visibility is not properties.VisibilityStatus.HIDE
+    ]
+
+    for reference in _drawing_order(_layer_references(visible_references)):
+        file = reference._file
+        if not isinstance(file, ImageFileReference):
+            return None
+        source = caches.frames.source(file._file)
+        hasher.update(
+            f"{source} {reference.layer} {reference.x} {reference.y} {reference.scale!r}\n".encode("utf-8")
+        )
+    return hasher.hexdigest()
+
+
+def _frame_buffer(
+        frame: FrameInfo,
+        frame_states: FrameStates,
+        canvas_pool: CanvasPool,
+        stats: Optional[RenderStats] = None
+) -> bytes:
+    # The raw RGB buffer of the frame. A frame that was drawn the same way
+    # before is read back from `caches.frames`, if it's kept on disk, instead
+    # of being drawn again. The canvas isn't touched then, which still holds
+    # (and knows) what was last drawn on it.
+    key = None
+    size = canvas_pool.window_size[0] * canvas_pool.window_size[1] * 3
+    if caches.frames.directory is not None:
+        frame_states.step(frame.index)
+        key = _frame_key(frame_states, canvas_pool.window_size)
+        if key is not None:
+            buffer = caches.frames.load(key, size)
+            if buffer is not None:
+                return buffer
+
+    canvas = canvas_pool.acquire()
+    try:
+        pixels = draw_frame(frame, frame_states, canvas)
+        buffer = canvas.tobytes()
+    finally:
+        canvas_pool.release(canvas)
 
-    _draw_on_frame(frame, layer_reference)
-    frame.canvas.save(frame.save_file)
+    if stats is not None:
+        stats.pixels_blitted += pixels
+    if key is not None:
+        caches.frames.save(key, buffer)
+    return buffer
 
 
-def fill_undrawn_frames(temporary_directory: Path, video_length: int):
-    with TemporaryAttribute(cleanup=_call_close) as frame_assignment:
-        for index in range(video_length):
-            try:
-                frame_assignment.value = Image.open(
-                    str(temporary_directory / f"{index:06d}.png")
-                )
-            except FileNotFoundError:
-                frame_assignment.value.save(
-                    temporary_directory / f"{index:06d}.png"
-                )
+def draw_frame(frame: FrameInfo, frame_states: FrameStates, canvas: _FrameCanvas) -> int:
+    # Returns the number of pixels drawn.
+    frame_states.step(frame.index)
+    visible_references = []
 
+    for reference in frame_states.references():
+        if reference.visibility is properties.VisibilityStatus.HIDE:
+            continue
 
-def generate_frames(
-        parsed_motion_tree: MotionTree,
+        frame_states.open(reference)
+        visible_references.append(reference)
+
+    layer_reference = _layer_references(visible_references)
+
+    # The layers that stay the same for a while are drawn once onto a base
+    # surface, which is copied from in place of drawing each of them.
+    static_layers = frame_states.static_layers
+    pixels = 0
+    if static_layers.update(frame_states.index, frame_states.references(), canvas.size):
+        with tracing.span("static layers", "draw"):
+            static_layers.surface.clear()
+            pixels += _draw_on_frame(
+                static_layers.surface,
+                _layer_references(reference for reference in visible_references if reference.ID in static_layers.IDs)
+            )
+    base = static_layers.surface
+    if base is not None:
+        layer_reference = _layer_references(
+            reference for reference in visible_references if reference.ID not in static_layers.IDs
+        )
+
+    # Rather than starting from a blank canvas, only the regions that differ
+    # from what was last drawn on it are cleared and drawn over again.
+    contents = {
+        reference.ID: (
+            reference.layer, reference.x, reference.y, quantise_scale(reference.scale),
+            _bounds(reference, canvas.size)
+        )
+        for reference in _drawing_order(_layer_references(visible_references))
+    }
+
+    for region in _damaged_regions(canvas.contents, contents):
+        if base is None:
+            canvas.clear_region(region)
+        else:
+            canvas.copy_region(base, region)
+            pixels += (region[2] - region[0]) * (region[3] - region[1])
+        pixels += _draw_on_frame(canvas, layer_reference, region)
+    canvas.contents = contents
+
+    return pixels
+
+
+def create_frame(
+        frame: FrameInfo,
+        frame_states: FrameStates,
+        canvas_pool: CanvasPool,
+        frame_writer: FrameWriter,
+        stats: Optional[RenderStats] = None
+) -> Future:
+    # The frame is saved by the writer's threads, so only the time spent
+    # handing it over (or waiting for them to catch up) is timed. Returns the
+    # future of saving it.
+    with tracing.span("frame", "frame", {"index": frame.index}):
+        with measure(stats, "draw_frames"):
+            buffer = _frame_buffer(frame, frame_states, canvas_pool, stats)
+        with measure(stats, "save_frames"):
+            return frame_writer.save(buffer, frame.save_file)
+
+
+def _timestamp(index: int, frame_rate: int) -> int:
+    # The time that the frame at `index` is shown at, in microseconds.
+    return (2 * index * 1_000_000 + frame_rate) // (2 * frame_rate)
+
+
+def fill_undrawn_frames(
+        frames: List[FrameInfo],
         temporary_directory: Path,
-        window_size: Tuple[int, int]
-) -> Tuple[List[FrameInfo], int]:
-    # ...
-    frames = []
+        start: int,
+        stop: int
+) -> Path:
+    # Rather than copying the previous file for every frame that wasn't drawn,
+    # each drawn frame is listed for ffmpeg's concat demuxer with how long it's
+    # held for, from `start` (where the first frame is shown) up to `stop`.
+    # The durations are counted at `LISTED_FRAME_RATE`, whatever the video's
+    # frame rate is, so that they're exact in the time base of the image
+    # demuxer; `stitch_video` scales them back.
+    frame_list = temporary_directory / "frames.ffconcat"
+
+    lines = ["ffconcat version 1.0"]
+    for frame, end in zip(frames, itertools.chain((frame.index for frame in frames[1:]), (stop,))):
+        shown = max(frame.index, start)
+        duration = _timestamp(end - start, LISTED_FRAME_RATE) - _timestamp(shown - start, LISTED_FRAME_RATE)
+        lines.append(f"file '{frame.save_file.name}'")
+        lines.append(f"duration {duration // 1_000_000}.{duration % 1_000_000:06d}")
+    # The duration of the last file in the list is ignored, so it's listed a
+    # second time to be held until the end.
+    lines.append(f"file '{frames[-1].save_file.name}'")
+
+    frame_list.write_text("\n".join(lines) + "\n")
+    return frame_list
+
+
+def draw_frames(
+        frames: List[FrameInfo],
+        frame_states: FrameStates,
+        canvas_pool: CanvasPool,
+        stats: Optional[RenderStats] = None
+) -> Iterator[Tuple[FrameInfo, bytes]]:
+    for frame in frames:
+        with tracing.span("frame", "frame", {"index": frame.index}), measure(stats, "draw_frames"):
+            buffer = _frame_buffer(frame, frame_states, canvas_pool, stats)
+        yield frame, buffer
+
+
+def hold_frames(drawn_frames: Iterable[Tuple[FrameInfo, bytes]], start: int, stop: int) -> Iterator[bytes]:
+    # Yields the raw RGB buffer of every frame from `start` up to `stop`, in
+    # order. The indices between drawn frames repeat the previous buffer, the
+    # same way that `fill_undrawn_frames` holds the previous file. The first
+    # frame may come from before `start`, in which case it's held into it.
+    previous_buffer = None
+    index = start
+
+    for frame, buffer in drawn_frames:
+        for _ in range(index, frame.index):
+            yield previous_buffer
+
+        yield buffer
+        previous_buffer = buffer
+        index = max(index, frame.index) + 1
+
+    for _ in range(index, stop):
+        yield previous_buffer
+
+
+def drawn_ranges(parsed_motion_tree: MotionTree) -> Tuple[List[range], int]:
+    # The indices of the frames that need to be drawn, as ranges in order, and
+    # the number of frames in the video. Every other frame is held from the
+    # one drawn before it.
+    ranges = []
+    last_drawn = None
     index = 0
 
+    def draw(start, stop):
+        nonlocal last_drawn
+        if ranges and ranges[-1].stop == start:
+            ranges[-1] = range(ranges[-1].start, stop)
+        else:
+            ranges.append(range(start, stop))
+        last_drawn = stop - 1
+
     for node in parsed_motion_tree.body:
         type_ = type(node)
         if type_ is motion_tree.Start:
-            frames.append(FrameInfo(0, temporary_directory, window_size))
+            draw(0, 1)
         elif type_ in (motion_tree.HideImage, motion_tree.MoveImage, motion_tree.ShowImage):
-            if index == frames[-1].index:
+            if index == last_drawn:
                 continue
-            frames.append(FrameInfo(index, temporary_directory, window_size))
+            draw(index, index + 1)
         elif type_ is motion_tree.InvokePrevious:
             start = 0
-            if index == frames[-1].index:
+            if index == last_drawn:
                 start = 1
                 index += 1
-            for _ in range(start, node.length):
-                frames.append(FrameInfo(index, temporary_directory, window_size))
-                index += 1
+            if node.length > start:
+                draw(index, index + node.length - start)
+                index += node.length - start
             del start
         elif type_ is motion_tree.Continue:
             index += node.length
         elif type_ is motion_tree.End:
             break
 
-    return frames, index
+    return ranges, max(index, last_drawn + 1)
+
+
+def _check_frame_range(start: int, stop: Optional[int], video_length: int) -> int:
+    for name, value in (("start", start), ("stop", stop)):
+        if value is None and name == "stop":
+            continue
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise errors.TypeError(f"`{name}` must be an integer.")
+
+    if stop is None:
+        stop = video_length
+    if not 0 <= start < stop <= video_length:
+        raise errors.IndexError(
+            f"The range of frames from {start} to {stop} isn't within the {video_length} frames of the video."
+        )
+    return stop
+
+
+def generate_frame_range(
+        parsed_motion_tree: MotionTree,
+        temporary_directory: Optional[Path],
+        start: int = 0,
+        stop: Optional[int] = None,
+        view: Optional[PreviewView] = None,
+        extension: str = ".png"
+) -> Tuple[List[FrameInfo], int]:
+    # The frames that need to be drawn for the indices from `start` up to
+    # `stop` (the end of the video, if it's None), which is returned as well.
+    # That includes the frame that's held into `start`, if it isn't drawn
+    # itself. Finding them takes as long as the number of ranges to search
+    # through, rather than the index that's searched for. With a `view`, the
+    # frames and indices are those of the preview. Frames that are saved are
+    # given files with the extension of their format.
+    ranges, video_length = drawn_ranges(parsed_motion_tree)
+    if view is not None:
+        ranges, video_length = view.resample(ranges, video_length)
+    stop = _check_frame_range(start, stop, video_length)
+
+    position = bisect.bisect_right([range_.start for range_ in ranges], start) - 1
+    frames = [FrameInfo(min(start, ranges[position].stop - 1), temporary_directory, extension)]
+    for range_ in itertools.islice(ranges, position, None):
+        if range_.start >= stop:
+            break
+        for index in range(max(range_.start, start + 1), min(range_.stop, stop)):
+            frames.append(FrameInfo(index, temporary_directory, extension))
+
+    return frames, stop
+
+
+def generate_frames(
+        parsed_motion_tree: MotionTree,
+        temporary_directory: Optional[Path]
+) -> Tuple[List[FrameInfo], int]:
+    frames, video_length = generate_frame_range(parsed_motion_tree, temporary_directory)
+    return frames, video_length
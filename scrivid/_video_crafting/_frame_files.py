@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+from typing import TYPE_CHECKING
+
+from PIL import Image
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+    from pathlib import Path
+    from typing import Deque, Optional, Tuple
+
+
+# The name that Pillow gives each format that frames can be saved in. Raw
+# frames are saved as they're drawn, with three bytes per pixel and nothing
+# else, so Pillow isn't needed for them.
+FORMATS = {
+    "bmp": "BMP",
+    "png": "PNG",
+    "ppm": "PPM",
+    "raw": None,
+}
+
+# Compressing and writing frames mostly happens outside of the GIL, so it
+# runs alongside drawing.
+_THREADS = min(4, os.cpu_count() or 1)
+_QUEUED_FRAMES_PER_THREAD = 2
+
+
+class FrameWriter:
+    """
+    Saves frames in the given format from a pool of threads, so that drawing
+    doesn't wait on compressing them, or on the filesystem. Only a few frames
+    are waiting to be saved at once, after which drawing waits on the oldest
+    of them, so memory use stays the same however far ahead drawing gets.
+
+    Each frame is handed over as its raw RGB buffer, which is a copy of the
+    canvas it was drawn on, so the canvas can be drawn on again straight away.
+    """
+
+    __slots__ = ("_compress_level", "_executor", "_format", "_pending", "_window_size")
+
+    _executor: Optional[ThreadPoolExecutor]
+    _pending: Deque[Future]
+
+    def __init__(self, frame_format: str, compress_level: Optional[int], window_size: Tuple[int, int]):
+        self._compress_level = compress_level
+        self._executor = None
+        self._format = frame_format
+        self._pending = deque()
+        self._window_size = window_size
+
+    def __repr__(self):
+        frame_format = self._format
+        compress_level = self._compress_level
+
+        return f"{self.__class__.__name__}({frame_format=}, {compress_level=})"
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=_THREADS, thread_name_prefix="scrivid-frame-writer")
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is not None:
+            # Something else went wrong, so the frames left to be saved won't
+            # be needed.
+            for future in self._pending:
+                future.cancel()
+            self._pending.clear()
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _encode(self, buffer: bytes) -> bytes:
+        if self._format == "raw":
+            return buffer
+
+        with io.BytesIO() as file:
+            self._save_image(buffer, file)
+            return file.getvalue()
+
+    def _save(self, buffer: bytes, path: Path):
+        if self._format == "raw":
+            path.write_bytes(buffer)
+        else:
+            self._save_image(buffer, path)
+
+    def _save_image(self, buffer: bytes, file):
+        options = {}
+        if self._compress_level is not None:
+            options["compress_level"] = self._compress_level
+        Image.frombytes("RGB", self._window_size, buffer).save(file, FORMATS[self._format], **options)
+
+    def _submit(self, function, *args) -> Future:
+        if len(self._pending) >= _THREADS * _QUEUED_FRAMES_PER_THREAD:
+            self._pending.popleft().result()
+
+        future = self._executor.submit(function, *args)
+        self._pending.append(future)
+        return future
+
+    def encode(self, buffer: bytes) -> Future:
+        # For frames that are kept in memory, the data of the file is the
+        # result of the future.
+        return self._submit(self._encode, buffer)
+
+    def flush(self):
+        # Waits until every frame has been saved, raising the first error
+        # from saving them, if there is one.
+        while self._pending:
+            self._pending.popleft().result()
+
+    def save(self, buffer: bytes, path: Path) -> Future:
+        # The future is done once the file is written.
+        return self._submit(self._save, buffer, path)
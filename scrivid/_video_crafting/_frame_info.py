@@ -5,42 +5,116 @@ from typing import TYPE_CHECKING
 from PIL import Image
 
 if TYPE_CHECKING:
+    from collections.abc import Hashable
     from pathlib import Path
-    from typing import Tuple
+    from typing import Dict, List, Optional, Tuple
+
+    Box = Tuple[int, int, int, int]
+
+
+_BACKGROUND = (255, 255, 255)
 
 
 class _FrameCanvas:
-    __slots__ = ("_canvas", "_pixel_canvas", "index")
+    # `contents` records what was last drawn on the canvas, as the state of
+    # every reference drawn by its ID. The next frame only has to redraw
+    # where that state has changed.
+    __slots__ = ("_canvas", "_pixel_canvas", "contents")
 
-    def __init__(self, index: int, window_size: Tuple[int, int]):
-        self._canvas = Image.new("RGB", window_size, (255, 255, 255))
+    contents: Dict[Hashable, tuple]
+
+    def __init__(self, window_size: Tuple[int, int]):
+        self._canvas = Image.new("RGB", window_size, _BACKGROUND)
         self._pixel_canvas = self._canvas.load()
-        self.index = index
+        self.contents = {}
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self._canvas.size
+
+    def clear(self):
+        self._canvas.paste(_BACKGROUND, (0, 0, *self._canvas.size))
+        self.contents = {}
+
+    def clear_region(self, box: Box):
+        # Leaves `contents` as it is, since the region is expected to be drawn
+        # over again straight after.
+        self._canvas.paste(_BACKGROUND, box)
 
-    def save(self, save_file: Path):
-        self._canvas.save(save_file, "PNG")
+    def copy_region(self, source: _FrameCanvas, box: Box):
+        self._canvas.paste(source._canvas.crop(box), box)
+
+    def close(self):
         self._canvas.close()
         self._canvas = None
         self._pixel_canvas = None
 
+    def paste(self, image: Image.Image, coordinates: Tuple[int, int]):
+        # Pillow clips the region to the canvas boundaries, so unlike
+        # `set_pixel`, negative coordinates are not drawn on the other side.
+        self._canvas.paste(image, coordinates)
+
+    def tobytes(self) -> bytes:
+        return self._canvas.tobytes()
+
     def set_pixel(self, coordinates: Tuple[int, int], pixel_value: Tuple[int, int, int]):
-        # TODO: Implement behaviour for when the coordinates has a negative
-        # value, to simply return instead of trying to draw it, since a 
-        # negative value draws on the other side, but not vice versa.
+        # The caller is expected to clip the coordinates to the canvas, since
+        # a negative value draws on the other side, but not vice versa.
         try:
             self._pixel_canvas.__setitem__(coordinates, pixel_value)
         except IndexError:
             pass
 
 
+class CanvasPool:
+    """
+    Hands out canvases for frames while they are being drawn, and keeps the
+    returned ones to be reused, so that only as many canvases exist as there
+    are frames being drawn at the same time.
+
+    A reused canvas still holds the last frame that was drawn on it, along
+    with its `contents`, so that only the parts that differ in the next frame
+    need to be drawn.
+    """
+
+    __slots__ = ("_available", "window_size")
+
+    _available: List[_FrameCanvas]
+    window_size: Tuple[int, int]
+
+    def __init__(self, window_size: Tuple[int, int]):
+        self._available = []
+        self.window_size = window_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def acquire(self) -> _FrameCanvas:
+        if not self._available:
+            return _FrameCanvas(self.window_size)
+
+        return self._available.pop()
+
+    def close(self):
+        for canvas in self._available:
+            canvas.close()
+        self._available.clear()
+
+    def release(self, canvas: _FrameCanvas):
+        self._available.append(canvas)
+
+
 class FrameInfo:
-    __slots__ = ("canvas", "index", "temp_dir")
+    __slots__ = ("extension", "index", "temp_dir")
 
-    def __init__(self, index: int, temp_dir: Path, window_size: Tuple[int, int]):
-        self.canvas = _FrameCanvas(index, window_size)
+    def __init__(self, index: int, temp_dir: Optional[Path], extension: str = ".png"):
+        self.extension = extension
         self.index = index
         self.temp_dir = temp_dir
 
     @property
     def save_file(self):
-        return self.temp_dir / f"{self.index:06d}.png"
+        return self.temp_dir / f"{self.index:06d}{self.extension}"
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+from ._static_layers import StaticLayers
+
+from .. import adjustments, properties
+
+import bisect
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ._preview import PreviewView
+    from ..abc import Adjustment
+    from .._file_objects.images import ImageReference
+    from .._separating_instructions import SeparatedInstructions
+
+    from collections.abc import Iterable
+    from typing import Iterator, List, Optional, Tuple
+
+
+_MERGE_SETTINGS = {"mode": properties.MergeMode.REVERSE_APPEND}
+
+
+def _invoke_adjustment_duration(index: int, adj: Adjustment):
+    # Assume that the `adj` has a 'duration' attribute.
+    duration = index - adj.activation_time
+    if duration > adj.duration:
+        return adj.duration
+    else:
+        return duration
+
+
+def _enact_adjustment(index: int, adj: Adjustment) -> Tuple[properties.Properties, bool]:
+    # Returns the change that the adjustment makes at `index`, and whether that
+    # change is final (it will be the same for every index after this one).
+    if type(adj) is adjustments.core.MoveAdjustment:
+        length = _invoke_adjustment_duration(index, adj)
+        return adj._enact(length), length >= adj.duration
+    else:
+        return adj._enact(), True
+
+
+class ReferenceState:
+    """
+    Carries the properties of one reference forward from frame to frame. The
+    reference is copied, so the instructions passed in are never modified, but
+    the copy shares the file object with the original so that it's only opened
+    once.
+    """
+
+    __slots__ = (
+        "_activation_times", "_adjustments", "_initial", "_next", "_pending", "_settled", "_view", "reference"
+    )
+
+    _activation_times: Tuple[int, ...]
+    _adjustments: Tuple[Adjustment, ...]
+    _initial: properties.Properties
+    _next: int
+    _pending: List[Adjustment]
+    _settled: properties.Properties
+    _view: Optional[PreviewView]
+    reference: ImageReference
+
+    def __init__(
+            self,
+            reference: ImageReference,
+            adjustments_: Iterable[Adjustment],
+            view: Optional[PreviewView] = None
+    ):
+        self._adjustments = tuple(adjustments_)
+        self._activation_times = tuple(adj.activation_time for adj in self._adjustments)
+        self._initial = reference._properties
+        self._view = view
+        self.reference = reference.copy(reference.ID)
+        self.reset()
+
+    def _set_properties(self, properties_: properties.Properties):
+        if self._view is not None:
+            properties_ = self._view.view(properties_)
+        self.reference._properties = properties_
+
+    def reset(self):
+        self._next = 0
+        self._pending = []
+        self._settled = self._initial
+        self._set_properties(self._initial)
+
+    def step(self, index: int):
+        # The adjustments are sorted by their activation time, so the ones that
+        # have been activated since the last step are found by bisecting, no
+        # matter how far ahead `index` is.
+        activated = bisect.bisect_right(self._activation_times, index, self._next)
+        self._pending.extend(self._adjustments[self._next:activated])
+        self._next = activated
+
+        if not self._pending:
+            return
+
+        # Adjustments are applied in the same order as they're sorted. The
+        # leading ones whose change is final are folded into `_settled`, so
+        # they're never applied again on the frames after this one.
+        current = self._settled
+        settled_count = 0
+        for position, adj in enumerate(self._pending):
+            change, is_final = _enact_adjustment(index, adj)
+            current = current.merge(change, **_MERGE_SETTINGS)
+
+            if is_final and settled_count == position:
+                self._settled = current
+                settled_count += 1
+
+        del self._pending[:settled_count]
+        self._set_properties(current)
+
+
+class FrameStates:
+    """
+    Steps the state of every reference forward, one frame index at a time.
+    Only the adjustments that are active at the index are applied, instead of
+    replaying every adjustment from the beginning of the video.
+
+    With a `view`, the indices are those of the preview, and the references
+    are drawn as they are in it.
+    """
+
+    __slots__ = ("_index", "_opened", "_states", "_view", "static_layers")
+
+    def __init__(self, split_instructions: SeparatedInstructions, view: Optional[PreviewView] = None):
+        self._index = -1
+        self._opened = []
+        self._states = [
+            ReferenceState(reference, split_instructions.adjustments.get(ID, ()), view)
+            for ID, reference in split_instructions.references.items()
+        ]
+        self._view = view
+        self.static_layers = StaticLayers(split_instructions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        # Only close the files that were opened while drawing, since the
+        # others were opened by the caller.
+        for reference in self._opened:
+            reference.close()
+        self._opened.clear()
+        self.static_layers.close()
+
+    def open(self, reference: ImageReference):
+        if reference.is_opened:
+            return
+        reference.open()
+        self._opened.append(reference)
+
+    @property
+    def index(self) -> int:
+        """ The index of the frame of the video that the states are at. """
+        return self._index
+
+    def references(self) -> Iterator[ImageReference]:
+        for state in self._states:
+            yield state.reference
+
+    def step(self, index: int):
+        if self._view is not None:
+            index = self._view.source_index(index)
+
+        if index < self._index:
+            for state in self._states:
+                state.reset()
+
+        for state in self._states:
+            state.step(index)
+
+        self._index = index
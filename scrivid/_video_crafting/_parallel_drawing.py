@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+from ._frame_drawing import create_frame, draw_frames
+from ._frame_info import CanvasPool
+from ._frame_states import FrameStates
+from ._progress import check_cancelled
+from ._render_stats import RenderStats
+
+from .. import caches, errors
+from .._utils import tracing
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ._frame_info import FrameInfo
+    from ._preview import PreviewView
+    from ._scratch import Scratch
+    from .._separating_instructions import SeparatedInstructions
+
+    from multiprocessing.synchronize import Event
+    from pathlib import Path
+    from typing import Iterator, List, Optional, Tuple
+
+
+# Roughly how many bytes of frame buffers a single task sends back at a time.
+_BYTES_PER_TASK = 32 * 1024 * 1024
+_FRAMES_PER_TASK = 16
+
+# Set up once in every worker process by `_initialize_worker`.
+_worker_state: Optional[Tuple[FrameStates, CanvasPool, Optional[Event]]] = None
+
+
+def _initialize_worker(
+        separated_instructions: SeparatedInstructions,
+        window_size: Tuple[int, int],
+        view: Optional[PreviewView],
+        trace: bool,
+        cancelled: Optional[Event],
+        frame_cache: Tuple[Optional[Path], int]
+):
+    # Each worker steps its own copy of the instructions forward, so only the
+    # indices of the frames need to be sent for every task. The event that
+    # cancels compiling the video can only be shared with a process as it's
+    # started, rather than with every task.
+    global _worker_state
+    _worker_state = (FrameStates(separated_instructions, view), CanvasPool(window_size), cancelled)
+    use_frame_cache(frame_cache)
+
+    # A forked worker starts with the tracer of the process that started it,
+    # along with everything recorded in it so far.
+    if trace:
+        tracing.start()
+    else:
+        tracing.stop()
+
+
+def _draw_frames(
+        frames: List[FrameInfo],
+        save: Optional[Scratch],
+        keep_stats: bool
+) -> Tuple[List[Optional[bytes]], Optional[RenderStats], Optional[List[dict]]]:
+    # The statistics and trace events of drawing the frames are sent back with
+    # them, to be added to those of the process that's compiling the video.
+    frame_states, canvas_pool, cancelled = _worker_state
+    stats = cache_infos = None
+    if keep_stats:
+        stats = RenderStats()
+        cache_infos = RenderStats._cache_infos()
+
+    # Cancelling is checked between every frame, rather than every task, so
+    # that the pool can be shut down without waiting on the tasks in it. Every
+    # frame has been saved by the time the task returns.
+    if save is not None:
+        with save._frame_writer(canvas_pool.window_size) as frame_writer:
+            for frame in frames:
+                check_cancelled(cancelled)
+                create_frame(frame, frame_states, canvas_pool, frame_writer, stats)
+        buffers = [None] * len(frames)
+    else:
+        buffers = []
+        for _, buffer in draw_frames(frames, frame_states, canvas_pool, stats):
+            buffers.append(buffer)
+            check_cancelled(cancelled)
+
+    if stats is not None:
+        stats._count_caches(cache_infos)
+    events = None if tracing.tracer is None else tracing.tracer.take_events()
+    return buffers, stats, events
+
+
+def frame_cache_settings() -> Tuple[Optional[Path], int]:
+    # The frames that a process draws are kept in the same directory as those
+    # of the process that started it, even if it was started without a copy
+    # of its memory (see `use_frame_cache`).
+    return caches.frames.directory, caches.frames.budget
+
+
+def use_frame_cache(settings: Tuple[Optional[Path], int]):
+    caches.frames.directory, caches.frames.budget = settings
+
+
+def check_workers(workers: Optional[int]):
+    if workers is None:
+        return
+    if not isinstance(workers, int) or isinstance(workers, bool) or workers < 1:
+        raise errors.TypeError("`workers` must be a positive integer.")
+
+
+def _frames_per_task(window_size: Tuple[int, int], save: Optional[Scratch]) -> int:
+    if save is not None:
+        return _FRAMES_PER_TASK
+    frame_size = window_size[0] * window_size[1] * 3
+    return max(1, min(_FRAMES_PER_TASK, _BYTES_PER_TASK // frame_size))
+
+
+def future_result(future):
+    try:
+        return future.result()
+    except errors.ScrividException:
+        raise
+    except BrokenProcessPool as exc:
+        # A worker process died (such as from running out of memory), so the
+        # frames it was drawing will never arrive.
+        raise errors.InternalError(exc)
+    except Exception as exc:
+        raise errors.InternalError(exc)
+
+
+def draw_frames_in_parallel(
+        frames: List[FrameInfo],
+        separated_instructions: SeparatedInstructions,
+        window_size: Tuple[int, int],
+        workers: int,
+        *,
+        save: Optional[Scratch],
+        view: Optional[PreviewView] = None,
+        stats: Optional[RenderStats] = None,
+        cancelled: Optional[Event] = None
+) -> Iterator[Tuple[FrameInfo, Optional[bytes]]]:
+    """
+    Draws the frames across a pool of worker processes, yielding each one in
+    order with its raw RGB buffer. If `save` is given, the frames are saved to
+    their files by the workers instead, in the format that it's set to, and
+    the buffer is None. The statistics of the workers are added to `stats`, if
+    it's given. The workers stop drawing once `cancelled` is set, raising
+    RenderCancelled.
+    """
+    def results(task, future):
+        buffers, task_stats, events = future_result(future)
+        if task_stats is not None:
+            stats._merge(task_stats)
+        if events:
+            tracing.tracer.extend(events)
+        return zip(task, buffers)
+
+    frames_per_task = _frames_per_task(window_size, save)
+    tasks = (frames[start:start + frames_per_task] for start in range(0, len(frames), frames_per_task))
+    pending = deque()
+
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_initialize_worker,
+        initargs=(
+            separated_instructions, window_size, view, tracing.tracer is not None, cancelled, frame_cache_settings()
+        )
+    )
+    try:
+        for task in tasks:
+            pending.append((task, executor.submit(_draw_frames, task, save, stats is not None)))
+
+            # Only a few tasks are queued ahead of the one that's next in
+            # order, so that finished frames don't pile up in memory.
+            if len(pending) < 2 * workers:
+                continue
+
+            task, future = pending.popleft()
+            yield from results(task, future)
+
+        while pending:
+            task, future = pending.popleft()
+            yield from results(task, future)
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
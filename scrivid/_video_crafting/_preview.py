@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+from .. import errors, properties
+from ..metadata import Metadata
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import List, Optional, Tuple, Union
+
+
+EXCLUDED = properties.EXCLUDED
+
+
+def _ceil_division(a: int, b: int) -> int:
+    return -(-a // b)
+
+
+class Preview:
+    """
+    The settings for compiling a preview of a video, which is drawn smaller
+    and at a lower frame rate than the video itself, and encoded with the
+    "draft" encoder profile. Each frame of the preview shows what the video
+    shows at the same point in time, so the timing of every adjustment is
+    kept.
+
+    :param scale: `(float)` The fraction of `Metadata.window_size` that the
+        preview is drawn at. Defaults to 0.5.
+    :param frame_rate: `(int)` The frame rate of the preview, which can't be
+        more than that of the video. Defaults to half of it.
+    """
+
+    __slots__ = ("frame_rate", "scale")
+
+    def __init__(self, *, scale: Union[float, int] = 0.5, frame_rate: Optional[int] = None):
+        self.frame_rate = frame_rate
+        self.scale = scale
+
+    def __repr__(self):
+        scale = self.scale
+        frame_rate = self.frame_rate
+
+        return f"{self.__class__.__name__}({scale=}, {frame_rate=})"
+
+    def _validate(self, metadata: Metadata) -> PreviewView:
+        scale = self.scale
+        if not isinstance(scale, (float, int)) or isinstance(scale, bool) or not 0 < scale <= 1:
+            raise errors.TypeError("`Preview.scale` must be a number above 0, and no more than 1.")
+
+        frame_rate = self.frame_rate
+        if frame_rate is None:
+            frame_rate = max(1, metadata.frame_rate // 2)
+        elif (
+                not isinstance(frame_rate, int) or isinstance(frame_rate, bool)
+                or not 0 < frame_rate <= metadata.frame_rate
+        ):
+            raise errors.TypeError("`Preview.frame_rate` must be a positive integer, and no more than the video's.")
+
+        return PreviewView(scale, frame_rate, metadata)
+
+
+class PreviewView:
+    # Maps the frames and references of a video onto its preview.
+    __slots__ = ("_scale", "metadata", "source_frame_rate")
+
+    _scale: Union[float, int]
+    metadata: Metadata
+    source_frame_rate: int
+
+    def __init__(self, scale: Union[float, int], frame_rate: int, metadata: Metadata):
+        self._scale = scale
+        self.source_frame_rate = metadata.frame_rate
+
+        # yuv420p needs both dimensions to be even.
+        width = max(2, int(metadata.window_width * scale) // 2 * 2)
+        height = max(2, int(metadata.window_height * scale) // 2 * 2)
+        self.metadata = Metadata(
+            frame_rate=frame_rate,
+            save_location=metadata.save_location,
+            video_name=metadata.video_name,
+            window_size=(width, height),
+            # Previews are encoded as fast as possible, since they're thrown
+            # away.
+            encoder_profile="draft"
+        )
+
+    def _first_index_at(self, source_index: int) -> int:
+        # The first index of the preview that shows the video at or after
+        # `source_index`.
+        return _ceil_division(source_index * self.metadata.frame_rate, self.source_frame_rate)
+
+    def resample(self, ranges: List[range], video_length: int) -> Tuple[List[range], int]:
+        # Maps the ranges of the frames that are drawn onto the preview. A
+        # frame of the preview is drawn if any frame of the video was drawn
+        # since the one before it, so that it shows the latest of them.
+        preview_length = max(1, self._first_index_at(video_length))
+        preview_ranges = []
+
+        for range_ in ranges:
+            start = self._first_index_at(range_.start)
+            stop = min(self._first_index_at(range_.stop - 1) + 1, preview_length)
+            if start >= stop:
+                continue
+
+            if preview_ranges and preview_ranges[-1].stop >= start:
+                preview_ranges[-1] = range(preview_ranges[-1].start, max(stop, preview_ranges[-1].stop))
+            else:
+                preview_ranges.append(range(start, stop))
+
+        return preview_ranges, preview_length
+
+    def source_index(self, index: int) -> int:
+        # The index of the frame of the video that's shown at the same time as
+        # the frame of the preview at `index`.
+        return index * self.source_frame_rate // self.metadata.frame_rate
+
+    def view(self, properties_: properties.Properties) -> properties.Properties:
+        # The properties that a reference is drawn with in the preview.
+        scale = self._scale
+        reference_scale = 1 if properties_.scale is EXCLUDED else properties_.scale
+
+        return properties.Properties(
+            layer=properties_.layer,
+            scale=reference_scale * scale,
+            visibility=properties_.visibility,
+            x=properties_.x if properties_.x is EXCLUDED else round(properties_.x * scale),
+            y=properties_.y if properties_.y is EXCLUDED else round(properties_.y * scale)
+        )
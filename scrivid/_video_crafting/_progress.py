@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+from .. import errors
+
+import multiprocessing
+import subprocess
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from multiprocessing.synchronize import Event
+    from typing import Callable, Optional, Tuple
+
+    PROGRESS_CALLABLE = Callable[["RenderProgress"], None]
+
+
+# How often (in seconds) ffmpeg, or the processes compiling segments, are
+# checked on while they're waited for.
+POLL_INTERVAL = 0.1
+
+
+def check_cancelled(cancelled: Optional[Event]):
+    if cancelled is not None and cancelled.is_set():
+        raise errors.RenderCancelled()
+
+
+def check_progress(progress: Optional[PROGRESS_CALLABLE], cancel: Optional[CancelToken]):
+    if progress is not None and not callable(progress):
+        raise errors.TypeError("`progress` must be callable.")
+    if cancel is not None and not isinstance(cancel, CancelToken):
+        raise errors.TypeError("`cancel` must be an instance of CancelToken.")
+
+
+class CancelToken:
+    """
+    Cancels a call to `compile_video` that it's passed to, from another thread
+    or from the progress callback. The video stops being compiled before the
+    next frame is drawn, ffmpeg is stopped, the scratch directory (see
+    Scratch) and the unfinished video are removed, and `compile_video` raises
+    RenderCancelled. A resumable scratch directory is kept instead, to pick up
+    from later.
+
+    A token can't be used again once it's cancelled.
+    """
+
+    __slots__ = ("_event",)
+
+    _event: Event
+
+    def __init__(self):
+        # The processes that draw frames check it as well, so it's shared
+        # between processes.
+        self._event = multiprocessing.Event()
+
+    def __repr__(self):
+        cancelled = self.cancelled
+
+        return f"{self.__class__.__name__}({cancelled=})"
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+
+
+class RenderProgress:
+    """
+    How far along compiling a video is, as passed to the `progress` callback
+    of `compile_video`.
+
+    :param stage: `(str)` The stage of compiling the video that's under way,
+        named the same as in `RenderStats.stages`.
+    :param frames_rendered: `(int)` The number of frames of the video (or
+        preview) that are ready to be encoded, including those held from the
+        frame before them.
+    :param total_frames: `(int)` The number of frames being compiled, from
+        `start` up to `stop`.
+    :param encoded_frames: `(int)` The number of frames that ffmpeg has
+        reported encoding so far.
+    """
+
+    __slots__ = ("encoded_frames", "frames_rendered", "stage", "total_frames")
+
+    def __init__(self, *, stage: str, frames_rendered: int, total_frames: int, encoded_frames: int):
+        self.encoded_frames = encoded_frames
+        self.frames_rendered = frames_rendered
+        self.stage = stage
+        self.total_frames = total_frames
+
+    def __repr__(self):
+        stage = self.stage
+        frames_rendered = self.frames_rendered
+        total_frames = self.total_frames
+        encoded_frames = self.encoded_frames
+
+        return f"{self.__class__.__name__}({stage=}, {frames_rendered=}, {total_frames=}, {encoded_frames=})"
+
+
+class ProgressReporter:
+    # Keeps track of how far along compiling a video is, for the callback, and
+    # stops compiling it once it's cancelled. Everything is reported from the
+    # thread compiling the video, including what ffmpeg has encoded, which is
+    # read by another thread.
+    __slots__ = (
+        "_callback", "_encoded_frames", "_frames_rendered", "_reported", "_stage", "_total_frames", "cancelled"
+    )
+
+    _callback: Optional[PROGRESS_CALLABLE]
+    _reported: Optional[tuple]
+    cancelled: Optional[Event]
+
+    def __init__(self, callback: Optional[PROGRESS_CALLABLE], cancelled: Optional[Event]):
+        self._callback = callback
+        self._encoded_frames = 0
+        self._frames_rendered = 0
+        self._reported = None
+        self._stage = None
+        self._total_frames = 0
+        self.cancelled = cancelled
+
+    def __repr__(self):
+        stage = self._stage
+        cancelled = self.cancelled
+
+        return f"{self.__class__.__name__}({stage=}, {cancelled=})"
+
+    def _state(self) -> tuple:
+        return self._stage, self._frames_rendered, self._total_frames, self._encoded_frames
+
+    def begin(self, total_frames: int):
+        self._encoded_frames = 0
+        self._frames_rendered = 0
+        self._total_frames = total_frames
+
+    def check(self):
+        check_cancelled(self.cancelled)
+
+    def encoded(self, frames: int):
+        self._encoded_frames = frames
+
+    def enter(self, stage: str):
+        self._stage = stage
+        self.report()
+
+    def poll(self):
+        # Reports the progress only if it has changed since it was last
+        # reported, such as when ffmpeg has encoded more frames.
+        if self._state() == self._reported:
+            self.check()
+        else:
+            self.report()
+
+    def rendered(self, frames: int):
+        self._frames_rendered = frames
+        self.report()
+
+    @property
+    def reads_ffmpeg(self) -> bool:
+        # Whether ffmpeg should write what it has encoded so far to stdout.
+        return self._callback is not None
+
+    def report(self):
+        self._reported = state = self._state()
+        if self._callback is not None:
+            stage, frames_rendered, total_frames, encoded_frames = state
+            self._callback(RenderProgress(
+                stage=stage, frames_rendered=frames_rendered, total_frames=total_frames, encoded_frames=encoded_frames
+            ))
+        # The callback is allowed to cancel compiling the video itself.
+        self.check()
+
+    def update(self, frames_rendered: int, encoded_frames: int):
+        # For the progress made by other processes.
+        self._encoded_frames = encoded_frames
+        self._frames_rendered = frames_rendered
+        self.poll()
+
+    def wait(self, process: subprocess.Popen):
+        # Waits for ffmpeg to exit, while reporting what it has encoded. If
+        # there's nothing to report or cancel, it's simply waited for.
+        if not self.watching:
+            process.wait()
+            return
+
+        while True:
+            try:
+                process.wait(timeout=POLL_INTERVAL)
+            except subprocess.TimeoutExpired:
+                self.poll()
+            else:
+                return
+
+    @property
+    def watching(self) -> bool:
+        return self._callback is not None or self.cancelled is not None
+
+
+class SharedProgress:
+    # The callback of a process that compiles a segment, which passes its
+    # progress on to the process compiling the video, through memory that's
+    # shared with it. Each segment has a pair of counts in it.
+    __slots__ = ("_counts", "_number")
+
+    def __init__(self, counts, number: int):
+        self._counts = counts
+        self._number = number
+
+    def __repr__(self):
+        number = self._number
+
+        return f"{self.__class__.__name__}({number=})"
+
+    def __call__(self, progress: RenderProgress):
+        self._counts[2 * self._number] = progress.frames_rendered
+        self._counts[2 * self._number + 1] = progress.encoded_frames
+
+    def fill(self, frames: int):
+        # For a segment that was compiled by an earlier attempt at compiling
+        # the video (see Checkpoint), which is counted as done.
+        self._counts[2 * self._number] = self._counts[2 * self._number + 1] = frames
+
+    @staticmethod
+    def allocate(segments: int):
+        return multiprocessing.RawArray("q", 2 * segments)
+
+    @staticmethod
+    def totals(counts) -> Tuple[int, int]:
+        # The number of frames rendered and encoded, across every segment.
+        return sum(counts[0::2]), sum(counts[1::2])
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+from .. import caches
+from .._utils import tracing
+
+import contextlib
+import time
+from typing import TYPE_CHECKING
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the time of child processes (such as
+    # ffmpeg) isn't counted.
+    resource = None
+
+if TYPE_CHECKING:
+    from typing import ContextManager, Dict, Optional
+
+    CacheInfo = caches.CacheInfo
+
+
+_CACHES = {
+    "decoded_images": caches.decoded_images,
+    "frames": caches.frames,
+    "segments": caches.segments,
+    "sprites": caches.sprites,
+}
+
+
+def _cpu_time() -> float:
+    # The CPU time of the calling thread, along with that of every child
+    # process that has finished (and been waited for) so far.
+    cpu_time = time.thread_time()
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu_time += usage.ru_utime + usage.ru_stime
+    return cpu_time
+
+
+def measure(stats: Optional[RenderStats], name: str) -> ContextManager[None]:
+    # Times the stage, if the statistics are being kept.
+    if stats is None:
+        return contextlib.nullcontext()
+    return stats._measure(name)
+
+
+class _Measurement:
+    # Times a stage. Unlike a generator-based context manager, this doesn't
+    # touch the exceptions that pass through it, which may be frozen.
+    __slots__ = ("_cpu_time", "_name", "_stats", "_wall_time")
+
+    def __init__(self, stats: RenderStats, name: str):
+        self._name = name
+        self._stats = stats
+
+    def __enter__(self):
+        self._wall_time = tracing.now()
+        self._cpu_time = _cpu_time()
+
+    def __exit__(self, *_):
+        wall_time = tracing.now()
+        self._stats._add_stage(self._name, (wall_time - self._wall_time) / 1_000_000, _cpu_time() - self._cpu_time)
+
+        # Every stage is also a span of the trace, if one is being recorded.
+        if tracing.tracer is not None:
+            tracing.tracer.add(self._name, "stage", self._wall_time, wall_time)
+
+
+class StageStats:
+    """
+    The time spent in one stage of compiling a video.
+
+    :param wall_time: `(float)` The number of seconds that passed while in the
+        stage.
+    :param cpu_time: `(float)` The number of seconds of CPU time used by the
+        stage, including that of the processes it waited on (such as ffmpeg).
+    """
+
+    __slots__ = ("cpu_time", "wall_time")
+
+    def __init__(self, *, wall_time: float = 0.0, cpu_time: float = 0.0):
+        self.cpu_time = cpu_time
+        self.wall_time = wall_time
+
+    def __repr__(self):
+        wall_time = self.wall_time
+        cpu_time = self.cpu_time
+
+        return f"{self.__class__.__name__}({wall_time=}, {cpu_time=})"
+
+
+class RenderStats:
+    """
+    The statistics of compiling a video, as returned by `compile_video`.
+
+    `stages` holds the time spent in each stage, by its name, in the order
+    that they were first entered. The stages are "separate_instructions",
+    "motion_tree.parse", "generate_frames", "draw_frames", "save_frames"
+    (only when frames are saved as files), "fill_undrawn_frames" (likewise),
+    "stitch_video" and "join_segments" (only with segments). The frames drawn
+    by worker processes, or by segments, are timed in those processes, and
+    their times are added together.
+
+    `caches` holds the lookups made in each of the caches from the `caches`
+    module while compiling the video, with their size and budget at the end.
+    The size of a cache on disk is as of the last time that it was looked
+    through, along with what was written to it since (see its `info` method
+    for the size of everything in it).
+
+    :param wall_time: `(float)` The number of seconds that compiling the video
+        took, from start to finish.
+    :param frames_drawn: `(int)` The number of frames that were drawn, or read
+        back from `caches.frames`.
+    :param frames_held: `(int)` The number of frames that were held from the
+        frame before them, instead of being drawn.
+    :param pixels_blitted: `(int)` The number of pixels that were copied onto
+        a canvas, from an image or from the base surface of the static layers.
+    """
+
+    __slots__ = ("caches", "frames_drawn", "frames_held", "pixels_blitted", "stages", "wall_time")
+
+    caches: Dict[str, CacheInfo]
+    stages: Dict[str, StageStats]
+
+    def __init__(self):
+        self.caches = {}
+        self.frames_drawn = 0
+        self.frames_held = 0
+        self.pixels_blitted = 0
+        self.stages = {}
+        self.wall_time = 0.0
+
+    def __repr__(self):
+        wall_time = self.wall_time
+        frames_drawn = self.frames_drawn
+        frames_held = self.frames_held
+        pixels_blitted = self.pixels_blitted
+
+        return f"{self.__class__.__name__}({wall_time=}, {frames_drawn=}, {frames_held=}, {pixels_blitted=})"
+
+    def _add_stage(self, name: str, wall_time: float, cpu_time: float):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = StageStats()
+        stage.wall_time += wall_time
+        stage.cpu_time += cpu_time
+
+    def _add_lookups(self, name: str, hits: int, misses: int, evictions: int, latest: CacheInfo):
+        counted = self.caches.get(name)
+        if counted is not None:
+            hits += counted.hits
+            misses += counted.misses
+            evictions += counted.evictions
+        self.caches[name] = caches.CacheInfo(
+            budget=latest.budget, evictions=evictions, hits=hits, misses=misses, size=latest.size
+        )
+
+    @staticmethod
+    def _cache_infos() -> Dict[str, CacheInfo]:
+        return {name: cache._statistics() for name, cache in _CACHES.items()}
+
+    def _count_caches(self, before: Dict[str, CacheInfo]):
+        # Adds the lookups made since `before`, from `_cache_infos`.
+        for name, after in self._cache_infos().items():
+            self._add_lookups(
+                name,
+                after.hits - before[name].hits,
+                after.misses - before[name].misses,
+                after.evictions - before[name].evictions,
+                after
+            )
+
+    def _merge(self, other: RenderStats):
+        # Adds the statistics from another process into these. The size and
+        # budget of each cache are kept as they are in this process, if it
+        # has used the cache.
+        for name, stage in other.stages.items():
+            self._add_stage(name, stage.wall_time, stage.cpu_time)
+
+        for name, info in other.caches.items():
+            self._add_lookups(name, info.hits, info.misses, info.evictions, self.caches.get(name, info))
+
+        self.frames_drawn += other.frames_drawn
+        self.frames_held += other.frames_held
+        self.pixels_blitted += other.pixels_blitted
+
+    def _measure(self, name: str) -> _Measurement:
+        return _Measurement(self, name)
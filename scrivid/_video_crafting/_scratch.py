@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+from ._checkpoint import Checkpoint, NoCheckpoint
+from ._frame_files import FORMATS, FrameWriter
+
+from .. import errors
+
+from pathlib import Path, PurePath
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ..metadata import Metadata
+
+    from typing import Optional, Tuple, Union
+
+
+_PREFIX = ".scrivid-cache-"
+_RESUMABLE_PREFIX = ".scrivid-resume-"
+
+
+def check_scratch(scratch: Union[None, str, Path, Scratch]) -> Scratch:
+    if scratch is None:
+        return Scratch()
+    if isinstance(scratch, (str, PurePath)):
+        scratch = Scratch(scratch)
+    elif not isinstance(scratch, Scratch):
+        raise errors.TypeError("`scratch` must be a path, or an instance of Scratch.")
+
+    scratch._validate()
+    return scratch
+
+
+def check_resumable(scratch: Scratch, stream: bool, segments: Optional[int]):
+    # Only the frames that are saved as files, and segments, outlast the
+    # process compiling them.
+    if not scratch.resumable or segments is not None:
+        return
+    if stream:
+        raise errors.ConflictingAttributesError(
+            first_name="stream", first_value=stream, second_name="resumable", second_value=scratch.resumable
+        )
+    if scratch.in_memory:
+        raise errors.ConflictingAttributesError(
+            first_name="in_memory", first_value=scratch.in_memory, second_name="resumable",
+            second_value=scratch.resumable
+        )
+
+
+class Scratch:
+    """
+    Where the intermediate files of compiling a video are kept, which are the
+    frames saved with `stream=False`, and the segments. Each call to
+    `compile_video` creates a directory of its own inside of the location,
+    named `.scrivid-cache-` followed by random characters, and removes it once
+    it's done. Any number of videos can be compiled into the same folder at
+    once, and a directory left behind by a crash doesn't get in the way of the
+    next video.
+
+    :param location: `(str | Path)` The folder that the directory is created
+        in. A folder on tmpfs (such as `/dev/shm`) or a fast local drive keeps
+        the frames off of a slow or networked drive that the video is saved
+        to. Defaults to `Metadata.save_location`.
+    :param in_memory: `(bool)` Whether the frames saved with `stream=False`
+        are kept in memory (in `frame_format`), instead of as files, and piped
+        into ffmpeg from there. Every frame that's drawn stays in memory until the
+        video is encoded, so this is meant for short videos. Segments are
+        still saved as files. Defaults to False.
+    :param frame_format: `(str)` The format that the frames are saved in:
+        "png", "bmp" or "ppm" (which aren't compressed at all), or "raw" (the
+        RGB values of every pixel, and nothing else). Frames are saved from a
+        pool of threads whatever the format, but the uncompressed formats take
+        the least time to save. Defaults to "png".
+    :param compress_level: `(int)` The zlib compression level of PNG frames,
+        from 0 (none) to 9 (the smallest files). Defaults to Pillow's own
+        default of 6.
+    :param resumable: `(bool)` Whether the video can be picked up from where
+        it stopped, if compiling it fails or is cancelled. The directory is
+        named `.scrivid-resume-` followed by the name of the video instead,
+        and is kept until the video is compiled, along with a manifest of the
+        frames (or segments) finished in it. Compiling the video again, from
+        the same instructions and metadata, and with the same settings, only
+        draws what's missing. Anything else starts it over. Only frames saved
+        as files (with `stream=False`), and segments, can be resumed; a
+        streamed video that's too short to split is compiled as a single
+        segment. Only one render at a time can compile the same video into
+        the same location, and another one raises `errors.RenderInProgress`.
+        Defaults to False.
+    """
+
+    __slots__ = ("_fingerprint", "compress_level", "frame_format", "in_memory", "location", "resumable")
+
+    _fingerprint: Optional[str]
+
+    def __init__(
+            self,
+            location: Optional[Union[str, Path]] = None,
+            *,
+            in_memory: bool = False,
+            frame_format: str = "png",
+            compress_level: Optional[int] = None,
+            resumable: bool = False
+    ):
+        if isinstance(location, str):
+            location = Path(location)
+        self._fingerprint = None
+        self.compress_level = compress_level
+        self.frame_format = frame_format
+        self.in_memory = in_memory
+        self.location = location
+        self.resumable = resumable
+
+    def __repr__(self):
+        location = self.location
+        in_memory = self.in_memory
+        frame_format = self.frame_format
+        compress_level = self.compress_level
+        resumable = self.resumable
+
+        return (
+            f"{self.__class__.__name__}({location=}, {in_memory=}, {frame_format=}, {compress_level=}, "
+            f"{resumable=})"
+        )
+
+    def _directory(self, metadata: Metadata, settings: dict) -> Union[Checkpoint, NoCheckpoint]:
+        # The settings are those that what's saved in a resumable directory
+        # was compiled with, besides the instructions and the metadata.
+        location = metadata.save_location if self.location is None else self.location
+        if self._fingerprint is None:
+            return NoCheckpoint(location, _PREFIX)
+
+        settings = {**settings, "frame_format": self.frame_format}
+        return Checkpoint(location / f"{_RESUMABLE_PREFIX}{metadata.video_name}", self._fingerprint, metadata, settings)
+
+    @property
+    def _extension(self) -> str:
+        return f".{self.frame_format}"
+
+    def _frame_writer(self, window_size: Tuple[int, int]) -> FrameWriter:
+        return FrameWriter(self.frame_format, self.compress_level, window_size)
+
+    def _resuming(self, fingerprint: str) -> Scratch:
+        # The same settings, for resuming the instructions with the given
+        # fingerprint (see Checkpoint).
+        scratch = self._within(self.location)
+        scratch.resumable = True
+        scratch._fingerprint = fingerprint
+        return scratch
+
+    def _validate(self):
+        if self.location is not None and not isinstance(self.location, PurePath):
+            raise errors.TypeError("`Scratch.location` must be a path.")
+        if not isinstance(self.in_memory, bool):
+            raise errors.TypeError("`Scratch.in_memory` must be a boolean.")
+        if not isinstance(self.resumable, bool):
+            raise errors.TypeError("`Scratch.resumable` must be a boolean.")
+        if not isinstance(self.frame_format, str) or self.frame_format not in FORMATS:
+            raise errors.TypeError(f"`Scratch.frame_format` must be one of: {', '.join(FORMATS)}.")
+
+        compress_level = self.compress_level
+        if compress_level is None:
+            return
+        if self.frame_format != "png":
+            raise errors.ConflictingAttributesError(
+                first_name="frame_format", first_value=self.frame_format,
+                second_name="compress_level", second_value=compress_level
+            )
+        if not isinstance(compress_level, int) or isinstance(compress_level, bool) or not 0 <= compress_level <= 9:
+            raise errors.TypeError("`Scratch.compress_level` must be an integer from 0 to 9.")
+
+    def _within(self, location: Optional[Path]) -> Scratch:
+        # The same settings, in another location, such as that of a segment.
+        # Segments are resumed as a whole, so what's inside of them isn't
+        # resumable by itself.
+        return Scratch(
+            location, in_memory=self.in_memory, frame_format=self.frame_format, compress_level=self.compress_level
+        )
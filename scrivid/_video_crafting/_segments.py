@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+from ._frame_drawing import _frame_key
+from ._frame_states import FrameStates
+from ._video_stitching import _output_settings
+
+from .. import errors, motion_tree
+from ..metadata import Metadata
+
+import bisect
+import hashlib
+import json
+import shutil
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ._frame_info import FrameInfo
+    from ._preview import PreviewView
+    from .._separating_instructions import SeparatedInstructions
+
+    from pathlib import Path
+    from typing import List, Optional
+
+    MotionTree = motion_tree.MotionTree
+
+
+# Every segment is encoded by an ffmpeg process of its own, which isn't worth
+# starting for only a handful of frames.
+_MINIMUM_SEGMENT_FRAMES = 24
+
+_CHANGES = (motion_tree.HideImage, motion_tree.MoveImage, motion_tree.ShowImage)
+
+
+def check_segments(segments: Optional[int]):
+    if segments is None:
+        return
+    if not isinstance(segments, int) or isinstance(segments, bool) or segments < 1:
+        raise errors.TypeError("`segments` must be a positive integer.")
+
+
+def change_points(parsed_motion_tree: MotionTree, view: Optional[PreviewView] = None) -> List[int]:
+    # The indices at which a node of the motion tree starts to change what's
+    # drawn, where a segment starts on a keyframe that means something.
+    points = {0}
+    for node in parsed_motion_tree.body:
+        if type(node) in _CHANGES:
+            points.add(node.time)
+
+    if view is not None:
+        points = {view._first_index_at(point) for point in points}
+    return sorted(points)
+
+
+def split_segments(points: List[int], start: int, stop: int, segments: int) -> List[range]:
+    """
+    Splits the range of frames from `start` up to `stop` into (at most) the
+    number of segments given. Each boundary is moved onto the nearest of the
+    change points, if there's one within half a segment of where the boundary
+    would split the range evenly.
+    """
+    length = stop - start
+    segments = max(1, min(segments, length // _MINIMUM_SEGMENT_FRAMES))
+    tolerance = length // (2 * segments)
+    candidates = [point for point in points if start < point < stop]
+
+    boundaries = [start]
+    for number in range(1, segments):
+        even = start + number * length // segments
+        position = bisect.bisect_left(candidates, even)
+        boundary = min(candidates[max(0, position - 1):position + 1], key=lambda point: abs(point - even), default=even)
+        if abs(boundary - even) > tolerance:
+            boundary = even
+
+        if boundary - boundaries[-1] >= _MINIMUM_SEGMENT_FRAMES and stop - boundary >= _MINIMUM_SEGMENT_FRAMES:
+            boundaries.append(boundary)
+    boundaries.append(stop)
+
+    return [range(first, last) for first, last in zip(boundaries, boundaries[1:])]
+
+
+def segment_metadata(metadata: Metadata, directory: Path, number: int) -> Metadata:
+    # Each segment is compiled as a video of its own, in a directory of its own
+    # (along with its frames, if they're saved). Every GOP is closed, so that
+    # the segments can be joined without being encoded again. The directory is
+    # made by `prepare_segment`, unless the segment was compiled by an earlier
+    # attempt at compiling the video (see Checkpoint).
+    save_location = directory / f"segment-{number:06d}"
+
+    return Metadata(
+        frame_rate=metadata.frame_rate,
+        save_location=save_location,
+        video_name="segment",
+        window_size=metadata.window_size,
+        encoder_profile=metadata._encoder_profile()._with_closed_gop()
+    )
+
+
+def prepare_segment(segment: Metadata):
+    # The segment starts over in an empty directory, even if an earlier
+    # attempt at compiling it left something behind.
+    if segment.save_location.exists():
+        shutil.rmtree(segment.save_location)
+    segment.save_location.mkdir()
+
+
+def segment_keys(
+        separated_instructions: SeparatedInstructions,
+        frames: List[FrameInfo],
+        ranges: List[range],
+        segment: Metadata,
+        view: Optional[PreviewView],
+        settings: dict
+) -> List[Optional[str]]:
+    """
+    The key of each segment in `caches.segments`, from the frames (as from
+    `generate_frame_range`) that are drawn for the range of the segment, or
+    held into it, and where each one starts in the segment. Every segment is
+    encoded the same way as `segment`, with the frames handed to ffmpeg as the
+    settings say. A segment with a frame that has no key of its own in
+    `caches.frames` has no key either.
+    """
+    frame_keys = []
+    with FrameStates(separated_instructions, view) as frame_states:
+        for frame in frames:
+            frame_states.step(frame.index)
+            frame_keys.append(_frame_key(frame_states, segment.window_size))
+
+    encoding = json.dumps(
+        {"frame_rate": segment.frame_rate, "output": _output_settings(segment), **settings}, sort_keys=True
+    )
+    indices = [frame.index for frame in frames]
+    keys = []
+    for range_ in ranges:
+        hasher = hashlib.sha256(f"{encoding}\n{len(range_)}\n".encode("utf-8"))
+        position = bisect.bisect_right(indices, range_.start) - 1
+        for index, frame_key in zip(indices[position:], frame_keys[position:]):
+            if index >= range_.stop:
+                break
+            if frame_key is None:
+                hasher = None
+                break
+            hasher.update(f"{max(index - range_.start, 0)} {frame_key}\n".encode("utf-8"))
+        keys.append(None if hasher is None else hasher.hexdigest())
+    return keys
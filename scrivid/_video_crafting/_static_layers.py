@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from ._frame_info import _FrameCanvas
+
+from .. import adjustments
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ..abc import Adjustment
+    from .._file_objects.images import ImageReference
+    from .._separating_instructions import SeparatedInstructions
+
+    from collections.abc import Hashable, Iterable
+    from typing import Dict, FrozenSet, List, Optional, Tuple
+
+
+# A layer has to stay unchanged for at least this many frames to be flattened
+# into the base surface, since flattening it costs as much as drawing it.
+_MINIMUM_STATIC_FRAMES = 8
+
+_NEVER = float("inf")
+
+
+def _change_range(adj: Adjustment) -> Tuple[int, int]:
+    # The first and last index at which the adjustment can change the
+    # reference, matching how `_frame_states._enact_adjustment` applies it.
+    if type(adj) is adjustments.core.MoveAdjustment:
+        return adj.activation_time, adj.activation_time + adj.duration
+    else:
+        return adj.activation_time, adj.activation_time
+
+
+def _unchanged_range(change_ranges: List[Tuple[int, int]], index: int) -> Tuple[int, float]:
+    # The range of indices around `index` over which the reference is the same
+    # as it is at `index`.
+    start = 0
+    end = _NEVER
+    for first, last in change_ranges:
+        if first <= index:
+            start = max(start, min(last, index))
+        if last > index:
+            end = min(end, max(first, index + 1))
+    return start, end
+
+
+class StaticLayers:
+    """
+    Works out, from the adjustments of every reference, which layers stay
+    unchanged over a range of frames. The references on those layers (if
+    they're below every layer that changes) are flattened onto `surface`, so
+    each frame starts from it instead of drawing them again.
+    """
+
+    __slots__ = ("_change_ranges", "_end", "_start", "cutoff", "IDs", "surface")
+
+    _change_ranges: Dict[Hashable, List[Tuple[int, int]]]
+    _end: float
+    _start: int
+    cutoff: Optional[int]
+    IDs: FrozenSet[Hashable]
+    surface: Optional[_FrameCanvas]
+
+    def __init__(self, split_instructions: SeparatedInstructions):
+        self._change_ranges = {
+            ID: [_change_range(adj) for adj in split_instructions.adjustments.get(ID, ())]
+            for ID in split_instructions.references
+        }
+        self._end = 0
+        self._start = 0
+        self.cutoff = None
+        self.IDs = frozenset()
+        self.surface = None
+
+    def _is_valid(self, index: int, references: List[ImageReference]) -> bool:
+        if not self._start <= index < self._end:
+            return False
+
+        # A reference that isn't flattened may have been moved below the
+        # flattened layers, in which case it would be drawn on top of them.
+        cutoff = self.cutoff
+        return cutoff is None or all(
+            reference.layer >= cutoff for reference in references if reference.ID not in self.IDs
+        )
+
+    def _close_surface(self):
+        if self.surface is not None:
+            self.surface.close()
+            self.surface = None
+
+    def close(self):
+        self._close_surface()
+        self._end = 0
+        self.cutoff = None
+        self.IDs = frozenset()
+
+    def update(self, index: int, references: Iterable[ImageReference], canvas_size: Tuple[int, int]) -> bool:
+        """
+        Works out the flattened layers for the frame at `index`, if the ones
+        from before don't hold for it. Returns whether `surface` has to be
+        drawn again from the references in `IDs`.
+        """
+        references = list(references)
+        if self._is_valid(index, references):
+            return False
+
+        unchanged_ranges = {
+            reference.ID: _unchanged_range(self._change_ranges[reference.ID], index) for reference in references
+        }
+        changing_layers = [
+            reference.layer for reference in references
+            if unchanged_ranges[reference.ID][1] - index < _MINIMUM_STATIC_FRAMES
+        ]
+        cutoff = min(changing_layers, default=None)
+        IDs = frozenset(
+            reference.ID for reference in references if cutoff is None or reference.layer < cutoff
+        )
+
+        # Until one of the flattened references changes. If there aren't any,
+        # it's worked out again once any reference changes instead.
+        ranges = [unchanged_ranges[ID] for ID in (IDs or unchanged_ranges)]
+        self._start = max((start for start, _ in ranges), default=0)
+        self._end = min((end for _, end in ranges), default=_NEVER)
+        self.cutoff = cutoff
+        self.IDs = IDs
+
+        if not IDs:
+            self._close_surface()
+            return False
+
+        if self.surface is None or self.surface.size != canvas_size:
+            self._close_surface()
+            self.surface = _FrameCanvas(canvas_size)
+        return True
@@ -1,41 +1,443 @@
+from __future__ import annotations
+
 from .. import errors
+from .._utils import tracing
 
+import contextlib
 import os
+from pathlib import Path
+import queue
+import subprocess
+import tempfile
+import threading
+from typing import TYPE_CHECKING
 
 import ffmpeg
 
+if TYPE_CHECKING:
+    from ._progress import ProgressReporter
+    from ..metadata import Metadata
+
+    from typing import List, Optional, Tuple
+
+
+# Roughly how many bytes of frames can be waiting to be written to ffmpeg.
+_QUEUED_BYTES = 64 * 1024 * 1024
+_QUEUED_FRAMES = 8
+
+# Put into the queue to stop the writer thread.
+_STOP = None
+
+# The frame rate that the image demuxer opens every file in a frame list at.
+# The timestamps of the list are rounded to it, so it's what the durations in
+# the list are counted at.
+LISTED_FRAME_RATE = 25
+
+
+def _command(progress: Optional[ProgressReporter]) -> List[str]:
+    # With `-progress`, ffmpeg writes what it has encoded so far to stdout
+    # every so often, in place of the stats it writes to stderr.
+    if progress is None or not progress.reads_ffmpeg:
+        return ["ffmpeg"]
+    return ["ffmpeg", "-progress", "pipe:1", "-nostats"]
+
+
+def _read_lines(pipe, lines: List[bytes], progress: Optional[ProgressReporter] = None):
+    # ffmpeg blocks once a pipe is full, so each one has to be drained for the
+    # entire time that it's running. The progress is written as `key=value`
+    # lines, of which only the number of frames is needed.
+    for line in pipe:
+        lines.append(line)
+        if progress is None:
+            continue
+        key, _, value = line.partition(b"=")
+        if key == b"frame" and value.strip().isdigit():
+            progress.encoded(int(value))
+
+
+class _UnfinishedFile:
+    # The file that ffmpeg writes a video to, next to where the video is
+    # saved, which only replaces the video once ffmpeg has finished it. A video
+    # that fails (or is cancelled) partway leaves nothing behind, and never
+    # stands in the way of compiling it again.
+    __slots__ = ("destination", "path")
+
+    path: Optional[Path]
+
+    def __init__(self, destination: Path):
+        self.destination = destination
+        self.path = None
+
+    def __repr__(self):
+        destination = self.destination
+        path = self.path
+
+        return f"{self.__class__.__name__}({destination=}, {path=})"
+
+    def __enter__(self):
+        self.create()
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.discard()
 
-def _concatenate(*, input_file, input_settings, output_file, output_settings):
-    try:
-        (
-            ffmpeg
-            .input(input_file, **input_settings)
-            .output(output_file, **output_settings)
-            .run(quiet=True)
+    def create(self):
+        # The file is created empty, and ffmpeg is told to overwrite it. It
+        # keeps the extension of the video, which ffmpeg picks the format from.
+        descriptor, path = tempfile.mkstemp(
+            prefix=f".{self.destination.stem}-", suffix=f".unfinished{self.destination.suffix}",
+            dir=self.destination.parent
         )
-    except ffmpeg._run.Error as exc:
-        raise errors.InternalErrorFromFFMPEG(exc, exc.stdout, exc.stderr)
+        os.close(descriptor)
+        self.path = Path(path)
 
+    def discard(self):
+        if self.path is None:
+            return
+        with contextlib.suppress(FileNotFoundError):
+            self.path.unlink()
+        self.path = None
 
-def stitch_video(temporary_directory, metadata):
-    input_file = os.path.join(temporary_directory, "%06d.png")
-    output_file = str(metadata.save_location / f"{metadata.video_name}.mp4")
-    dimensions = f"{metadata.window_width}x{metadata.window_height}"
+    def finish(self):
+        os.replace(self.path, self.destination)
+        self.path = None
+
+
+def _concatenate(*, input_file, input_settings, output_file, output_settings, filters=(), progress=None):
+    with _UnfinishedFile(output_file) as unfinished_file:
+        stream = ffmpeg.input(input_file, **input_settings)
+        for name, kwargs in filters:
+            stream = stream.filter(name, **kwargs)
+        # The unfinished file is already there, so ffmpeg overwrites it.
+        arguments = stream.output(str(unfinished_file.path), **output_settings).compile(
+            cmd=[*_command(progress), "-y"]
+        )
+
+        stdout = []
+        stderr = []
+        with tracing.span("ffmpeg", "encode", {"output": str(output_file)}):
+            process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            readers = [
+                threading.Thread(target=_read_lines, args=(process.stdout, stdout, progress), daemon=True),
+                threading.Thread(target=_read_lines, args=(process.stderr, stderr), daemon=True)
+            ]
+            for reader in readers:
+                reader.start()
+
+            try:
+                if progress is None:
+                    process.wait()
+                else:
+                    progress.wait(process)
+            finally:
+                # Compiling the video was cancelled (or interrupted) while
+                # waiting, so ffmpeg isn't left running on its own.
+                if process.returncode is None:
+                    process.kill()
+                    process.wait()
+                for reader in readers:
+                    reader.join()
+
+        if process.returncode != 0:
+            exc = ffmpeg.Error("ffmpeg", b"".join(stdout), b"".join(stderr))
+            raise errors.InternalErrorFromFFMPEG(exc, exc.stdout, exc.stderr)
+        if progress is not None:
+            progress.report()
+
+
+def _input_filters(frame_format: str) -> List[Tuple[str, dict]]:
+    # BMP files are decoded as BGR, which ffmpeg converts into YUV slightly
+    # differently than RGB. They're turned back into RGB first, so that the
+    # video comes out the same whatever format the frames are in.
+    if frame_format == "bmp":
+        return [("format", {"pix_fmts": "rgb24"})]
+    return []
+
+
+def video_file(metadata: Metadata) -> Path:
+    return metadata.save_location / f"{metadata.video_name}.mp4"
+
+
+def _output_settings(metadata: Metadata) -> dict:
+    return {
+        **metadata._encoder_profile()._output_settings(),
+        "s": f"{metadata.window_width}x{metadata.window_height}"
+    }
+
+
+def join_segments(segment_files: List[Path], directory: Path, metadata: Metadata):
+    # Every segment is encoded with the same settings, so they're copied into
+    # the video one after another instead of being encoded again. They're
+    # listed relative to the directory, which the concat demuxer resolves
+    # them from.
+    segment_list = directory / "segments.ffconcat"
+    lines = ["ffconcat version 1.0"]
+    for file in segment_files:
+        lines.append(f"file '{file.relative_to(directory).as_posix()}'")
+    segment_list.write_text("\n".join(lines) + "\n")
 
-    # I honest to god could not tell you how I figured this out. I just
-    # couldn't figure out how to make a stable result for the life of me.
     _concatenate(
-        input_file=input_file, 
+        input_file=str(segment_list),
         input_settings={
-            "f": "image2",
-            "pattern_type": "sequence",
-            "r": metadata.frame_rate,
+            "f": "concat",
+            "safe": 0,
         },
-        output_file=output_file,
+        output_file=video_file(metadata),
         output_settings={
-            "b:v": "4M",
-            "vcodec": "libx264",
-            "pix_fmt": "yuv420p",
-            "s": dimensions
+            "c": "copy",
         }
     )
+
+
+def stitch_video(
+        frame_list: Path,
+        video_length: int,
+        metadata: Metadata,
+        progress: Optional[ProgressReporter] = None,
+        frame_format: str = "png"
+):
+    # The frames in the list are held for a varying number of frames, so the
+    # `fps` filter is what turns them back into a constant frame rate. Unlike
+    # `-r`, it holds the previous frame through a gap instead of the next one.
+    # Their timestamps are counted at `LISTED_FRAME_RATE`, so they're first
+    # moved to a finer time base and scaled to the video's frame rate.
+    # The image demuxer that the list opens every file with tells the format
+    # of each one from its extension.
+    _concatenate(
+        input_file=str(frame_list),
+        input_settings={
+            "f": "concat",
+            "safe": 0,
+        },
+        output_file=video_file(metadata),
+        output_settings={
+            **_output_settings(metadata),
+            "frames:v": video_length,
+            "r": metadata.frame_rate,
+        },
+        filters=[
+            *_input_filters(frame_format),
+            ("settb", {"expr": "AVTB"}),
+            ("setpts", {"expr": f"PTS*{LISTED_FRAME_RATE}/{metadata.frame_rate}"}),
+            ("fps", {"fps": metadata.frame_rate})
+        ],
+        progress=progress
+    )
+
+
+class VideoStream:
+    """
+    Feeds frames into ffmpeg as raw RGB buffers through its stdin, instead of
+    having it read them from image files.
+
+    Frames are written from a thread of its own, through a queue that holds
+    only a few frames at a time. The next frames can be drawn while ffmpeg
+    takes in the ones before them, and drawing waits once the queue is full,
+    so memory use stays the same however far ahead drawing gets.
+
+    If it's given a ProgressReporter, what ffmpeg has encoded is reported to
+    it, and ffmpeg is stopped if compiling the video is cancelled while it's
+    waited for. Each frame is written as a raw RGB buffer, unless it's in
+    another `frame_format` (see `Scratch`), in which case it's written as the
+    data of a file in that format. The video only replaces whatever was saved
+    before it once ffmpeg has finished it.
+    """
+
+    __slots__ = (
+        "_broken_pipe", "_format", "_metadata", "_output", "_process", "_progress", "_queue", "_readers", "_started",
+        "_stderr", "_writer"
+    )
+
+    _broken_pipe: bool
+    _metadata: Metadata
+    _output: Optional[_UnfinishedFile]
+    _process: Optional[subprocess.Popen]
+    _progress: Optional[ProgressReporter]
+    _queue: Optional[queue.Queue]
+    _readers: List[threading.Thread]
+    _stderr: List[bytes]
+    _writer: Optional[threading.Thread]
+
+    def __init__(
+            self,
+            metadata: Metadata,
+            progress: Optional[ProgressReporter] = None,
+            *,
+            frame_format: str = "raw"
+    ):
+        self._broken_pipe = False
+        self._format = frame_format
+        self._metadata = metadata
+        self._output = None
+        self._process = None
+        self._progress = progress
+        self._queue = None
+        self._readers = []
+        self._started = 0.0
+        self._stderr = []
+        self._writer = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            # Something else went wrong, so that exception is propagated
+            # instead of anything ffmpeg might complain about.
+            self._terminate()
+
+    def _finish(self):
+        self._stop_writer()
+        process = self._process
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            self._broken_pipe = True
+        if self._progress is None:
+            process.wait()
+        else:
+            self._progress.wait(process)
+        self._join_readers()
+        self._trace(process)
+        self._process = None
+
+        # ffmpeg doesn't always exit with an error code when it stops early,
+        # so a pipe that was closed on the other end is treated as an error as
+        # well. The progress callback may still raise an error (or cancel) as
+        # the last of the progress is reported, before the video is saved.
+        try:
+            if process.returncode != 0 or self._broken_pipe:
+                stderr = b"".join(self._stderr)
+                exc = ffmpeg.Error("ffmpeg", None, stderr)
+                raise errors.InternalErrorFromFFMPEG(exc, None, stderr)
+            if self._progress is not None:
+                self._progress.report()
+        except BaseException:
+            self._output.discard()
+            self._output = None
+            raise
+        self._output.finish()
+        self._output = None
+
+    def _input_settings(self) -> dict:
+        metadata = self._metadata
+        if self._format != "raw":
+            # The files are simply written one after another, and ffmpeg's
+            # decoders are named after their formats.
+            return {"f": "image2pipe", "vcodec": self._format, "framerate": metadata.frame_rate}
+        return {
+            "f": "rawvideo",
+            "pix_fmt": "rgb24",
+            "s": f"{metadata.window_width}x{metadata.window_height}",
+            "r": metadata.frame_rate
+        }
+
+    def _join_readers(self):
+        for reader in self._readers:
+            reader.join()
+        self._readers = []
+
+    def _queue_size(self) -> int:
+        metadata = self._metadata
+        frame_size = metadata.window_width * metadata.window_height * 3
+        return max(1, min(_QUEUED_FRAMES, _QUEUED_BYTES // frame_size))
+
+    def _stop_writer(self):
+        # The writer keeps taking frames from the queue after the pipe breaks,
+        # so this can't wait on a full queue forever.
+        self._queue.put(_STOP)
+        self._writer.join()
+
+    def _terminate(self):
+        if self._process is not None:
+            self._process.kill()
+            self._stop_writer()
+            self._process.wait()
+            self._join_readers()
+            self._trace(self._process)
+            self._process = None
+        if self._output is not None:
+            self._output.discard()
+            self._output = None
+
+    def _trace(self, process: subprocess.Popen):
+        # ffmpeg runs alongside the frames being drawn, so it's given a track
+        # of its own in the trace.
+        tracer = tracing.tracer
+        if tracer is None:
+            return
+        tracer.name_thread(process.pid, "ffmpeg")
+        tracer.add(
+            "ffmpeg", "encode", self._started, tracing.now(), {"output": str(video_file(self._metadata))},
+            thread=process.pid
+        )
+
+    def _write_frames(self):
+        stdin = self._process.stdin
+        while True:
+            frame = self._queue.get()
+            if frame is _STOP:
+                return
+            if self._broken_pipe:
+                continue
+
+            try:
+                stdin.write(frame)
+            except BrokenPipeError:
+                self._broken_pipe = True
+
+    def open(self):
+        metadata = self._metadata
+        stream = ffmpeg.input("pipe:", **self._input_settings())
+        for name, kwargs in _input_filters(self._format):
+            stream = stream.filter(name, **kwargs)
+
+        self._output = _UnfinishedFile(video_file(metadata))
+        self._output.create()
+        arguments = (
+            stream
+            .output(str(self._output.path), **_output_settings(metadata))
+            # ffmpeg would otherwise ask whether to overwrite the (empty)
+            # unfinished file through stdin, which is where the frames are
+            # going.
+            .compile(cmd=[*_command(self._progress), "-y"])
+        )
+
+        self._started = tracing.now()
+        try:
+            self._process = subprocess.Popen(
+                arguments, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        except BaseException:
+            self._output.discard()
+            self._output = None
+            raise
+        self._stderr = []
+        self._readers = [
+            threading.Thread(target=_read_lines, args=(self._process.stdout, [], self._progress), daemon=True),
+            threading.Thread(target=_read_lines, args=(self._process.stderr, self._stderr), daemon=True)
+        ]
+        for reader in self._readers:
+            reader.start()
+
+        self._broken_pipe = False
+        self._queue = queue.Queue(self._queue_size())
+        self._writer = threading.Thread(target=self._write_frames, daemon=True)
+        self._writer.start()
+
+    def close(self):
+        if self._process is not None:
+            self._finish()
+
+    def write(self, frame: bytes):
+        # ffmpeg has stopped taking frames, so there's no point in drawing any
+        # more of them.
+        if self._broken_pipe:
+            self._finish()
+        self._queue.put(frame)
@@ -1,45 +1,575 @@
 from __future__ import annotations
 
-from ._frame_drawing import create_frame, fill_undrawn_frames, generate_frames
-from ._video_stitching import stitch_video
+from ._checkpoint import fingerprint
+from ._frame_drawing import create_frame, fill_undrawn_frames, generate_frame_range, hold_frames
+from ._frame_info import CanvasPool
+from ._frame_states import FrameStates
+from ._parallel_drawing import (
+    check_workers, draw_frames_in_parallel, frame_cache_settings, future_result, use_frame_cache
+)
+from ._preview import Preview
+from ._progress import check_progress, POLL_INTERVAL, ProgressReporter, SharedProgress
+from ._render_stats import RenderStats
+from ._scratch import check_resumable, check_scratch, Scratch
+from ._segments import (
+    change_points, check_segments, prepare_segment, segment_keys, segment_metadata, split_segments
+)
+from ._video_stitching import join_segments, stitch_video, video_file, VideoStream
+from .iter_frames import iter_buffers, iter_drawn_frames
 
-from .. import motion_tree
+from .. import caches, errors, motion_tree
 
 from .._separating_instructions import separate_instructions
-from .._utils import TemporaryDirectory
+from .._utils import tracing
 
+from collections import deque
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+import contextlib
+import itertools
+import multiprocessing
+from pathlib import PurePath
+import time
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
+    from ._checkpoint import Checkpoint, NoCheckpoint
+    from ._frame_info import FrameInfo
+    from ._preview import PreviewView
+    from ._progress import CancelToken, PROGRESS_CALLABLE
     from ..abc import Adjustment
     from .._file_objects.images import ImageReference
+    from .._separating_instructions import SeparatedInstructions
     from ..metadata import Metadata
 
     from collections.abc import Sequence
-    from typing import Union
+    from concurrent.futures import Future
+    from multiprocessing.synchronize import Event
+    from pathlib import Path
+    from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple, Union
 
     INSTRUCTIONS = Union[ImageReference, Adjustment]
+    CHECKPOINT = Union[Checkpoint, NoCheckpoint]
+    MotionTree = motion_tree.MotionTree
+    COMPILER = Callable[..., None]
 
 
-def compile_video(instructions: Sequence[INSTRUCTIONS], metadata: Metadata):
+# Set up once in every process that compiles segments, by
+# `_initialize_segment_worker`.
+_segment_state: Optional[Tuple[Event, Optional[object]]] = None
+
+
+def _count_frames(stats: RenderStats, frames: List[FrameInfo], start: int, stop: int, resumed: int = 0):
+    # The frames saved by an earlier attempt at compiling the video (see
+    # Checkpoint) are neither drawn nor held.
+    stats.frames_drawn += len(frames) - resumed
+    stats.frames_held += stop - start - len(frames)
+
+
+def _checkpoint_settings(start: int, stop: Optional[int], view: Optional[PreviewView], **settings) -> dict:
+    # What's saved in a resumable scratch directory depends on these, besides
+    # the instructions and the metadata.
+    return {"start": start, "stop": stop, "preview_scale": None if view is None else view._scale, **settings}
+
+
+def _record_saved(saving: Deque[Tuple[int, Future]], checkpoint: CHECKPOINT):
+    # Frames are recorded in the order that they're drawn, once they're saved.
+    # A frame that hasn't been saved yet, or couldn't be, holds back those
+    # after it.
+    while saving:
+        index, saved = saving[0]
+        if not saved.done() or saved.cancelled() or saved.exception() is not None:
+            return
+        checkpoint.complete(index)
+        saving.popleft()
+
+
+def _held_until(frames: List[FrameInfo], stop: int) -> Iterator[int]:
+    # The index that each frame is held up to, but not including, which is
+    # where the next one is drawn.
+    return itertools.chain((frame.index for frame in frames[1:]), (stop,))
+
+
+def _compiler(stream: bool, scratch: Scratch) -> COMPILER:
+    if stream:
+        return _compile_from_stream
+    if scratch.in_memory:
+        return _compile_in_memory
+    return _compile_from_files
+
+
+def _compile_from_files(
+        separated_instructions: SeparatedInstructions,
+        parsed_motion_tree: MotionTree,
+        metadata: Metadata,
+        workers: Optional[int],
+        start: int,
+        stop: Optional[int],
+        view: Optional[PreviewView],
+        scratch: Scratch,
+        stats: RenderStats,
+        progress: ProgressReporter
+):
+    with scratch._directory(metadata, _checkpoint_settings(start, stop, view)) as checkpoint:
+        progress.enter("generate_frames")
+        with stats._measure("generate_frames"):
+            frames, stop = generate_frame_range(
+                parsed_motion_tree, checkpoint.dir, start, stop, view, extension=scratch._extension
+            )
+        # The frames saved by an earlier attempt, if the scratch directory is
+        # resumable, aren't drawn again.
+        remaining = [
+            (frame, held_until) for frame, held_until in zip(frames, _held_until(frames, stop))
+            if frame.index not in checkpoint.completed
+        ]
+        _count_frames(stats, frames, start, stop, len(frames) - len(remaining))
+        progress.begin(stop - start)
+
+        progress.enter("draw_frames")
+        if workers is None:
+            saving = deque()
+            try:
+                with FrameStates(separated_instructions, view) as frame_states:
+                    with CanvasPool(metadata.window_size) as canvas_pool:
+                        with scratch._frame_writer(metadata.window_size) as frame_writer:
+                            for frame_information, held_until in remaining:
+                                saved = create_frame(frame_information, frame_states, canvas_pool, frame_writer, stats)
+                                saving.append((frame_information.index, saved))
+                                _record_saved(saving, checkpoint)
+                                progress.rendered(held_until - start)
+            finally:
+                _record_saved(saving, checkpoint)
+        else:
+            # The workers have saved every frame that they hand back.
+            drawn_frames = draw_frames_in_parallel(
+                [frame for frame, _ in remaining], separated_instructions, metadata.window_size, workers,
+                save=scratch, view=view, stats=stats, cancelled=progress.cancelled
+            )
+            with contextlib.closing(drawn_frames):
+                for (frame, _), (_, held_until) in zip(drawn_frames, remaining):
+                    checkpoint.complete(frame.index)
+                    progress.rendered(held_until - start)
+        checkpoint.save()
+
+        if scratch.frame_format == "raw":
+            # ffmpeg can't tell what raw files are from the concat demuxer, so
+            # they're read back and piped into it instead, the same as when
+            # streaming.
+            progress.enter("stitch_video")
+            saved_frames = ((frame, frame.save_file.read_bytes()) for frame in frames)
+            with VideoStream(metadata, progress) as video_stream:
+                with stats._measure("stitch_video"):
+                    for buffer in hold_frames(saved_frames, start, stop):
+                        video_stream.write(buffer)
+                    video_stream.close()
+            return
+
+        progress.enter("fill_undrawn_frames")
+        with stats._measure("fill_undrawn_frames"):
+            frame_list = fill_undrawn_frames(frames, checkpoint.dir, start, stop)
+        progress.enter("stitch_video")
+        with stats._measure("stitch_video"):
+            stitch_video(frame_list, stop - start, metadata, progress, scratch.frame_format)
+
+
+def _compile_in_memory(
+        separated_instructions: SeparatedInstructions,
+        parsed_motion_tree: MotionTree,
+        metadata: Metadata,
+        workers: Optional[int],
+        start: int,
+        stop: Optional[int],
+        view: Optional[PreviewView],
+        scratch: Scratch,
+        stats: RenderStats,
+        progress: ProgressReporter
+):
+    # Like `_compile_from_files`, except that every frame drawn is kept in
+    # memory as the data of a file, and piped into ffmpeg (held for as many
+    # frames as it is) once they're all drawn.
+    progress.enter("generate_frames")
+    with stats._measure("generate_frames"):
+        frames, stop = generate_frame_range(parsed_motion_tree, None, start, stop, view)
+    _count_frames(stats, frames, start, stop)
+    progress.begin(stop - start)
+
+    progress.enter("draw_frames")
+    encoded_frames = []
+    drawn_frames = iter_drawn_frames(
+        separated_instructions, frames, metadata.window_size, workers, view, stats, progress.cancelled
+    )
+    with contextlib.closing(drawn_frames), scratch._frame_writer(metadata.window_size) as frame_writer:
+        for (frame, buffer), held_until in zip(drawn_frames, _held_until(frames, stop)):
+            with stats._measure("save_frames"):
+                encoded_frames.append((frame, frame_writer.encode(buffer)))
+            progress.rendered(held_until - start)
+
+    progress.enter("stitch_video")
+    saved_frames = ((frame, encoded.result()) for frame, encoded in encoded_frames)
+    with VideoStream(metadata, progress, frame_format=scratch.frame_format) as video_stream:
+        with stats._measure("stitch_video"):
+            for data in hold_frames(saved_frames, start, stop):
+                video_stream.write(data)
+            video_stream.close()
+
+
+def _compile_from_stream(
+        separated_instructions: SeparatedInstructions,
+        parsed_motion_tree: MotionTree,
+        metadata: Metadata,
+        workers: Optional[int],
+        start: int,
+        stop: Optional[int],
+        view: Optional[PreviewView],
+        scratch: Scratch,
+        stats: RenderStats,
+        progress: ProgressReporter
+):
+    # The range is checked before ffmpeg is started.
+    progress.enter("generate_frames")
+    with stats._measure("generate_frames"):
+        frames, stop = generate_frame_range(parsed_motion_tree, None, start, stop, view)
+    _count_frames(stats, frames, start, stop)
+    progress.begin(stop - start)
+
+    progress.enter("draw_frames")
+    buffers = iter_buffers(
+        separated_instructions, frames, start, stop, metadata.window_size, workers, view, stats, progress.cancelled
+    )
+
+    # Drawing is timed as the buffers are drawn, so only the time spent handing
+    # them to ffmpeg (and waiting for it to finish) is timed here. If anything
+    # goes wrong, ffmpeg is stopped first, and then any worker processes.
+    with contextlib.closing(buffers), VideoStream(metadata, progress) as video_stream:
+        for rendered, buffer in enumerate(buffers, 1):
+            with stats._measure("stitch_video"):
+                video_stream.write(buffer)
+            progress.rendered(rendered)
+
+        progress.enter("stitch_video")
+        with stats._measure("stitch_video"):
+            video_stream.close()
+
+
+def _initialize_segment_worker(
+        stopped: Event,
+        counts: Optional[object],
+        frame_cache: Tuple[Optional[Path], int]
+):
+    # The event that stops compiling the segments, and the memory that the
+    # progress of each segment is shared through, can only be shared with a
+    # process as it's started, rather than with every segment.
+    global _segment_state
+    _segment_state = (stopped, counts)
+    use_frame_cache(frame_cache)
+
+
+def _compile_segment(
+        separated_instructions: SeparatedInstructions,
+        parsed_motion_tree: MotionTree,
+        metadata: Metadata,
+        number: int,
+        start: int,
+        stop: int,
+        stream: bool,
+        view: Optional[PreviewView],
+        scratch: Scratch,
+        trace: bool
+) -> Tuple[RenderStats, Optional[List[dict]]]:
+    # Run in a process of its own, for every segment. A forked process starts
+    # with the tracer of the process that started it, so it's replaced.
+    stats = RenderStats()
+    cache_infos = RenderStats._cache_infos()
+    if trace:
+        tracing.start()
+    else:
+        tracing.stop()
+
+    stopped, counts = _segment_state
+    progress = ProgressReporter(None if counts is None else SharedProgress(counts, number), stopped)
+
+    try:
+        _compiler(stream, scratch)(
+            separated_instructions, parsed_motion_tree, metadata, None, start, stop, view, scratch, stats, progress
+        )
+    finally:
+        tracer = tracing.stop()
+
+    stats._count_caches(cache_infos)
+    return stats, None if tracer is None else tracer.take_events()
+
+
+def _wait_for_segments(
+        pending: Dict[Future, int],
+        counts: Optional[object],
+        progress: ProgressReporter,
+        checkpoint: CHECKPOINT
+):
+    # Each segment is drawn and encoded at once, so the progress of both is
+    # added up from every segment. Every segment is recorded as soon as it's
+    # compiled, since each one is a good deal of work. A segment that fails
+    # is raised right away, rather than once the others are compiled too.
+    timeout = POLL_INTERVAL if progress.watching else None
+    not_done = pending
+    while not_done:
+        done, not_done = wait(not_done, timeout, return_when=FIRST_EXCEPTION)
+        done = [future for future in done if not future.cancelled()]
+        compiled = [pending[future] for future in done if future.exception() is None]
+        for number in compiled:
+            checkpoint.complete(number)
+        if compiled:
+            checkpoint.save()
+        for future in done:
+            if future.exception() is not None:
+                future_result(future)
+
+        if counts is None:
+            progress.check()
+        else:
+            progress.update(*SharedProgress.totals(counts))
+
+
+def _compile_in_segments(
+        separated_instructions: SeparatedInstructions,
+        parsed_motion_tree: MotionTree,
+        metadata: Metadata,
+        segments: int,
+        workers: Optional[int],
+        start: int,
+        stop: Optional[int],
+        stream: bool,
+        view: Optional[PreviewView],
+        scratch: Scratch,
+        stats: RenderStats,
+        progress: ProgressReporter
+):
+    progress.enter("generate_frames")
+    with stats._measure("generate_frames"):
+        frames, stop = generate_frame_range(parsed_motion_tree, None, start, stop, view)
+    ranges = split_segments(change_points(parsed_motion_tree, view), start, stop, segments)
+
+    # A video that's too short to split is compiled as it is, unless it's
+    # streamed and resumable. Streamed frames can't be resumed by themselves,
+    # so it's compiled as a single segment instead, which can.
+    if len(ranges) == 1 and not (stream and scratch.resumable):
+        _compiler(stream, scratch)(
+            separated_instructions, parsed_motion_tree, metadata, workers, start, stop, view, scratch, stats, progress
+        )
+        return
+
+    progress.begin(stop - start)
+    counts = SharedProgress.allocate(len(ranges)) if progress.reads_ffmpeg else None
+
+    settings = _checkpoint_settings(
+        start, stop, view, segments=[[range_.start, range_.stop] for range_ in ranges], stream=stream
+    )
+    with scratch._directory(metadata, settings) as checkpoint:
+        keys = [None] * len(ranges)
+        if caches.segments.directory is not None:
+            # How the frames are handed to ffmpeg may change how they're
+            # encoded.
+            handed_over = {
+                "stream": stream,
+                "in_memory": not stream and scratch.in_memory,
+                "frame_format": None if stream else scratch.frame_format
+            }
+            with stats._measure("generate_frames"):
+                keys = segment_keys(
+                    separated_instructions, frames, ranges, segment_metadata(metadata, checkpoint.dir, 0), view,
+                    handed_over
+                )
+
+        segment_files = []
+        pending = {}
+
+        # Set once the segments stop being waited for, so that the segments
+        # still being compiled stop as well, whether one of them failed or
+        # the video was cancelled (which is checked for while waiting).
+        stopped = multiprocessing.Event()
+        executor = ProcessPoolExecutor(
+            max_workers=workers or len(ranges),
+            initializer=_initialize_segment_worker,
+            initargs=(stopped, counts, frame_cache_settings())
+        )
+        try:
+            for number, range_ in enumerate(ranges):
+                segment = segment_metadata(metadata, checkpoint.dir, number)
+                segment_files.append(video_file(segment))
+
+                # A segment compiled by an earlier attempt, if the scratch
+                # directory is resumable, is joined as it is.
+                if number in checkpoint.completed:
+                    if counts is not None:
+                        SharedProgress(counts, number).fill(len(range_))
+                    continue
+
+                prepare_segment(segment)
+                # So is a segment made of the same frames as one that was
+                # compiled before, from `caches.segments`.
+                if keys[number] is not None and caches.segments.load(keys[number], segment_files[number]):
+                    if counts is not None:
+                        SharedProgress(counts, number).fill(len(range_))
+                    checkpoint.complete(number)
+                    checkpoint.save()
+                    continue
+
+                future = executor.submit(
+                    _compile_segment, separated_instructions, parsed_motion_tree, segment, number, range_.start,
+                    range_.stop, stream, view, scratch._within(segment.save_location), tracing.tracer is not None
+                )
+                pending[future] = number
+
+            progress.enter("draw_frames")
+            _wait_for_segments(pending, counts, progress, checkpoint)
+            for future, number in pending.items():
+                segment_stats, events = future_result(future)
+                stats._merge(segment_stats)
+                if events:
+                    tracing.tracer.extend(events)
+                if keys[number] is not None:
+                    caches.segments.save(keys[number], segment_files[number])
+        finally:
+            stopped.set()
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+        progress.enter("join_segments")
+        with stats._measure("join_segments"):
+            join_segments(segment_files, checkpoint.dir, metadata)
+
+
+def _compile_video(
+        instructions: Sequence[INSTRUCTIONS],
+        metadata: Metadata,
+        preview: Union[bool, Preview],
+        segments: Optional[int],
+        start: int,
+        stop: Optional[int],
+        stream: bool,
+        workers: Optional[int],
+        scratch: Scratch,
+        progress: ProgressReporter
+) -> RenderStats:
+    stats = RenderStats()
+    wall_time = time.perf_counter()
+    cache_infos = RenderStats._cache_infos()
+
+    view = None
+    if preview is True:
+        preview = Preview()
+    if preview:
+        view = preview._validate(metadata)
+        metadata = view.metadata
+
+    progress.enter("separate_instructions")
+    with stats._measure("separate_instructions"):
+        separated_instructions = separate_instructions(instructions)
+    progress.enter("motion_tree.parse")
+    with stats._measure("motion_tree.parse"):
+        parsed_motion_tree = motion_tree.parse(separated_instructions)
+    if scratch.resumable:
+        scratch = scratch._resuming(fingerprint(instructions))
+
+    # However this ends, the video is only saved once ffmpeg has finished it.
+    if segments is not None:
+        _compile_in_segments(
+            separated_instructions, parsed_motion_tree, metadata, segments, workers, start, stop, stream, view,
+            scratch, stats, progress
+        )
+    else:
+        _compiler(stream, scratch)(
+            separated_instructions, parsed_motion_tree, metadata, workers, start, stop, view, scratch, stats, progress
+        )
+
+    stats._count_caches(cache_infos)
+    stats.wall_time = time.perf_counter() - wall_time
+    return stats
+
+
+def compile_video(
+        instructions: Sequence[INSTRUCTIONS],
+        metadata: Metadata,
+        *,
+        cancel: Optional[CancelToken] = None,
+        preview: Union[bool, Preview] = False,
+        progress: Optional[PROGRESS_CALLABLE] = None,
+        scratch: Optional[Union[str, Path, Scratch]] = None,
+        segments: Optional[int] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+        stream: bool = True,
+        trace: Optional[Union[str, Path]] = None,
+        workers: Optional[int] = None
+) -> RenderStats:
     """
     Converts the objects, taken as instructions, into a compiled video.
+    Returns the statistics of compiling it, as an instance of RenderStats.
 
-    :param instructions: A list of instances of ImageReference's, and/or a 
+    :param instructions: A list of instances of ImageReference's, and/or a
         class of the Adjustment hierarchy.
     :param metadata: An instance of Metadata that stores the attributes
         of the video.
+    :param cancel: An instance of CancelToken, which stops compiling the
+        video once it's cancelled (see CancelToken). By default, it can't be
+        cancelled.
+    :param preview: Whether to compile a quicker preview of the video, which
+        is drawn smaller and at a lower frame rate, but with the same timing.
+        Either True for the default settings, or an instance of Preview. The
+        preview is saved in place of the video. Defaults to False.
+    :param progress: A callable that's called with an instance of
+        RenderProgress whenever a stage starts, a frame is rendered, or ffmpeg
+        reports what it has encoded (about twice a second), from the thread
+        that called `compile_video`. By default, nothing is reported.
+    :param scratch: Where the frames (with `stream=False`) and segments are
+        kept while the video is compiled, as either the folder to keep them
+        in, or an instance of Scratch. By default, they're kept in a folder
+        of their own inside of `metadata.save_location`. A Scratch that's
+        `resumable` lets compiling the video pick up from where it stopped,
+        the next time it's called the same way.
+    :param segments: The number of segments to split the video into, which
+        are drawn and encoded at the same time in processes of their own, and
+        joined together without being encoded again. The segments start where
+        the motion tree shows a change, where possible, and a video too short
+        to be worth splitting is compiled as a whole. Segments are kept in
+        `caches.segments`, if it has a directory, and those that are made of
+        the same frames as one that's kept aren't compiled again. By default,
+        the video isn't split.
+    :param start: The index of the first frame of the video (or preview) to
+        compile, to compile only a part of it. The frames before it aren't
+        drawn. Defaults to 0.
+    :param stop: The index of the frame to compile up to, but not including.
+        Defaults to the end of the video.
+    :param stream: Whether each frame is piped straight into ffmpeg as a raw
+        RGB buffer. If False, every frame that's drawn is saved first, as a
+        PNG file unless `scratch` says otherwise. Defaults to True.
+    :param trace: The path of a file to write a trace of compiling the video
+        to, in the JSON format of Chrome trace events, which trace viewers
+        (such as Perfetto, or `chrome://tracing`) can open. It has spans for
+        every stage, every frame, every reference drawn onto a frame, every
+        image decoded or resized, and ffmpeg. It's written even if compiling
+        the video fails. By default, nothing is traced.
+    :param workers: The number of processes that the frames are drawn across.
+        The result is identical to drawing every frame in this process, which
+        is what happens if it's not specified. With `segments`, it's instead
+        the number of segments that are compiled at once, which defaults to
+        all of them.
     """
     metadata._validate()
+    check_progress(progress, cancel)
+    scratch = check_scratch(scratch)
+    check_segments(segments)
+    check_resumable(scratch, stream, segments)
+    check_workers(workers)
+    if trace is not None and not isinstance(trace, (str, PurePath)):
+        raise errors.TypeError("`trace` must be a path.")
 
-    separated_instructions = separate_instructions(instructions)
-    parsed_motion_tree = motion_tree.parse(separated_instructions)
-
-    with TemporaryDirectory(metadata.save_location / ".scrivid-cache") as temp_dir:
-        frames, video_length = generate_frames(parsed_motion_tree, temp_dir.dir, metadata.window_size)
-
-        for frame_information in frames:
-            create_frame(frame_information, separated_instructions)
+    reporter = ProgressReporter(progress, None if cancel is None else cancel._event)
+    arguments = (instructions, metadata, preview, segments, start, stop, stream, workers, scratch, reporter)
+    if trace is None:
+        return _compile_video(*arguments)
 
-        fill_undrawn_frames(temp_dir.dir, video_length)
-        stitch_video(temp_dir.dir, metadata)
+    tracing.start()
+    try:
+        return _compile_video(*arguments)
+    finally:
+        tracing.stop().write(trace)
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+from ._frame_drawing import draw_frames, generate_frame_range, hold_frames
+from ._frame_info import CanvasPool
+from ._frame_states import FrameStates
+from ._parallel_drawing import check_workers, draw_frames_in_parallel
+
+from .. import errors, motion_tree
+
+from .._separating_instructions import separate_instructions
+
+from typing import TYPE_CHECKING
+
+from PIL import Image
+
+if TYPE_CHECKING:
+    from ._frame_info import FrameInfo
+    from ._preview import PreviewView
+    from ._render_stats import RenderStats
+    from ..abc import Adjustment
+    from .._file_objects.images import ImageReference
+    from .._separating_instructions import SeparatedInstructions
+    from ..metadata import Metadata
+
+    from collections.abc import Sequence
+    from multiprocessing.synchronize import Event
+    from typing import Iterator, List, Optional, Tuple, Union
+
+    INSTRUCTIONS = Union[ImageReference, Adjustment]
+    MotionTree = motion_tree.MotionTree
+
+
+def iter_drawn_frames(
+        separated_instructions: SeparatedInstructions,
+        frames: List[FrameInfo],
+        window_size: Tuple[int, int],
+        workers: Optional[int],
+        view: Optional[PreviewView] = None,
+        stats: Optional[RenderStats] = None,
+        cancelled: Optional[Event] = None
+) -> Iterator[Tuple[FrameInfo, bytes]]:
+    # Yields each of the frames given by `generate_frame_range` in order, with
+    # its raw RGB buffer. Only as many frames are in memory at once as are
+    # being drawn.
+    if workers is None:
+        with FrameStates(separated_instructions, view) as frame_states, CanvasPool(window_size) as canvas_pool:
+            yield from draw_frames(frames, frame_states, canvas_pool, stats)
+    else:
+        yield from draw_frames_in_parallel(
+            frames, separated_instructions, window_size, workers, save=None, view=view, stats=stats,
+            cancelled=cancelled
+        )
+
+
+def iter_buffers(
+        separated_instructions: SeparatedInstructions,
+        frames: List[FrameInfo],
+        start: int,
+        stop: int,
+        window_size: Tuple[int, int],
+        workers: Optional[int],
+        view: Optional[PreviewView] = None,
+        stats: Optional[RenderStats] = None,
+        cancelled: Optional[Event] = None
+) -> Iterator[bytes]:
+    # Yields the raw RGB buffer of every frame from `start` up to `stop` in
+    # order, holding each drawn frame until the next.
+    drawn_frames = iter_drawn_frames(separated_instructions, frames, window_size, workers, view, stats, cancelled)
+    yield from hold_frames(drawn_frames, start, stop)
+
+
+def _as_frame(buffer: bytes, window_size: Tuple[int, int], raw: bool) -> Union[Image.Image, bytes]:
+    if raw:
+        return buffer
+    return Image.frombytes("RGB", window_size, buffer)
+
+
+def iter_frames(
+        instructions: Sequence[INSTRUCTIONS],
+        metadata: Metadata,
+        *,
+        raw: bool = False,
+        start: int = 0,
+        stop: Optional[int] = None,
+        workers: Optional[int] = None
+) -> Iterator[Tuple[int, Union[Image.Image, bytes]]]:
+    """
+    Draws the frames of the video that the objects, taken as instructions,
+    make up, and yields each one with its index. The frames are drawn as they
+    are asked for, so memory use doesn't grow with the length of the video.
+
+    :param instructions: A list of instances of ImageReference's, and/or a
+        class of the Adjustment hierarchy.
+    :param metadata: An instance of Metadata that stores the attributes
+        of the video. Only `window_size` is required.
+    :param raw: Whether each frame is yielded as its raw RGB buffer (as
+        `bytes`, with three bytes per pixel), instead of as a PIL image.
+        Either can be passed to `numpy.asarray`, although a buffer has to be
+        reshaped into `(height, width, 3)`. Defaults to False.
+    :param start: The index of the first frame to yield. The frames before it
+        aren't drawn. Defaults to 0.
+    :param stop: The index that frames are yielded up to, but not including.
+        Defaults to the end of the video.
+    :param workers: The number of processes that the frames are drawn across.
+        The result is identical to drawing every frame in this process, which
+        is what happens if it's not specified.
+    """
+    metadata._validate_window_size()
+    check_workers(workers)
+
+    separated_instructions = separate_instructions(instructions)
+    parsed_motion_tree = motion_tree.parse(separated_instructions)
+
+    # The state of each reference is worked out at `start` directly, so none
+    # of the frames before it are drawn.
+    frames, stop = generate_frame_range(parsed_motion_tree, None, start, stop)
+    buffers = iter_buffers(separated_instructions, frames, start, stop, metadata.window_size, workers)
+    for index, buffer in enumerate(buffers, start):
+        yield index, _as_frame(buffer, metadata.window_size, raw)
+
+
+def render_frame(
+        instructions: Sequence[INSTRUCTIONS],
+        metadata: Metadata,
+        index: int,
+        *,
+        raw: bool = False
+) -> Union[Image.Image, bytes]:
+    """
+    Draws the single frame at `index` of the video that the objects, taken as
+    instructions, make up. None of the frames before it are drawn, and the
+    time it takes depends on the number of adjustments rather than the index.
+
+    :param instructions: A list of instances of ImageReference's, and/or a
+        class of the Adjustment hierarchy.
+    :param metadata: An instance of Metadata that stores the attributes
+        of the video. Only `window_size` is required.
+    :param index: The index of the frame to draw.
+    :param raw: Whether the frame is returned as its raw RGB buffer, instead
+        of as a PIL image. See `iter_frames`. Defaults to False.
+    """
+    if not isinstance(index, int) or isinstance(index, bool):
+        raise errors.TypeError("`index` must be an integer.")
+
+    for _, frame in iter_frames(instructions, metadata, raw=raw, start=index, stop=index + 1):
+        return frame
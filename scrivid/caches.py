@@ -0,0 +1,607 @@
+from __future__ import annotations
+
+from . import errors
+from ._utils import quantise_scale, scale_dimensions, tracing
+
+from collections import OrderedDict
+import contextlib
+import hashlib
+import os
+from pathlib import Path, PurePath
+import re
+import shutil
+import tempfile
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from PIL import Image
+
+if TYPE_CHECKING:
+    from collections.abc import Hashable
+    from typing import BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+
+
+_DEFAULT_DECODED_IMAGES_BUDGET = 512 * 1024 * 1024
+_DEFAULT_FRAMES_BUDGET = 4 * 1024 * 1024 * 1024
+_DEFAULT_SEGMENTS_BUDGET = 1024 * 1024 * 1024
+_DEFAULT_SPRITES_BUDGET = 256 * 1024 * 1024
+
+# Once the files of a cache on disk go over the budget, the least recently
+# used ones are removed until they're down to this fraction of it, so that the
+# directory isn't looked through again for every file written after that.
+_EVICTION_TARGET = 0.9
+_SHARD = re.compile(r"[0-9a-f]{2}")
+
+# A file that's still being written after this many seconds was left behind
+# by a process that died while writing it.
+_STALE_WRITE_AGE = 60 * 60
+
+
+def _check_budget(budget: int):
+    if not isinstance(budget, int) or isinstance(budget, bool) or budget < 0:
+        raise errors.TypeError("`budget` must be a non-negative integer.")
+
+
+def _copy_file(source: Path, destination: BinaryIO):
+    with open(source, "rb") as source_file:
+        shutil.copyfileobj(source_file, destination)
+
+
+def _image_size(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+class CacheInfo:
+    """
+    A snapshot of the statistics of a cache.
+
+    :param hits: `(int)` The number of lookups that were found in the cache.
+    :param misses: `(int)` The number of lookups that weren't.
+    :param evictions: `(int)` The number of entries that were dropped to stay
+        within the budget.
+    :param size: `(int)` The number of bytes currently held by the cache.
+    :param budget: `(int)` The maximum number of bytes the cache may hold.
+    """
+
+    __slots__ = ("budget", "evictions", "hits", "misses", "size")
+
+    def __init__(self, *, budget: int, evictions: int, hits: int, misses: int, size: int):
+        self.budget = budget
+        self.evictions = evictions
+        self.hits = hits
+        self.misses = misses
+        self.size = size
+
+    def __repr__(self):
+        hits = self.hits
+        misses = self.misses
+        evictions = self.evictions
+        size = self.size
+        budget = self.budget
+
+        return f"{self.__class__.__name__}({hits=}, {misses=}, {evictions=}, {size=}, {budget=})"
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+
+class _LRUCache:
+    # A thread-safe mapping of keys to images, that drops the least recently
+    # used entries once their total size goes over the budget.
+    __slots__ = ("_budget", "_entries", "_evictions", "_hits", "_lock", "_misses", "_size")
+
+    def __init__(self, budget: int):
+        _check_budget(budget)
+        self._budget = budget
+        self._entries = OrderedDict()
+        self._evictions = 0
+        self._hits = 0
+        self._lock = threading.Lock()
+        self._misses = 0
+        self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        # Assumes that the lock is held.
+        while self._size > self._budget and self._entries:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._size -= size
+            self._evictions += 1
+
+    def _lookup(self, key: Hashable):
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def _store(self, key: Hashable, value, size: int):
+        with self._lock:
+            if size > self._budget or key in self._entries:
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            self._evict()
+
+    @property
+    def budget(self) -> int:
+        """ The maximum number of bytes that the cache holds onto. """
+        return self._budget
+
+    @budget.setter
+    def budget(self, new_value: int):
+        _check_budget(new_value)
+        with self._lock:
+            self._budget = new_value
+            self._evict()
+
+    def clear(self):
+        """ Drops every entry, and resets the statistics. """
+        with self._lock:
+            self._entries.clear()
+            self._evictions = 0
+            self._hits = 0
+            self._misses = 0
+            self._size = 0
+
+    def _statistics(self) -> CacheInfo:
+        # As kept by `RenderStats`.
+        return self.info()
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(
+                budget=self._budget,
+                evictions=self._evictions,
+                hits=self._hits,
+                misses=self._misses,
+                size=self._size
+            )
+
+
+class DecodedImageCache(_LRUCache):
+    """
+    Holds decoded images, so that every reference to the same file shares one
+    decoded copy. Images are looked up by their resolved path, along with the
+    modification time and size of the file, so a file that changes on disk is
+    decoded again.
+
+    The images that are handed out are shared, and must not be modified.
+
+    :param budget: `(int)` The maximum number of bytes of decoded images to
+        hold onto. Images bigger than this are decoded, but not cached.
+    """
+
+    __slots__ = ()
+
+    @staticmethod
+    def _key(file: Path) -> Tuple[str, int, int]:
+        resolved = file.resolve()
+        stat = os.stat(resolved)
+        return str(resolved), stat.st_mtime_ns, stat.st_size
+
+    def open(self, file: Union[str, Path]) -> Image.Image:
+        key = self._key(Path(file))
+
+        image = self._lookup(key)
+        if image is not None:
+            return image
+
+        with tracing.span("decode", "cache", {"file": key[0]}):
+            image = Image.open(key[0])
+            image.load()
+            if image.fp is not None:
+                # Pillow keeps the file open after loading images with multiple
+                # frames. The cache holds onto a copy instead, so it isn't left
+                # open for as long as the image is cached.
+                with image:
+                    image = image.copy()
+
+        self._store(key, image, _image_size(image))
+        return image
+
+
+class SpriteCache(_LRUCache):
+    """
+    Holds resized copies of images, so that an image drawn at the same scale
+    over many frames is only resized once. Sprites are looked up by the source
+    image, the scale (rounded to two decimal places) and the resampling
+    filter.
+
+    The sprites that are handed out are shared, and must not be modified.
+
+    :param budget: `(int)` The maximum number of bytes of resized images to
+        hold onto. The source images are kept alive by the sprites made from
+        them, but aren't counted towards the budget.
+    """
+
+    __slots__ = ()
+
+    def resize(
+            self,
+            image: Image.Image,
+            scale: Union[float, int],
+            resample: Image.Resampling = Image.Resampling.LANCZOS
+    ) -> Optional[Image.Image]:
+        """
+        Returns the image resized by `scale`, or None if nothing of it would be
+        left to draw. A scale of one returns the image itself.
+        """
+        scale = quantise_scale(scale)
+        if scale == 1:
+            return image
+
+        size = scale_dimensions(image.width, image.height, scale)
+        if size[0] == 0 or size[1] == 0:
+            return None
+
+        # The source image is stored with the sprite, which keeps it alive, so
+        # its `id` can't be reused by another image while the entry exists.
+        key = (id(image), scale, resample)
+        entry = self._lookup(key)
+        if entry is not None:
+            return entry[1]
+
+        with tracing.span("resize", "cache", {"scale": scale, "size": size}):
+            sprite = image.resize(size, resample)
+        self._store(key, (image, sprite), _image_size(sprite))
+        return sprite
+
+
+class _DiskCache:
+    # A directory of files, each named by the hash that it's looked up by,
+    # that drops the least recently used files once their total size goes over
+    # the budget. Any number of processes can share the directory.
+    __slots__ = ("_budget", "_directory", "_evictions", "_hits", "_lock", "_misses", "_size", "_written")
+
+    _directory: Optional[Path]
+    _size: Optional[int]
+
+    # The extension of the files kept in the directory, which are the only
+    # ones that are ever removed from it.
+    _extension: str
+    _file_name: re.Pattern
+
+    def __init__(self, directory: Optional[Union[str, Path]], budget: int):
+        _check_budget(budget)
+        self._budget = budget
+        self._directory = None
+        self._evictions = 0
+        self._hits = 0
+        self._lock = threading.Lock()
+        self._misses = 0
+        # The number of bytes of files in the directory, as of the last time
+        # it was looked through, and how many this process has written since.
+        self._size = None
+        self._written = 0
+        self.directory = directory
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries())
+
+    def __repr__(self):
+        directory = self._directory
+        budget = self._budget
+
+        return f"{self.__class__.__name__}({directory=}, {budget=})"
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        # Every file in the directory, as (last used, size, path). Files left
+        # behind by a process that died while writing them are removed.
+        entries = []
+        if self._directory is None or not self._directory.is_dir():
+            return entries
+
+        now = time.time()
+        for shard in os.scandir(self._directory):
+            if not (_SHARD.fullmatch(shard.name) and shard.is_dir()):
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # It was removed by another process.
+                    continue
+                if self._file_name.fullmatch(entry.name):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                elif entry.name.endswith(".tmp") and now - stat.st_mtime > _STALE_WRITE_AGE:
+                    with contextlib.suppress(OSError):
+                        os.unlink(entry.path)
+        return entries
+
+    def _evict(self):
+        # Assumes that the lock is held. The directory is looked through for
+        # the files written by every process, not only this one.
+        entries = self._entries()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        if size > self._budget:
+            target = int(self._budget * _EVICTION_TARGET)
+            for _, entry_size, path in sorted(entries):
+                if size <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    # Another process removed it first.
+                    pass
+                except OSError:
+                    continue
+                size -= entry_size
+                self._evictions += 1
+
+        self._size = size
+        self._written = 0
+
+    def _keep(self, key: str, size: int, write: Callable[[BinaryIO], None]):
+        # Writes the file with the given key, which only appears once it's
+        # whole.
+        if self._directory is None or size > self._budget:
+            return
+
+        path = self._path(key)
+        temporary = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            descriptor, temporary = tempfile.mkstemp(suffix=".tmp", dir=path.parent)
+            with open(descriptor, "wb") as file:
+                write(file)
+            os.replace(temporary, path)
+        except OSError:
+            # A full (or read-only) disk only means that it isn't cached.
+            if temporary is not None:
+                with contextlib.suppress(OSError):
+                    os.unlink(temporary)
+            return
+
+        with self._lock:
+            self._written += size
+            # The directory is looked through again once this process alone
+            # could have taken it over the budget, which also finds the files
+            # written by every other process since.
+            if (
+                    self._size is None
+                    or self._size + self._written > self._budget
+                    or self._written > self._budget * (1 - _EVICTION_TARGET)
+            ):
+                self._evict()
+
+    def _path(self, key: str) -> Path:
+        # Files are spread across subdirectories by the start of their key, so
+        # that no single directory holds too many of them.
+        return self._directory / key[:2] / f"{key}{self._extension}"
+
+    @staticmethod
+    def _touch(path: Path):
+        # The modification time of a file is when it was last used.
+        with contextlib.suppress(OSError):
+            os.utime(path)
+
+    @property
+    def budget(self) -> int:
+        """ The maximum number of bytes kept in the directory. """
+        return self._budget
+
+    @budget.setter
+    def budget(self, new_value: int):
+        _check_budget(new_value)
+        with self._lock:
+            self._budget = new_value
+            if self._size is not None:
+                self._evict()
+
+    @property
+    def directory(self) -> Optional[Path]:
+        """ The directory that the cache is kept in, if any. """
+        return self._directory
+
+    @directory.setter
+    def directory(self, new_value: Optional[Union[str, Path]]):
+        if new_value is not None and not isinstance(new_value, (str, PurePath)):
+            raise errors.TypeError("`directory` must be a path, or None.")
+        with self._lock:
+            self._directory = None if new_value is None else Path(new_value)
+            self._size = None
+            self._written = 0
+
+    def clear(self):
+        """ Removes everything cached from the directory, and resets the statistics. """
+        with self._lock:
+            for _, _, path in self._entries():
+                with contextlib.suppress(OSError):
+                    os.unlink(path)
+            self._evictions = 0
+            self._hits = 0
+            self._misses = 0
+            self._size = None if self._directory is None else 0
+            self._written = 0
+
+    def _info(self) -> CacheInfo:
+        # Assumes that the lock is held. The size is as of the last time that
+        # the directory was looked through, along with what this process has
+        # written since.
+        return CacheInfo(
+            budget=self._budget,
+            evictions=self._evictions,
+            hits=self._hits,
+            misses=self._misses,
+            size=(self._size or 0) + self._written
+        )
+
+    def _statistics(self) -> CacheInfo:
+        # As kept by `RenderStats`, for every frame (or segment) compiled,
+        # which never looks through the directory.
+        with self._lock:
+            return self._info()
+
+    def info(self) -> CacheInfo:
+        # The directory is looked through for its size, since other processes
+        # may have written to it since.
+        with self._lock:
+            if self._directory is not None:
+                self._size = sum(entry_size for _, entry_size, _ in self._entries())
+                self._written = 0
+            return self._info()
+
+
+class FrameCache(_DiskCache):
+    """
+    Keeps the frames that are drawn in a directory on disk, so that a frame
+    that's drawn the same way again, by this process or any other (such as
+    when a video is compiled again after part of it was changed), is read
+    back instead of being drawn. Frames are looked up by a hash of everything
+    that decides what's drawn on them: the contents of the file of every
+    visible image, where each one is drawn, its scale and layer, the order
+    that they're drawn in, and the size of the canvas. A frame with an image
+    that doesn't come from a file (through `ImageFileReference`) is always
+    drawn.
+
+    Nothing is cached until `directory` is set. Any number of processes can
+    share the directory at once, since each frame is written to a file of its
+    own, which only appears once it's whole. The least recently used frames
+    are removed once the frames in the directory go over the budget, which
+    they may do for a short while with several processes writing to it.
+
+    :param directory: `(str | Path)` The directory that the frames are kept
+        in, which is created if it doesn't exist. Only the frames in it are
+        ever removed.
+    :param budget: `(int)` The maximum number of bytes of frames to keep in
+        the directory. Each frame takes three bytes per pixel.
+    """
+
+    __slots__ = ("_sources",)
+
+    _extension = ".rgb"
+    _file_name = re.compile(r"[0-9a-f]{64}\.rgb")
+
+    _sources: Dict[Tuple[str, int, int], str]
+
+    def __init__(self, directory: Optional[Union[str, Path]], budget: int):
+        super().__init__(directory, budget)
+        self._sources = {}
+
+    def load(self, key: str, size: int) -> Optional[bytes]:
+        """
+        Returns the raw RGB buffer of the frame with the given key, or None if
+        it isn't in the cache, or isn't `size` bytes long.
+        """
+        buffer = None
+        if self._directory is not None:
+            path = self._path(key)
+            try:
+                with tracing.span("read frame", "cache"):
+                    buffer = path.read_bytes()
+            except OSError:
+                pass
+            if buffer is not None and len(buffer) != size:
+                buffer = None
+
+        if buffer is not None:
+            self._touch(path)
+        self._count(buffer is not None)
+        return buffer
+
+    def save(self, key: str, buffer: bytes):
+        """ Keeps the raw RGB buffer of the frame with the given key. """
+        with tracing.span("write frame", "cache"):
+            self._keep(key, len(buffer), lambda file: file.write(buffer))
+
+    def source(self, file: Path) -> str:
+        """
+        A hash of the contents of an image file, which is only read again once
+        it changes on disk.
+        """
+        key = DecodedImageCache._key(file)
+        with self._lock:
+            digest = self._sources.get(key)
+        if digest is None:
+            digest = hashlib.sha256(Path(key[0]).read_bytes()).hexdigest()
+            with self._lock:
+                self._sources[key] = digest
+        return digest
+
+
+class SegmentCache(_DiskCache):
+    """
+    Keeps the segments of videos compiled with `segments` (see
+    `compile_video`) in a directory on disk, once they're encoded, so that a
+    segment that's made of the same frames as before is copied into the video
+    instead of being drawn and encoded again. After a change to part of a
+    video, only the segments that it changes are encoded again, and every
+    segment is joined into the video without being encoded again either way.
+
+    Segments are looked up by a hash of the frames in them (each by the same
+    hash as in `caches.frames`, along with where it starts in the segment),
+    the encoder profile, the frame rate and size of the video, and how the
+    frames are handed to ffmpeg. A segment with a frame that can't be hashed
+    (see FrameCache) is always compiled. Segments only line up with those of
+    an earlier video if it was split the same way, so the more segments a
+    video is split into, the less of it is encoded again after a change.
+
+    Nothing is cached until `directory` is set, and the directory can be
+    shared in the same way as that of FrameCache.
+
+    :param directory: `(str | Path)` The directory that the segments are kept
+        in, which is created if it doesn't exist. Only the segments in it are
+        ever removed.
+    :param budget: `(int)` The maximum number of bytes of segments to keep in
+        the directory.
+    """
+
+    __slots__ = ()
+
+    _extension = ".mp4"
+    _file_name = re.compile(r"[0-9a-f]{64}\.mp4")
+
+    def load(self, key: str, destination: Path) -> bool:
+        """
+        Copies the segment with the given key to `destination`, and returns
+        whether it was in the cache.
+        """
+        found = False
+        if self._directory is not None:
+            path = self._path(key)
+            try:
+                with tracing.span("read segment", "cache"):
+                    shutil.copyfile(path, destination)
+                found = True
+            except OSError:
+                pass
+
+        if found:
+            self._touch(path)
+        self._count(found)
+        return found
+
+    def save(self, key: str, source: Path):
+        """ Keeps a copy of the segment (the file at `source`) with the given key. """
+        try:
+            size = source.stat().st_size
+        except OSError:
+            return
+        with tracing.span("write segment", "cache"):
+            self._keep(key, size, lambda file: _copy_file(source, file))
+
+
+decoded_images = DecodedImageCache(_DEFAULT_DECODED_IMAGES_BUDGET)
+frames = FrameCache(None, _DEFAULT_FRAMES_BUDGET)
+segments = SegmentCache(None, _DEFAULT_SEGMENTS_BUDGET)
+sprites = SpriteCache(_DEFAULT_SPRITES_BUDGET)
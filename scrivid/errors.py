@@ -78,6 +78,10 @@ class DuplicateIDError(ScrividException):
         return _use_default_message_name(self)
 
 
+class IndexError(ScrividException):
+    ...
+
+
 @define(frozen=True)
 class InternalError(ScrividException):
     """
@@ -102,5 +106,19 @@ class OperatorError(ScrividException):
     ...
 
 
+class RenderCancelled(ScrividException):
+    """
+    An exception that is propagated when compiling a video is cancelled,
+    through its CancelToken.
+    """
+
+
+class RenderInProgress(ScrividException):
+    """
+    An exception that is propagated when a resumable video is compiled while
+    another render is already compiling it, into the same location.
+    """
+
+
 class TypeError(ScrividException):
     ...
@@ -4,14 +4,37 @@ from . import errors
 from ._utils.sentinel_objects import sentinel
 
 from pathlib import Path
+import re
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
-    from typing import Tuple, Union
+    from typing import Optional, Tuple, Union
 
 
 _NOT_SPECIFIED = sentinel("_NOT_SPECIFIED")
 
+_X26X_PRESETS = (
+    "ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow", "placebo"
+)
+
+# The settings that each supported codec accepts, as (presets, tunes, highest
+# CRF value, the options that close every GOP). libx265 ignores ffmpeg's own
+# `cgop` flag, so it's told through its own parameters instead.
+_CODECS = {
+    "libx264": (
+        _X26X_PRESETS,
+        ("film", "animation", "grain", "stillimage", "fastdecode", "zerolatency", "psnr", "ssim"),
+        51,
+        {"flags": "+cgop"}
+    ),
+    "libx265": (
+        _X26X_PRESETS,
+        ("animation", "grain", "fastdecode", "zerolatency", "psnr", "ssim"),
+        51,
+        {"x265-params": "open-gop=0"}
+    ),
+}
+
 
 def _check_attribute_presense(metadata, name):
     value = getattr(metadata, name, _NOT_SPECIFIED)
@@ -33,6 +56,10 @@ def _is_specified(obj):
 
 
 class _TypeValidatingCallables:
+    @staticmethod
+    def bitrate(value):
+        return isinstance(value, str) and re.fullmatch(r"\d+(\.\d+)?[kKM]?", value) is not None
+
     @staticmethod
     def int_(value):
         return isinstance(value, int) and not isinstance(value, bool)
@@ -45,6 +72,10 @@ class _TypeValidatingCallables:
     def str_or_path(value):
         return isinstance(value, str) or isinstance(value, Path)
 
+    @staticmethod
+    def str_or_encoder_profile(value):
+        return isinstance(value, str) or isinstance(value, EncoderProfile)
+
     @staticmethod
     def tuple_of_two_ints(value):
         return (
@@ -55,6 +86,141 @@ class _TypeValidatingCallables:
         )
 
 
+class EncoderProfile:
+    """
+    The settings that ffmpeg encodes a video with. Either `crf` (constant
+    quality) or `bitrate` can be given, but not both. The settings left as None
+    are left to ffmpeg's defaults.
+
+    Some profiles are built in, and can be given to `Metadata` by their name
+    instead: "default" (the same settings as before profiles were added),
+    "draft", "balanced" and "archive".
+
+    :param codec: `(str)` The video codec, either "libx264" or "libx265".
+    :param crf: `(int)` The constant rate factor, where lower is better
+        quality.
+    :param bitrate: `(str)` The target bitrate, such as "4M".
+    :param preset: `(str)` The encoder preset, from "ultrafast" to "placebo",
+        trading speed for size.
+    :param tune: `(str)` The encoder tuning, such as "animation" or
+        "stillimage" (the latter being libx264 only).
+    :param gop: `(int)` The maximum number of frames between keyframes.
+    :param threads: `(int)` The number of threads the encoder may use, where
+        0 lets it decide.
+    :param closed_gop: `(bool)` Whether every GOP is closed, so that no frame
+        refers to one from before the keyframe it follows. Defaults to False.
+    """
+
+    __slots__ = ("bitrate", "closed_gop", "codec", "crf", "gop", "preset", "threads", "tune")
+
+    def __init__(
+        self,
+        *,
+        codec: str = "libx264",
+        crf: Optional[int] = None,
+        bitrate: Optional[str] = None,
+        preset: Optional[str] = None,
+        tune: Optional[str] = None,
+        gop: Optional[int] = None,
+        threads: Optional[int] = None,
+        closed_gop: bool = False
+    ):
+        self.bitrate = bitrate
+        self.closed_gop = closed_gop
+        self.codec = codec
+        self.crf = crf
+        self.gop = gop
+        self.preset = preset
+        self.threads = threads
+        self.tune = tune
+
+    def __repr__(self):
+        codec = self.codec
+        crf = self.crf
+        bitrate = self.bitrate
+        preset = self.preset
+        tune = self.tune
+        gop = self.gop
+        threads = self.threads
+        closed_gop = self.closed_gop
+
+        return (
+            f"{self.__class__.__name__}({codec=}, {crf=}, {bitrate=}, {preset=}, {tune=}, {gop=}, {threads=}, "
+            f"{closed_gop=})"
+        )
+
+    def _with_closed_gop(self) -> EncoderProfile:
+        return EncoderProfile(
+            codec=self.codec,
+            crf=self.crf,
+            bitrate=self.bitrate,
+            preset=self.preset,
+            tune=self.tune,
+            gop=self.gop,
+            threads=self.threads,
+            closed_gop=True
+        )
+
+    def _output_settings(self) -> dict:
+        # The options passed on to ffmpeg for the output file.
+        settings = {}
+        if self.bitrate is not None:
+            settings["b:v"] = self.bitrate
+        settings["vcodec"] = self.codec
+        settings["pix_fmt"] = "yuv420p"
+        for name, value in (
+                ("crf", self.crf), ("preset", self.preset), ("tune", self.tune), ("g", self.gop),
+                ("threads", self.threads)
+        ):
+            if value is not None:
+                settings[name] = value
+        if self.closed_gop:
+            _, _, _, closed_gop_settings = _CODECS[self.codec]
+            settings.update(closed_gop_settings)
+        return settings
+
+    def _validate(self):
+        if self.codec not in _CODECS:
+            raise errors.AttributeError(
+                f"Encoder profile attribute \'codec\' must be one of {', '.join(_CODECS)}; got {self.codec!r}."
+            )
+        presets, tunes, highest_crf, _ = _CODECS[self.codec]
+
+        if self.crf is not None and self.bitrate is not None:
+            raise errors.ConflictingAttributesError(
+                first_name="crf", first_value=self.crf, second_name="bitrate", second_value=self.bitrate
+            )
+        if self.crf is not None and not (_TypeValidatingCallables.int_(self.crf) and 0 <= self.crf <= highest_crf):
+            raise errors.AttributeError(
+                f"Encoder profile attribute \'crf\' must be an integer from 0 to {highest_crf} for {self.codec}."
+            )
+        if self.bitrate is not None and not _TypeValidatingCallables.bitrate(self.bitrate):
+            raise errors.AttributeError(
+                "Encoder profile attribute \'bitrate\' must be a number of bits per second, such as \'4M\'."
+            )
+        for name, choices in (("preset", presets), ("tune", tunes)):
+            value = getattr(self, name)
+            if value is not None and value not in choices:
+                raise errors.AttributeError(
+                    f"Encoder profile attribute \'{name}\' must be one of {', '.join(choices)} for {self.codec}; got "
+                    f"{value!r}."
+                )
+        if self.gop is not None and not (_TypeValidatingCallables.int_(self.gop) and self.gop > 0):
+            raise errors.AttributeError("Encoder profile attribute \'gop\' must be a positive integer.")
+        if self.threads is not None and not (_TypeValidatingCallables.int_(self.threads) and self.threads >= 0):
+            raise errors.AttributeError("Encoder profile attribute \'threads\' must be a non-negative integer.")
+        if not isinstance(self.closed_gop, bool):
+            raise errors.AttributeError("Encoder profile attribute \'closed_gop\' must be a boolean.")
+
+
+ENCODER_PROFILES = {
+    "default": EncoderProfile(bitrate="4M"),
+    "draft": EncoderProfile(crf=30, preset="ultrafast", tune="fastdecode"),
+    "balanced": EncoderProfile(crf=23, preset="medium", tune="animation"),
+    "archive": EncoderProfile(crf=16, preset="slower", tune="animation"),
+}
+
+
 class Metadata:
     """
     Metadata stores all of the attributes for a Scrivid-generated video.
@@ -72,9 +238,12 @@ class Metadata:
         generated.
     :param window_size: `(tuple[int, int])` A tuple of (width, height) for the
         dimensions of the video.
+    :param encoder_profile: `(str | EncoderProfile)` The settings that the
+        video is encoded with, or the name of a built-in profile (see
+        `EncoderProfile`). Defaults to "default".
     """
 
-    __slots__ = ("_window_size", "frame_rate", "save_location", "video_name")
+    __slots__ = ("_window_size", "encoder_profile", "frame_rate", "save_location", "video_name")
 
     _window_size: Tuple[int, int]
 
@@ -84,12 +253,15 @@ class Metadata:
         frame_rate: Union[int, _NOT_SPECIFIED] = _NOT_SPECIFIED,
         save_location: Union[str, Path, _NOT_SPECIFIED] = _NOT_SPECIFIED,
         video_name: Union[str, _NOT_SPECIFIED] = _NOT_SPECIFIED,
-        window_size: Union[Tuple[int, int], _NOT_SPECIFIED] = _NOT_SPECIFIED
+        window_size: Union[Tuple[int, int], _NOT_SPECIFIED] = _NOT_SPECIFIED,
+        encoder_profile: Union[str, EncoderProfile] = "default"
     ):
         if isinstance(save_location, str):
             save_location = Path(save_location)
         self.save_location = save_location
 
+        self.encoder_profile = encoder_profile
+
         self._window_size = window_size
         self.frame_rate = frame_rate
         self.video_name = video_name
@@ -118,6 +290,11 @@ class Metadata:
         else:
             return self._window_size[0]
 
+    def _encoder_profile(self) -> EncoderProfile:
+        if isinstance(self.encoder_profile, str):
+            return ENCODER_PROFILES[self.encoder_profile]
+        return self.encoder_profile
+
     def _validate(self):
         _check_attribute_presense(self, "frame_rate")
         _check_attribute_presense(self, "save_location")
@@ -131,3 +308,18 @@ class Metadata:
 
         if self.window_width % 2 != 0 or self.window_height % 2 != 0:
             raise errors.AttributeError("Metadata attribute \'window_size\' must contain even numbers.")
+
+        _check_attribute_type(
+            self, "encoder_profile", "str, EncoderProfile", _TypeValidatingCallables.str_or_encoder_profile
+        )
+        if isinstance(self.encoder_profile, str) and self.encoder_profile not in ENCODER_PROFILES:
+            raise errors.AttributeError(
+                f"Metadata attribute \'encoder_profile\' must be one of {', '.join(ENCODER_PROFILES)}, or an "
+                f"EncoderProfile; got {self.encoder_profile!r}."
+            )
+        self._encoder_profile()._validate()
+
+    def _validate_window_size(self):
+        # Drawing the frames by themselves only requires the window size.
+        _check_attribute_presense(self, "window_size")
+        _check_attribute_type(self, "window_size", "tuple[int, int]", _TypeValidatingCallables.tuple_of_two_ints)
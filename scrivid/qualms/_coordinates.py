@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from .._utils import scale_dimensions
+
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -12,8 +14,9 @@ class ImageCoordinates:
     def __init__(self, image: ImageReference):
         x = image.x
         y = image.y
+        width, height = scale_dimensions(image.get_image_width(), image.get_image_height(), image.scale)
 
         self.x = x
-        self.x_prime = x + image.get_image_width()
+        self.x_prime = x + width
         self.y = y
-        self.y_prime = y + image.get_image_height()
+        self.y_prime = y + height
@@ -0,0 +1,253 @@
+from functions import get_current_directory
+
+from scrivid import caches, create_image_reference, errors, properties
+
+import os
+import shutil
+
+from PIL import Image
+import pytest
+
+
+directory = get_current_directory() / "images"
+
+IMAGE_SIZE = 255 * 255 * 3
+
+
+@pytest.fixture
+def cache():
+    yield caches.DecodedImageCache(10 * IMAGE_SIZE)
+
+
+def test_decoded_image_cache_budget_validation():
+    with pytest.raises(errors.TypeError):
+        caches.DecodedImageCache(-1)
+
+
+def test_decoded_image_cache_eviction(cache):
+    cache.budget = 2 * IMAGE_SIZE
+    cache.open(directory / "img1.png")
+    cache.open(directory / "img2.png")
+    cache.open(directory / "img1.png")  # img1 is now the most recently used.
+    cache.open(directory / "img3.png")  # So img2 is the one that's evicted.
+
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions) == (1, 3, 1)
+    assert info.size == 2 * IMAGE_SIZE
+
+    cache.open(directory / "img1.png")
+    cache.open(directory / "img2.png")
+    assert (cache.info().hits, cache.info().misses) == (2, 4)
+
+
+def test_decoded_image_cache_hits(cache):
+    first = cache.open(directory / "img1.png")
+    second = cache.open(directory / "img1.png")
+
+    assert first is second
+    assert cache.info().hits == 1
+    assert cache.info().misses == 1
+    assert cache.info().hit_rate == 0.5
+
+
+def test_decoded_image_cache_image_over_budget(cache):
+    cache.budget = IMAGE_SIZE - 1
+    cache.open(directory / "img1.png")
+
+    assert len(cache) == 0
+    assert cache.info().size == 0
+
+
+def test_decoded_image_cache_modified_file(cache, tmp_path):
+    file = tmp_path / "img.png"
+    shutil.copy(directory / "img1.png", file)
+    first = cache.open(file)
+
+    shutil.copy(directory / "img2.png", file)
+    stat = os.stat(file)
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    second = cache.open(file)
+
+    assert first is not second
+    assert second.tobytes() != first.tobytes()
+
+
+def test_decoded_image_shared_between_references():
+    caches.decoded_images.clear()
+    a = create_image_reference("a", directory / "img1.png")
+    b = create_image_reference("b", directory / "img1.png")
+    a.open()
+    b.open()
+
+    assert a.get_image() is b.get_image()
+    assert caches.decoded_images.info().hits == 1
+
+    # Closing one reference must not affect the image of the other.
+    a.close()
+    assert b.get_image().getpixel((0, 0)) is not None
+
+
+@pytest.fixture
+def sprite_cache():
+    yield caches.SpriteCache(10 * IMAGE_SIZE)
+
+
+@pytest.fixture
+def source_image():
+    with Image.open(directory / "img1.png") as image:
+        image.load()
+        yield image
+
+
+def test_sprite_cache_resize(sprite_cache, source_image):
+    sprite = sprite_cache.resize(source_image, 0.5)
+
+    assert sprite.size == (128, 128)
+    assert sprite.tobytes() == source_image.resize((128, 128), Image.Resampling.LANCZOS).tobytes()
+
+
+def test_sprite_cache_quantised_scale(sprite_cache, source_image):
+    first = sprite_cache.resize(source_image, 0.1 + 0.2)
+    second = sprite_cache.resize(source_image, 0.3)
+
+    assert first is second
+    assert (sprite_cache.info().hits, sprite_cache.info().misses) == (1, 1)
+
+
+def test_sprite_cache_resample_filter(sprite_cache, source_image):
+    lanczos = sprite_cache.resize(source_image, 2)
+    nearest = sprite_cache.resize(source_image, 2, Image.Resampling.NEAREST)
+
+    assert lanczos is not nearest
+    assert sprite_cache.info().misses == 2
+
+
+def test_sprite_cache_unscaled(sprite_cache, source_image):
+    assert sprite_cache.resize(source_image, 1) is source_image
+    assert sprite_cache.resize(source_image, properties.EXCLUDED) is source_image
+    assert len(sprite_cache) == 0
+
+
+def test_sprite_cache_vanishing_scale(sprite_cache, source_image):
+    assert sprite_cache.resize(source_image, 0) is None
+    assert sprite_cache.resize(source_image, 0.001) is None
+
+
+FRAME_SIZE = 4 * 4 * 3
+
+
+def frame_key(number):
+    return f"{number:064x}"
+
+
+@pytest.fixture
+def frame_cache(tmp_path):
+    yield caches.FrameCache(tmp_path / "frames", 10 * FRAME_SIZE)
+
+
+def test_frame_cache_disabled():
+    cache = caches.FrameCache(None, 10 * FRAME_SIZE)
+    cache.save(frame_key(1), bytes(FRAME_SIZE))
+
+    assert cache.load(frame_key(1), FRAME_SIZE) is None
+    assert len(cache) == 0
+
+
+def test_frame_cache_validation():
+    with pytest.raises(errors.TypeError):
+        caches.FrameCache(None, -1)
+    with pytest.raises(errors.TypeError):
+        caches.FrameCache(1, FRAME_SIZE)
+
+
+def test_frame_cache_hits(frame_cache):
+    assert frame_cache.load(frame_key(1), FRAME_SIZE) is None
+    frame_cache.save(frame_key(1), bytes(range(FRAME_SIZE)))
+
+    assert frame_cache.load(frame_key(1), FRAME_SIZE) == bytes(range(FRAME_SIZE))
+    # A frame of another size is never handed out.
+    assert frame_cache.load(frame_key(1), 2 * FRAME_SIZE) is None
+    assert (frame_cache.info().hits, frame_cache.info().misses) == (1, 2)
+    assert frame_cache.info().size == FRAME_SIZE
+
+
+def test_frame_cache_shared_between_processes(frame_cache):
+    # Another process is another instance, with the same directory.
+    other = caches.FrameCache(frame_cache.directory, frame_cache.budget)
+    frame_cache.save(frame_key(1), bytes(FRAME_SIZE))
+
+    assert other.load(frame_key(1), FRAME_SIZE) == bytes(FRAME_SIZE)
+
+
+def test_frame_cache_eviction(frame_cache):
+    # Frames are evicted until they're down to 90% of the budget.
+    frame_cache.budget = 7 * FRAME_SIZE // 2
+    for number in range(3):
+        frame_cache.save(frame_key(number), bytes(FRAME_SIZE))
+        # The modification times of the frames are how recently they were
+        # used, which is set apart by a second each here.
+        path = frame_cache.directory / "00" / f"{frame_key(number)}.rgb"
+        os.utime(path, (number, number))
+
+    frame_cache.load(frame_key(0), FRAME_SIZE)  # The first is now the most recently used.
+    frame_cache.save(frame_key(3), bytes(FRAME_SIZE))  # So the second is evicted.
+
+    assert frame_cache.load(frame_key(1), FRAME_SIZE) is None
+    assert frame_cache.load(frame_key(0), FRAME_SIZE) is not None
+    assert frame_cache.info().evictions == 1
+    assert len(frame_cache) == 3
+
+
+def test_frame_cache_statistics(frame_cache, monkeypatch):
+    frame_cache.save(frame_key(1), bytes(FRAME_SIZE))
+    frame_cache.load(frame_key(1), FRAME_SIZE)
+    frame_cache.load(frame_key(2), FRAME_SIZE)
+
+    # The statistics kept while compiling a video come from this process, and
+    # never from looking through the directory.
+    def entries(self):
+        raise AssertionError("The directory was looked through.")
+
+    monkeypatch.setattr(caches.FrameCache, "_entries", entries)
+    statistics = frame_cache._statistics()
+    assert (statistics.hits, statistics.misses, statistics.size) == (1, 1, FRAME_SIZE)
+
+
+def test_frame_cache_clear(frame_cache):
+    frame_cache.save(frame_key(1), bytes(FRAME_SIZE))
+    other_file = frame_cache.directory / "notes.txt"
+    other_file.write_text("Not a frame.")
+    frame_cache.clear()
+
+    assert len(frame_cache) == 0
+    assert other_file.exists()
+    assert frame_cache.load(frame_key(1), FRAME_SIZE) is None
+
+
+def test_segment_cache(tmp_path):
+    cache = caches.SegmentCache(tmp_path / "segments", 1024)
+    segment = tmp_path / "segment.mp4"
+    segment.write_bytes(b"segment")
+    destination = tmp_path / "copy.mp4"
+
+    assert not cache.load(frame_key(1), destination)
+    cache.save(frame_key(1), segment)
+    assert cache.load(frame_key(1), destination)
+
+    assert destination.read_bytes() == b"segment"
+    assert (cache.info().hits, cache.info().misses, cache.info().size) == (1, 1, len(b"segment"))
+
+
+def test_segment_cache_separate_from_frames(tmp_path):
+    # Both kinds of cache can share a directory, without touching each other's
+    # files.
+    segment_cache = caches.SegmentCache(tmp_path, 1024)
+    frame_cache = caches.FrameCache(tmp_path, 1024)
+    segment = tmp_path / "segment.mp4"
+    segment.write_bytes(b"segment")
+
+    segment_cache.save(frame_key(1), segment)
+    frame_cache.save(frame_key(2), bytes(FRAME_SIZE))
+    segment_cache.clear()
+
+    assert (len(segment_cache), len(frame_cache)) == (0, 1)
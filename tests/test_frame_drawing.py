@@ -0,0 +1,415 @@
+from functions import get_current_directory
+from samples import figure_eight, image_drawing
+
+from scrivid import (
+    adjustments, caches, create_image_reference, errors, ImageFileReference, ImageReference, motion_tree, properties
+)
+from scrivid._separating_instructions import separate_instructions
+from scrivid._video_crafting._frame_drawing import (
+    _draw_on_frame, _layer_references, create_frame, draw_frame, draw_frames, drawn_ranges, fill_undrawn_frames,
+    generate_frame_range, generate_frames
+)
+from scrivid._video_crafting._frame_files import FrameWriter
+from scrivid._video_crafting._frame_info import CanvasPool, FrameInfo
+from scrivid._video_crafting._frame_states import FrameStates
+from scrivid._video_crafting._parallel_drawing import draw_frames_in_parallel
+from scrivid._video_crafting._preview import Preview
+from scrivid._video_crafting._render_stats import RenderStats
+from scrivid._video_crafting._video_stitching import LISTED_FRAME_RATE
+
+import os
+
+from PIL import Image
+import pytest
+
+
+# ALIAS
+parametrize = pytest.mark.parametrize
+
+
+directory = get_current_directory() / "images"
+
+
+class PixelOnlyFileReference:
+    # Stands in for a FileAccess-like class that can't hand over its image as
+    # a whole, so that the per-pixel fallback is used.
+    def __init__(self, file):
+        self._file = ImageFileReference(file)
+
+    @property
+    def is_opened(self):
+        return self._file.is_opened
+
+    def get_image_height(self):
+        return self._file.get_image_height()
+
+    def get_image_width(self):
+        return self._file.get_image_width()
+
+    def get_pixel_value(self, coordinates):
+        return self._file.get_pixel_value(coordinates)
+
+    def open(self):
+        self._file.open()
+
+    def close(self):
+        self._file.close()
+
+
+class CrashingFileReference:
+    # Takes down the worker process that tries to open it.
+    def __init__(self, file):
+        self._file = file
+
+    @property
+    def is_opened(self):
+        return False
+
+    def open(self):
+        os._exit(1)
+
+    def close(self):
+        pass
+
+
+class _FreshCanvasPool(CanvasPool):
+    # Always hands out a blank canvas, so that every frame is drawn in full.
+    def acquire(self):
+        canvas = super().acquire()
+        canvas.clear()
+        return canvas
+
+
+def as_tuple(properties_):
+    return tuple(getattr(properties_, attr) for attr in properties_.__slots__)
+
+
+def state_of(frame_states):
+    return [as_tuple(reference._properties) for reference in frame_states.references()]
+
+
+def draw(reference, window_size):
+    canvas = CanvasPool(window_size).acquire()
+    _draw_on_frame(canvas, _layer_references([reference]))
+    return canvas._canvas
+
+
+@parametrize("x, y", [(20, 30), (-100, -40), (150, 180), (-300, 10)], ids=["inside", "top_left", "bottom_right", "off"])
+def test_draw_region_matches_pixels(x, y):
+    region = create_image_reference(0, directory / "img1.png", layer=1, x=x, y=y)
+    pixels = ImageReference(
+        1, PixelOnlyFileReference(directory / "img1.png"), properties.create(layer=1, x=x, y=y)
+    )
+
+    assert draw(region, (300, 300)).tobytes() == draw(pixels, (300, 300)).tobytes()
+
+
+def test_draw_region_clipped_to_canvas():
+    reference = create_image_reference(0, directory / "img1.png", layer=1, x=-200, y=-200)
+    canvas = draw(reference, (100, 100))
+
+    # The image covers (-200, -200) to (55, 55). Nothing should wrap around to
+    # the other side of the canvas.
+    assert canvas.getpixel((99, 99)) == (255, 255, 255)
+    assert canvas.crop((0, 0, 55, 55)).tobytes() == reference.get_image().crop((200, 200, 255, 255)).tobytes()
+
+
+def draw_all(references, window_size):
+    canvas = CanvasPool(window_size).acquire()
+    _draw_on_frame(canvas, _layer_references(references))
+    return canvas._canvas
+
+
+def test_draw_layer_order():
+    # Negative layers are drawn, and layers far apart cost nothing more than
+    # those next to each other.
+    below = create_image_reference("below", directory / "img1.png", layer=-5, x=0, y=0)
+    above = create_image_reference("above", directory / "img3.png", layer=1_000_000, x=0, y=0)
+
+    assert draw_all([below], (100, 100)).getpixel((10, 10)) == (10, 10, 10)
+    assert draw_all([above, below], (100, 100)).getpixel((10, 10)) == (10, 10, 255)
+
+
+def test_draw_order_within_layer():
+    # References on the same layer are drawn in the order that they're given
+    # in, with the last one on top.
+    first = create_image_reference("first", directory / "img1.png", layer=1, x=0, y=0)
+    second = create_image_reference("second", directory / "img3.png", layer=1, x=0, y=0)
+
+    assert draw_all([first, second], (100, 100)).getpixel((10, 10)) == (10, 10, 255)
+    assert draw_all([second, first], (100, 100)).getpixel((10, 10)) == (10, 10, 10)
+
+
+@parametrize("sample_module", [figure_eight, image_drawing], ids=["figure_eight", "image_drawing"])
+def test_frame_states_step_matches_replay(sample_module):
+    instructions, _ = sample_module.ALL()
+    split_instructions = separate_instructions(instructions)
+    stepped = FrameStates(split_instructions)
+
+    for index in range(50):
+        stepped.step(index)
+        replayed = FrameStates(split_instructions)
+        replayed.step(index)
+
+        assert state_of(stepped) == state_of(replayed)
+
+
+def test_frame_states_leave_instructions_unmodified():
+    instructions, _ = figure_eight.ALL()
+    split_instructions = separate_instructions(instructions)
+    original = [as_tuple(reference._properties) for reference in split_instructions.references.values()]
+
+    with FrameStates(split_instructions) as frame_states:
+        frame_states.step(20)
+        assert state_of(frame_states) != original
+
+    assert [as_tuple(reference._properties) for reference in split_instructions.references.values()] == original
+
+
+def test_canvas_pool_reuses_canvas():
+    reference = create_image_reference(0, directory / "img1.png", layer=1, x=0, y=0)
+    reference.open()
+
+    pool = CanvasPool((100, 100))
+    canvas = pool.acquire()
+    canvas.paste(reference.get_image(), (0, 0))
+    pool.release(canvas)
+
+    reused = pool.acquire()
+    assert reused is canvas
+    reused.clear()
+    assert reused._canvas.getcolors() == [(100 * 100, (255, 255, 255))]
+    assert reused.contents == {}
+
+
+@parametrize("sample_module", [figure_eight, image_drawing], ids=["figure_eight", "image_drawing"])
+@parametrize("order", ["forwards", "backwards"])
+def test_redrawn_regions_match_full_draw(sample_module, order):
+    instructions, metadata = sample_module.ALL()
+    split_instructions = separate_instructions(instructions)
+    frames, _ = generate_frames(motion_tree.parse(split_instructions), None)
+    if order == "backwards":
+        frames.reverse()
+
+    with FrameStates(split_instructions) as frame_states:
+        canvas_pool = CanvasPool(metadata.window_size)
+        redrawn = [buffer for _, buffer in draw_frames(frames, frame_states, canvas_pool)]
+        full = [buffer for _, buffer in draw_frames(frames, frame_states, _FreshCanvasPool(metadata.window_size))]
+
+    assert redrawn == full
+
+
+def test_unchanged_frame_draws_nothing():
+    reference = create_image_reference(0, directory / "img1.png", layer=1, x=0, y=0)
+    split_instructions = separate_instructions([reference])
+    frames = [FrameInfo(0, None), FrameInfo(1, None)]
+
+    with FrameStates(split_instructions) as frame_states:
+        canvas = CanvasPool((300, 300)).acquire()
+        draw_frame(frames[0], frame_states, canvas)
+        # Anything drawn over the unchanged reference would be left as is.
+        canvas.clear_region((0, 0, 10, 10))
+        draw_frame(frames[1], frame_states, canvas)
+
+    assert canvas._canvas.getpixel((0, 0)) == (255, 255, 255)
+
+
+def test_draw_frames_in_parallel_matches_serial():
+    instructions, metadata = figure_eight.ALL()
+    split_instructions = separate_instructions(instructions)
+    frames, _ = generate_frames(motion_tree.parse(split_instructions), None)
+
+    with FrameStates(split_instructions) as frame_states:
+        canvas_pool = CanvasPool(metadata.window_size)
+        serial = [(frame.index, buffer) for frame, buffer in draw_frames(frames, frame_states, canvas_pool)]
+    parallel = [
+        (frame.index, buffer)
+        for frame, buffer in draw_frames_in_parallel(frames, split_instructions, metadata.window_size, 2, save=None)
+    ]
+
+    assert serial == parallel
+
+
+def test_draw_frames_in_parallel_without_stats(monkeypatch):
+    # Without statistics to add them to, the workers never look at the caches.
+    def cache_infos():
+        raise AssertionError("The caches were looked at.")
+
+    monkeypatch.setattr(RenderStats, "_cache_infos", staticmethod(cache_infos))
+    instructions, metadata = figure_eight.ALL()
+    split_instructions = separate_instructions(instructions)
+    frames, _ = generate_frames(motion_tree.parse(split_instructions), None)
+    drawn_frames = draw_frames_in_parallel(frames, split_instructions, metadata.window_size, 2, save=None)
+
+    assert len(list(drawn_frames)) == len(frames)
+
+
+def test_draw_frames_in_parallel_worker_crash():
+    reference = ImageReference(0, CrashingFileReference(""), properties.create(layer=1, x=0, y=0))
+    split_instructions = separate_instructions([reference])
+    frames, _ = generate_frames(motion_tree.parse(split_instructions), None)
+
+    with pytest.raises(errors.InternalError):
+        list(draw_frames_in_parallel(frames, split_instructions, (10, 10), 2, save=None))
+
+
+@parametrize("scale", [0.5, 1.5], ids=["shrink", "grow"])
+def test_draw_scaled(scale):
+    reference = create_image_reference(0, directory / "img1.png", layer=1, scale=scale, x=10, y=20)
+    reference.open()
+    canvas = draw(reference, (500, 500))
+
+    size = (round(255 * scale), round(255 * scale))
+    expected = reference.get_image().resize(size, Image.Resampling.LANCZOS)
+    assert canvas.crop((10, 20, 10 + size[0], 20 + size[1])).tobytes() == expected.tobytes()
+    assert canvas.getpixel((9 + size[0] + 1, 20)) == (255, 255, 255)
+
+
+@parametrize("scale", [0.5, 1.5], ids=["shrink", "grow"])
+def test_draw_scaled_pixels(scale):
+    reference = ImageReference(
+        1, PixelOnlyFileReference(directory / "img1.png"), properties.create(layer=1, scale=scale, x=10, y=20)
+    )
+    canvas = draw(reference, (500, 500))
+
+    size = (round(255 * scale), round(255 * scale))
+    expected = reference._file._file.get_image().resize(size, Image.Resampling.NEAREST)
+    assert canvas.crop((10, 20, 10 + size[0], 20 + size[1])).tobytes() == expected.tobytes()
+
+
+def test_draw_zoom_resizes_once_per_scale():
+    instructions = [
+        create_image_reference("zoom", directory / "img1.png", layer=1, scale=1, x=0, y=0),
+        adjustments.move.create("zoom", 0, properties.Properties(scale=1), 10),
+    ]
+    split_instructions = separate_instructions(instructions)
+    frames, _ = generate_frames(motion_tree.parse(split_instructions), None)
+    caches.sprites.clear()
+
+    with FrameStates(split_instructions) as frame_states:
+        scales = set()
+        for frame, _ in draw_frames(frames, frame_states, CanvasPool((600, 600))):
+            scales.add(round(next(frame_states.references()).scale, 2))
+
+    assert caches.sprites.info().misses == len(scales - {1})
+
+
+def test_fill_undrawn_frames_holds_without_copies(tmp_path):
+    instructions, metadata = image_drawing.ALL()
+    split_instructions = separate_instructions(instructions)
+    frames, video_length = generate_frames(motion_tree.parse(split_instructions), tmp_path)
+
+    with FrameStates(split_instructions) as frame_states, CanvasPool(metadata.window_size) as canvas_pool:
+        with FrameWriter("png", None, metadata.window_size) as frame_writer:
+            for frame in frames:
+                create_frame(frame, frame_states, canvas_pool, frame_writer)
+    frame_list = fill_undrawn_frames(frames, tmp_path, 0, video_length)
+
+    assert len(list(tmp_path.glob("*.png"))) == len(frames) < video_length
+    durations = [float(line.split()[1]) for line in frame_list.read_text().splitlines() if line.startswith("duration")]
+    assert round(sum(durations) * LISTED_FRAME_RATE) == video_length
+
+
+@parametrize("frame_format, compress_level", [("png", 1), ("bmp", None), ("ppm", None), ("raw", None)])
+def test_frame_writer_formats(tmp_path, frame_format, compress_level):
+    image = Image.open(directory / "img1.png").convert("RGB")
+    buffers = [image.tobytes(), image.rotate(90).tobytes()]
+
+    with FrameWriter(frame_format, compress_level, image.size) as frame_writer:
+        for index, buffer in enumerate(buffers):
+            frame_writer.save(buffer, tmp_path / f"{index:06d}.{frame_format}")
+        encoded = frame_writer.encode(buffers[0])
+
+    # Every frame has been saved by the time the writer is closed.
+    for index, buffer in enumerate(buffers):
+        file = tmp_path / f"{index:06d}.{frame_format}"
+        if frame_format == "raw":
+            assert file.read_bytes() == buffer
+        else:
+            with Image.open(file) as saved:
+                assert saved.format == frame_format.upper()
+                assert saved.convert("RGB").tobytes() == buffer
+    assert encoded.result() == (tmp_path / f"000000.{frame_format}").read_bytes()
+
+
+def static_background_instructions():
+    return [
+        create_image_reference("background", directory / "img2.png", layer=1, x=0, y=0),
+        create_image_reference("sprite", directory / "img1.png", layer=2, x=100, y=100),
+        adjustments.move.create("sprite", 0, properties.Properties(x=60), 30),
+        adjustments.move.create("background", 20, properties.Properties(x=40), 1),
+    ]
+
+
+def test_static_layers_flattened_until_touched():
+    split_instructions = separate_instructions(static_background_instructions())
+    static_layers = FrameStates(split_instructions).static_layers
+    references = list(split_instructions.references.values())
+
+    assert static_layers.update(0, references, (300, 300))
+    assert static_layers.IDs == {"background"}
+    assert not any(static_layers.update(index, references, (300, 300)) for index in range(1, 20))
+
+    # The background is moved over frames 20 and 21, so it isn't flattened
+    # until it settles again.
+    assert not static_layers.update(20, references, (300, 300))
+    assert static_layers.IDs == frozenset()
+    assert static_layers.surface is None
+
+    assert static_layers.update(22, references, (300, 300))
+    assert static_layers.IDs == {"background"}
+
+
+def test_static_layers_match_full_draw():
+    split_instructions = separate_instructions(static_background_instructions())
+    frames, _ = generate_frames(motion_tree.parse(split_instructions), None)
+
+    with FrameStates(split_instructions) as frame_states:
+        flattened = [buffer for _, buffer in draw_frames(frames, frame_states, CanvasPool((300, 300)))]
+        full = []
+        for frame in frames:
+            frame_states.step(frame.index)
+            canvas = CanvasPool((300, 300)).acquire()
+            _draw_on_frame(canvas, _layer_references(frame_states.references()))
+            full.append(canvas.tobytes())
+
+    assert flattened == full
+
+
+@parametrize("preview_frame_rate", [1, 5, 6, 12])
+def test_preview_frames_show_the_same_time(preview_frame_rate):
+    instructions, metadata = figure_eight.ALL()
+    parsed_motion_tree = motion_tree.parse(separate_instructions(instructions))
+    view = Preview(frame_rate=preview_frame_rate)._validate(metadata)
+
+    ranges, video_length = drawn_ranges(parsed_motion_tree)
+    drawn = [index for range_ in ranges for index in range_]
+    shown = [max(index for index in drawn if index <= source) for source in range(video_length)]
+
+    frames, preview_length = generate_frame_range(parsed_motion_tree, None, view=view)
+    preview_drawn = [frame.index for frame in frames]
+    assert preview_length * metadata.frame_rate >= video_length * preview_frame_rate
+    for index in range(preview_length):
+        source = view.source_index(index)
+        previous = shown[view.source_index(index - 1)] if index else None
+        # A frame of the preview is drawn exactly when what it shows changes.
+        assert (index in preview_drawn) == (shown[source] != previous)
+
+
+def test_preview_draws_scaled_references():
+    reference = create_image_reference(0, directory / "img1.png", layer=1, scale=0.8, x=100, y=50)
+    metadata = figure_eight.ALL()[1]
+    view = Preview(scale=0.5)._validate(metadata)
+
+    with FrameStates(separate_instructions([reference]), view) as frame_states:
+        frame_states.step(0)
+        drawn = next(frame_states.references())
+
+    assert (drawn.x, drawn.y, drawn.scale) == (50, 25, 0.4)
+    assert view.metadata.window_size == (metadata.window_width // 2, metadata.window_height // 2)
+
+
+@parametrize("settings", [{"scale": 0}, {"scale": 1.5}, {"frame_rate": 0}, {"frame_rate": 1000}])
+def test_preview_validation(settings):
+    with pytest.raises(errors.TypeError):
+        Preview(**settings)._validate(figure_eight.ALL()[1])
@@ -1,5 +1,5 @@
 from functions import assemble_arguments
-from scrivid import errors, Metadata
+from scrivid import EncoderProfile, errors, Metadata
 
 import pytest
 
@@ -69,3 +69,61 @@ def test_window_attributes_exclusion():
     metadata = Metadata()
     assert metadata.window_height is None
     assert metadata.window_width is None
+
+
+@parametrize("encoder_profile", ["default", "draft", "balanced", "archive"])
+def test_encoder_profile_built_in(encoder_profile):
+    metadata = Metadata(**METADATA_DEFAULTS, encoder_profile=encoder_profile)
+    metadata._validate()
+
+
+def test_encoder_profile_default_settings():
+    # The default profile must encode videos the same way as before profiles
+    # existed.
+    settings = Metadata(**METADATA_DEFAULTS)._encoder_profile()._output_settings()
+    assert settings == {"b:v": "4M", "vcodec": "libx264", "pix_fmt": "yuv420p"}
+
+
+def test_encoder_profile_settings():
+    profile = EncoderProfile(
+        codec="libx265", crf=20, preset="slow", tune="animation", gop=60, threads=4, closed_gop=True
+    )
+    Metadata(**METADATA_DEFAULTS, encoder_profile=profile)._validate()
+    assert profile._output_settings() == {
+        "vcodec": "libx265", "pix_fmt": "yuv420p", "crf": 20, "preset": "slow", "tune": "animation", "g": 60,
+        "threads": 4, "x265-params": "open-gop=0"
+    }
+
+
+def test_encoder_profile_closed_gop_settings():
+    assert EncoderProfile(closed_gop=True)._output_settings()["flags"] == "+cgop"
+    assert "flags" not in EncoderProfile(codec="libx265", closed_gop=True)._output_settings()
+
+
+def test_encoder_profile_conflicting_rate_control():
+    metadata = Metadata(**METADATA_DEFAULTS, encoder_profile=EncoderProfile(crf=23, bitrate="4M"))
+    with pytest.raises(errors.ConflictingAttributesError):
+        metadata._validate()
+
+
+@parametrize("encoder_profile", [
+    "unknown",
+    FILL_VALUE,
+    EncoderProfile(codec="mpeg4"),
+    EncoderProfile(crf=52),
+    EncoderProfile(crf=2.5),
+    EncoderProfile(bitrate=4000),
+    EncoderProfile(bitrate="fast"),
+    EncoderProfile(preset="quick"),
+    EncoderProfile(codec="libx265", tune="stillimage"),
+    EncoderProfile(gop=0),
+    EncoderProfile(threads=-1),
+    EncoderProfile(closed_gop=1),
+], ids=[
+    "name", "type", "codec", "crf_range", "crf_type", "bitrate_type", "bitrate", "preset", "tune", "gop", "threads",
+    "closed_gop"
+])
+def test_encoder_profile_validation(encoder_profile):
+    metadata = Metadata(**METADATA_DEFAULTS, encoder_profile=encoder_profile)
+    with pytest.raises(errors.AttributeError):
+        metadata._validate()
@@ -336,3 +336,13 @@ def test_comparison_true(qualm, args):
 def test_message(qualm_cls, args, expected):
     qualm = qualm_cls(0, *args)
     assert str(qualm) == expected
+
+
+@categorize(category="qualms")
+@parametrize("scale,matches", [(1, False), (2, True)], ids=["unscaled", "scaled"])
+def test_out_of_range_scaled(scale, matches):
+    qualms_ = []
+    image = create_image_reference(1, directory / "img1.png", scale=scale, x=100, y=100)
+    qualms.OutOfRange.check(qualms_, 0, image, (500, 500))
+
+    assert (len(qualms_) == 1) is matches
@@ -2,6 +2,11 @@ from functions import assemble_arguments, categorize, get_current_directory, Tem
 from samples import empty, figure_eight, image_drawing, overlap, slide
 
 import scrivid
+from scrivid._video_crafting import _frame_drawing, _segments, _video_stitching
+
+import time
+
+import json
 
 import cv2 as opencv
 import imagehash
@@ -77,13 +82,771 @@ class VideoFilePointer:
         id_convention=lambda args: f"{args[0].NAME()}"
     )
 )
-def test_compile_video_output(temp_dir, sample_module):
+@parametrize("stream", [True, False], ids=["stream", "files"])
+def test_compile_video_output(temp_dir, sample_module, stream):
     instructions, metadata = sample_module.ALL()
-    metadata.save_location = temp_dir
-    scrivid.compile_video(instructions, metadata)
+    metadata.save_location = temp_dir / ("stream" if stream else "files")
+    metadata.save_location.mkdir(exist_ok=True)
+    scrivid.compile_video(instructions, metadata, stream=stream)
 
-    actual = ComparisonBlock(str(temp_dir / f"{metadata.video_name}.mp4"))
+    actual = ComparisonBlock(str(metadata.save_location / f"{metadata.video_name}.mp4"))
     expected = ComparisonBlock(str(get_current_directory() / f"videos/__scrivid_\'{sample_module.NAME()}\'__.mp4"))
 
     with actual.container, expected.container:
         loop_over_video_objects(actual, expected)
+
+
+@categorize(category="video")
+def test_compile_video_overlap_order(temp_dir):
+    # The hash of a frame barely changes if the references on the same layer
+    # are drawn the other way around, so the pixels are compared instead. The
+    # last reference of a layer is drawn on top.
+    instructions, metadata = overlap.ALL()
+    metadata.save_location = temp_dir / "overlap-order"
+    metadata.save_location.mkdir(exist_ok=True)
+    scrivid.compile_video(instructions, metadata)
+
+    actual = ComparisonBlock(str(metadata.save_location / f"{metadata.video_name}.mp4"))
+    expected = ComparisonBlock(str(get_current_directory() / f"videos/__scrivid_\'{overlap.NAME()}\'__.mp4"))
+
+    with actual.container, expected.container:
+        while True:
+            actual.read_container()
+            expected.read_container()
+            if not actual.ret or not expected.ret:
+                break
+
+            differing = opencv.absdiff(actual.frame, expected.frame).max(axis=2) > 30
+            assert differing.mean() < 0.02
+
+
+@categorize(category="video")
+@parametrize("frame_rate", [24, 30, 60])
+def test_compile_video_frame_rates(temp_dir, frame_rate):
+    # The frames that are held are listed at a frame rate of their own, which
+    # mustn't move any of them at a different one.
+    instructions, metadata = figure_eight.ALL()
+    metadata.frame_rate = frame_rate
+    metadata.save_location = temp_dir / f"frame-rate-{frame_rate}"
+    metadata.save_location.mkdir(exist_ok=True)
+    scrivid.compile_video(instructions, metadata, stream=False)
+
+    _, streamed_metadata = figure_eight.ALL()
+    streamed_metadata.frame_rate = frame_rate
+    streamed_metadata.save_location = temp_dir / f"frame-rate-{frame_rate}-streamed"
+    streamed_metadata.save_location.mkdir(exist_ok=True)
+    scrivid.compile_video(instructions, streamed_metadata)
+
+    video = metadata.save_location / f"{metadata.video_name}.mp4"
+    streamed_video = streamed_metadata.save_location / f"{metadata.video_name}.mp4"
+    assert video.read_bytes() == streamed_video.read_bytes()
+
+
+@categorize(category="video")
+@parametrize("stream", [True, False], ids=["stream", "files"])
+def test_compile_video_after_failure(temp_dir, stream):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / f"after-failure-{stream}"
+    metadata.save_location.mkdir(exist_ok=True)
+    # An image that's missing is only found out once it's shown, partway
+    # through the video.
+    failing_instructions = (
+        *instructions,
+        scrivid.create_image_reference("MISSING", temp_dir / "missing.png", layer=2, x=0, y=0),
+        scrivid.adjustments.hide.create("MISSING", 0),
+        scrivid.adjustments.show.create("MISSING", 30)
+    )
+
+    with pytest.raises(Exception):
+        scrivid.compile_video(failing_instructions, metadata, stream=stream)
+    assert list(metadata.save_location.iterdir()) == []
+
+    scrivid.compile_video(instructions, metadata, stream=stream)
+    assert [file.name for file in metadata.save_location.iterdir()] == [f"{metadata.video_name}.mp4"]
+
+
+@categorize(category="video")
+@parametrize(
+    "sample_module",
+    assemble_arguments(
+        (figure_eight,),
+        (image_drawing,),
+        (slide,),
+        id_convention=lambda args: f"{args[0].NAME()}"
+    )
+)
+def test_iter_frames_output(sample_module):
+    instructions, metadata = sample_module.ALL()
+    expected = ComparisonBlock(str(get_current_directory() / f"videos/__scrivid_\'{sample_module.NAME()}\'__.mp4"))
+
+    with expected.container:
+        for index, image in scrivid.iter_frames(instructions, metadata):
+            expected.read_container()
+            assert expected.ret
+            expected.define_hash(imagehash.phash)
+            assert close_hash_match(imagehash.phash(image), expected.hash, 5)
+
+        expected.read_container()
+        assert not expected.ret
+
+
+def test_iter_frames_raw():
+    instructions, metadata = figure_eight.ALL()
+    width, height = metadata.window_size
+    frames = scrivid.iter_frames(instructions, metadata)
+    raw_frames = scrivid.iter_frames(instructions, metadata, raw=True)
+
+    for (index, image), (raw_index, buffer) in zip(frames, raw_frames):
+        assert index == raw_index
+        assert image.size == (width, height)
+        assert image.tobytes() == buffer
+        assert len(memoryview(buffer)) == width * height * 3
+
+
+def test_iter_frames_only_requires_window_size():
+    instructions, _ = figure_eight.ALL()
+    frames = scrivid.iter_frames(instructions, scrivid.Metadata(window_size=(101, 75)))
+
+    index, image = next(frames)
+    frames.close()
+    assert (index, image.size) == (0, (101, 75))
+
+    with pytest.raises(scrivid.errors.AttributeError):
+        next(scrivid.iter_frames(instructions, scrivid.Metadata(frame_rate=12)))
+
+
+@parametrize("index", [0, 7, 20, 45])
+def test_render_frame_matches_iter_frames(index):
+    instructions, metadata = figure_eight.ALL()
+    frames = [buffer for _, buffer in scrivid.iter_frames(instructions, metadata, raw=True)]
+
+    assert scrivid.render_frame(instructions, metadata, index, raw=True) == frames[index]
+
+
+@parametrize("start, stop", [(0, 5), (5, 15), (18, None)])
+def test_iter_frames_range(start, stop):
+    instructions, metadata = image_drawing.ALL()
+    frames = list(scrivid.iter_frames(instructions, metadata, raw=True))
+    frame_range = list(scrivid.iter_frames(instructions, metadata, raw=True, start=start, stop=stop))
+
+    assert frame_range == frames[start:stop]
+
+
+@parametrize("start, stop", [(-1, 5), (5, 5), (0, 1000), (1000, None)])
+def test_iter_frames_range_out_of_bounds(start, stop):
+    instructions, metadata = figure_eight.ALL()
+
+    with pytest.raises(scrivid.errors.IndexError):
+        next(scrivid.iter_frames(instructions, metadata, start=start, stop=stop))
+
+
+@categorize(category="video")
+@parametrize("stream", [True, False], ids=["stream", "files"])
+def test_compile_video_subclip(temp_dir, stream):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / ("subclip-stream" if stream else "subclip-files")
+    metadata.save_location.mkdir(exist_ok=True)
+    scrivid.compile_video(instructions, metadata, start=10, stop=30, stream=stream)
+
+    expected = [image for _, image in scrivid.iter_frames(instructions, metadata, start=10, stop=30)]
+    actual = ComparisonBlock(str(metadata.save_location / f"{metadata.video_name}.mp4"))
+    with actual.container:
+        for image in expected:
+            actual.read_container()
+            assert actual.ret
+            actual.define_hash(imagehash.phash)
+            assert close_hash_match(actual.hash, imagehash.phash(image), 5)
+
+        actual.read_container()
+        assert not actual.ret
+
+
+@categorize(category="video")
+def test_compile_video_preview(temp_dir):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / "preview"
+    metadata.save_location.mkdir(exist_ok=True)
+    scrivid.compile_video(instructions, metadata, preview=scrivid.Preview(scale=0.5, frame_rate=6))
+
+    video = opencv.VideoCapture(str(metadata.save_location / f"{metadata.video_name}.mp4"))
+    try:
+        assert video.get(opencv.CAP_PROP_FPS) == 6
+        assert video.get(opencv.CAP_PROP_FRAME_WIDTH) == metadata.window_width // 2
+        assert video.get(opencv.CAP_PROP_FRAME_COUNT) == -(-46 * 6 // metadata.frame_rate)
+    finally:
+        video.release()
+
+
+@categorize(category="video")
+@parametrize("stream", [True, False], ids=["stream", "files"])
+def test_compile_video_segments(temp_dir, monkeypatch, stream):
+    # The sample is too short to be split otherwise.
+    monkeypatch.setattr(_segments, "_MINIMUM_SEGMENT_FRAMES", 8)
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / ("segments-stream" if stream else "segments-files")
+    metadata.save_location.mkdir(exist_ok=True)
+    stats = scrivid.compile_video(instructions, metadata, segments=3, stream=stream, workers=2)
+
+    # The statistics of every segment are added together.
+    assert stats.frames_drawn + stats.frames_held == 46
+    assert "join_segments" in stats.stages
+
+    # Only the video is left behind.
+    assert [file.name for file in metadata.save_location.iterdir()] == [f"{metadata.video_name}.mp4"]
+
+    expected = [image for _, image in scrivid.iter_frames(instructions, metadata)]
+    actual = ComparisonBlock(str(metadata.save_location / f"{metadata.video_name}.mp4"))
+    with actual.container:
+        for image in expected:
+            actual.read_container()
+            assert actual.ret
+            actual.define_hash(imagehash.phash)
+            assert close_hash_match(actual.hash, imagehash.phash(image), 5)
+
+        actual.read_container()
+        assert not actual.ret
+
+
+@categorize(category="video")
+def test_compile_video_segments_libx265(temp_dir, monkeypatch):
+    # Every segment starts on a closed GOP, so they're joined without being
+    # encoded again.
+    monkeypatch.setattr(_segments, "_MINIMUM_SEGMENT_FRAMES", 8)
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / "segments-libx265"
+    metadata.save_location.mkdir(exist_ok=True)
+    metadata.encoder_profile = scrivid.EncoderProfile(codec="libx265", crf=28, preset="ultrafast")
+    scrivid.compile_video(instructions, metadata, segments=3)
+
+    expected = [image for _, image in scrivid.iter_frames(instructions, metadata)]
+    actual = ComparisonBlock(str(metadata.save_location / f"{metadata.video_name}.mp4"))
+    with actual.container:
+        for image in expected:
+            actual.read_container()
+            assert actual.ret
+            actual.define_hash(imagehash.phash)
+            assert close_hash_match(actual.hash, imagehash.phash(image), 5)
+
+        actual.read_container()
+        assert not actual.ret
+
+
+@categorize(category="video")
+def test_compile_video_segment_failure(temp_dir, monkeypatch):
+    monkeypatch.setattr(_segments, "_MINIMUM_SEGMENT_FRAMES", 8)
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / "segment-failure"
+    metadata.save_location.mkdir(exist_ok=True)
+    # The image is missing from the first few frames of the first segment,
+    # while the other segments take a while to draw.
+    failing_instructions = (
+        *instructions,
+        scrivid.create_image_reference("MISSING", temp_dir / "missing.png", layer=2, x=0, y=0),
+        scrivid.adjustments.hide.create("MISSING", 5)
+    )
+    draw_frame = _frame_drawing.draw_frame
+
+    def slow_draw_frame(*args):
+        time.sleep(0.25)
+        return draw_frame(*args)
+
+    monkeypatch.setattr(_frame_drawing, "draw_frame", slow_draw_frame)
+
+    started = time.perf_counter()
+    with pytest.raises(Exception):
+        scrivid.compile_video(failing_instructions, metadata, segments=3)
+    # Every frame of a segment takes a quarter of a second, so the others are
+    # stopped long before they're compiled.
+    assert time.perf_counter() - started < 46 * 0.25 / 3
+    assert list(metadata.save_location.iterdir()) == []
+
+
+@categorize(category="video")
+@parametrize("stream, segments", [(True, None), (False, None), (True, 3)], ids=["stream", "files", "segments"])
+def test_compile_video_progress_error(temp_dir, monkeypatch, stream, segments):
+    monkeypatch.setattr(_segments, "_MINIMUM_SEGMENT_FRAMES", 8)
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / f"progress-error-{stream}-{segments}"
+    metadata.save_location.mkdir(exist_ok=True)
+
+    # The error is raised once ffmpeg has encoded the whole video, at the
+    # latest as the last of the progress is reported.
+    def progress(current):
+        if current.stage in ("stitch_video", "join_segments") and current.encoded_frames >= current.total_frames:
+            raise ValueError("Stopped by the callback.")
+
+    with pytest.raises(ValueError):
+        scrivid.compile_video(instructions, metadata, progress=progress, segments=segments, stream=stream)
+    assert list(metadata.save_location.iterdir()) == []
+
+
+def test_split_segments():
+    points = [0, 40, 95, 130, 210]
+    # The even boundaries at 100 and 200 are moved onto the nearest change
+    # points, but none are near enough to 300.
+    assert _segments.split_segments(points, 0, 400, 4) == [
+        range(0, 95), range(95, 210), range(210, 300), range(300, 400)
+    ]
+
+
+def test_split_segments_minimum_length():
+    segments = _segments.split_segments([0], 10, 110, 8)
+    assert [len(segment) for segment in segments] == [25, 25, 25, 25]
+    assert _segments.split_segments([0], 0, 30, 8) == [range(0, 30)]
+
+
+def test_compile_video_segments_validation(temp_dir):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir
+    with pytest.raises(scrivid.errors.TypeError):
+        scrivid.compile_video(instructions, metadata, segments=0)
+
+
+@categorize(category="video")
+def test_compile_video_stream_ffmpeg_error(temp_dir, monkeypatch):
+    # ffmpeg doesn't know the encoder, so it stops taking frames long before
+    # they've all been queued.
+    monkeypatch.setattr(_video_stitching, "_QUEUED_FRAMES", 1)
+    monkeypatch.setattr(_video_stitching, "_output_settings", lambda metadata: {"vcodec": "not-an-encoder"})
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / "existing"
+    metadata.save_location.mkdir(exist_ok=True)
+    existing_video = metadata.save_location / f"{metadata.video_name}.mp4"
+    existing_video.write_bytes(b"An earlier video.")
+
+    with pytest.raises(scrivid.errors.InternalErrorFromFFMPEG):
+        scrivid.compile_video(instructions, metadata)
+
+    # The video saved before is left as it was.
+    assert list(metadata.save_location.iterdir()) == [existing_video]
+    assert existing_video.read_bytes() == b"An earlier video."
+
+
+@categorize(category="video")
+@parametrize("stream, workers", [(True, None), (False, None), (True, 2)], ids=["stream", "files", "workers"])
+def test_compile_video_stats(temp_dir, stream, workers):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / f"stats-{stream}-{workers}"
+    metadata.save_location.mkdir(exist_ok=True)
+    stats = scrivid.compile_video(instructions, metadata, stream=stream, workers=workers)
+
+    assert isinstance(stats, scrivid.RenderStats)
+    assert stats.frames_drawn + stats.frames_held == 46
+    assert stats.frames_drawn > 0 and stats.pixels_blitted > 0
+
+    expected_stages = ["separate_instructions", "motion_tree.parse", "generate_frames", "draw_frames"]
+    if not stream:
+        expected_stages += ["save_frames", "fill_undrawn_frames"]
+    expected_stages.append("stitch_video")
+    assert list(stats.stages) == expected_stages
+    assert all(stage.wall_time >= 0 and stage.cpu_time >= 0 for stage in stats.stages.values())
+    assert sum(stage.wall_time for stage in stats.stages.values()) <= stats.wall_time or workers is not None
+
+    # Every reference opens its image through the cache at least once.
+    assert stats.caches["decoded_images"].hits + stats.caches["decoded_images"].misses > 0
+
+
+@categorize(category="video")
+@parametrize("workers", [None, 2], ids=["serial", "workers"])
+def test_compile_video_trace(temp_dir, workers):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / f"trace-{workers}"
+    metadata.save_location.mkdir(exist_ok=True)
+    trace_file = metadata.save_location / "trace.json"
+    stats = scrivid.compile_video(instructions, metadata, trace=trace_file, workers=workers)
+
+    with open(trace_file) as file:
+        events = json.load(file)["traceEvents"]
+    spans = [event for event in events if event["ph"] == "X"]
+
+    frames = [span for span in spans if span["cat"] == "frame"]
+    assert len(frames) == stats.frames_drawn
+    blitted = {span["args"]["ID"] for span in spans if span["name"] == "blit"}
+    assert blitted and blitted <= {
+        reference.ID for reference in instructions if isinstance(reference, scrivid.ImageReference)
+    }
+    assert [span["name"] for span in spans if span["cat"] == "encode"] == ["ffmpeg"]
+    assert {"separate_instructions", "motion_tree.parse", "stitch_video"} <= {
+        span["name"] for span in spans if span["cat"] == "stage"
+    }
+
+
+def test_compile_video_trace_validation(temp_dir):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir
+    with pytest.raises(scrivid.errors.TypeError):
+        scrivid.compile_video(instructions, metadata, trace=1)
+
+
+@categorize(category="video")
+@parametrize("stream, workers", [(True, None), (False, None), (True, 2)], ids=["stream", "files", "workers"])
+def test_compile_video_progress(temp_dir, stream, workers):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / f"progress-{stream}-{workers}"
+    metadata.save_location.mkdir(exist_ok=True)
+    reported = []
+    scrivid.compile_video(instructions, metadata, progress=reported.append, stream=stream, workers=workers)
+
+    assert all(isinstance(progress, scrivid.RenderProgress) for progress in reported)
+    assert reported[0].stage == "separate_instructions"
+    assert reported[-1].stage == "stitch_video"
+    assert "draw_frames" in {progress.stage for progress in reported}
+
+    frames_rendered = [progress.frames_rendered for progress in reported]
+    assert frames_rendered == sorted(frames_rendered)
+    assert reported[-1].frames_rendered == reported[-1].total_frames == 46
+    assert reported[-1].encoded_frames == 46
+
+
+@categorize(category="video")
+@parametrize(
+    "stream, workers, segments",
+    [(True, None, None), (False, None, None), (True, 2, None), (True, 2, 3)],
+    ids=["stream", "files", "workers", "segments"]
+)
+def test_compile_video_cancel(temp_dir, monkeypatch, stream, workers, segments):
+    monkeypatch.setattr(_segments, "_MINIMUM_SEGMENT_FRAMES", 8)
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / f"cancel-{stream}-{workers}-{segments}"
+    metadata.save_location.mkdir(exist_ok=True)
+    cancel = scrivid.CancelToken()
+
+    def progress(current):
+        if current.frames_rendered >= 10:
+            cancel.cancel()
+
+    with pytest.raises(scrivid.errors.RenderCancelled):
+        scrivid.compile_video(
+            instructions, metadata, cancel=cancel, progress=progress, segments=segments, stream=stream,
+            workers=workers
+        )
+
+    # Neither the `.scrivid-cache` folder nor the unfinished video is left.
+    assert cancel.cancelled
+    assert list(metadata.save_location.iterdir()) == []
+
+
+def test_compile_video_progress_validation(temp_dir):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir
+    with pytest.raises(scrivid.errors.TypeError):
+        scrivid.compile_video(instructions, metadata, progress=1)
+    with pytest.raises(scrivid.errors.TypeError):
+        scrivid.compile_video(instructions, metadata, cancel=True)
+
+
+@categorize(category="video")
+@parametrize("in_memory", [False, True], ids=["files", "memory"])
+def test_compile_video_scratch(temp_dir, in_memory):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / f"scratch-{in_memory}"
+    metadata.save_location.mkdir(exist_ok=True)
+    location = temp_dir / f"scratch-location-{in_memory}"
+    location.mkdir(exist_ok=True)
+
+    # A directory left behind by a render that crashed doesn't get in the way.
+    (location / ".scrivid-cache-crashed").mkdir(exist_ok=True)
+    scratch_directories = []
+
+    def progress(current):
+        if current.stage == "draw_frames":
+            scratch_directories.append({path.name for path in location.iterdir()} - {".scrivid-cache-crashed"})
+
+    scrivid.compile_video(
+        instructions, metadata, progress=progress, scratch=scrivid.Scratch(location, in_memory=in_memory),
+        stream=False
+    )
+
+    # Only the video is saved to `save_location`.
+    assert [file.name for file in metadata.save_location.iterdir()] == [f"{metadata.video_name}.mp4"]
+    assert [path.name for path in location.iterdir()] == [".scrivid-cache-crashed"]
+    if in_memory:
+        assert scratch_directories[-1] == set()
+    else:
+        (directory,) = scratch_directories[-1]
+        assert directory.startswith(".scrivid-cache-")
+
+    expected = [image for _, image in scrivid.iter_frames(instructions, metadata)]
+    actual = ComparisonBlock(str(metadata.save_location / f"{metadata.video_name}.mp4"))
+    with actual.container:
+        for image in expected:
+            actual.read_container()
+            assert actual.ret
+            actual.define_hash(imagehash.phash)
+            assert close_hash_match(actual.hash, imagehash.phash(image), 5)
+
+
+def test_compile_video_scratch_validation(temp_dir):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir
+    with pytest.raises(scrivid.errors.TypeError):
+        scrivid.compile_video(instructions, metadata, scratch=1)
+    with pytest.raises(scrivid.errors.TypeError):
+        scrivid.compile_video(instructions, metadata, scratch=scrivid.Scratch(in_memory=1))
+
+
+@categorize(category="video")
+@parametrize("frame_format, in_memory", [("ppm", False), ("bmp", True), ("raw", False)], ids=["ppm", "bmp", "raw"])
+def test_compile_video_frame_formats(temp_dir, frame_format, in_memory):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / f"format-{frame_format}"
+    metadata.save_location.mkdir(exist_ok=True)
+    scrivid.compile_video(
+        instructions, metadata, scratch=scrivid.Scratch(frame_format=frame_format, in_memory=in_memory), stream=False
+    )
+
+    # The frames are decoded into the same pixels whatever their format, so
+    # the video is the same as one that's streamed.
+    _, streamed_metadata = figure_eight.ALL()
+    streamed_metadata.save_location = temp_dir / f"format-{frame_format}-streamed"
+    streamed_metadata.save_location.mkdir(exist_ok=True)
+    scrivid.compile_video(instructions, streamed_metadata)
+
+    video = metadata.save_location / f"{metadata.video_name}.mp4"
+    streamed_video = streamed_metadata.save_location / f"{metadata.video_name}.mp4"
+    assert video.read_bytes() == streamed_video.read_bytes()
+
+
+@parametrize(
+    "scratch, error",
+    [
+        (scrivid.Scratch(frame_format="gif"), scrivid.errors.TypeError),
+        (scrivid.Scratch(compress_level=10), scrivid.errors.TypeError),
+        (scrivid.Scratch(frame_format="ppm", compress_level=1), scrivid.errors.ConflictingAttributesError),
+    ],
+    ids=["format", "compress_level", "conflicting"]
+)
+def test_compile_video_frame_format_validation(temp_dir, scratch, error):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir
+    with pytest.raises(error):
+        scrivid.compile_video(instructions, metadata, scratch=scratch, stream=False)
+
+
+@categorize(category="video")
+@parametrize(
+    "stream, workers, segments",
+    [(False, None, None), (False, 2, None), (True, 1, 3)],
+    ids=["files", "workers", "segments"]
+)
+def test_compile_video_resume(temp_dir, monkeypatch, stream, workers, segments):
+    monkeypatch.setattr(_segments, "_MINIMUM_SEGMENT_FRAMES", 8)
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / f"resume-{workers}-{segments}"
+    metadata.save_location.mkdir(exist_ok=True)
+    scratch = scrivid.Scratch(resumable=True)
+    cancel = scrivid.CancelToken()
+    arguments = {"scratch": scratch, "segments": segments, "stream": stream, "workers": workers}
+
+    def progress(current):
+        if current.frames_rendered >= 25:
+            cancel.cancel()
+
+    with pytest.raises(scrivid.errors.RenderCancelled):
+        scrivid.compile_video(instructions, metadata, cancel=cancel, progress=progress, **arguments)
+
+    # The scratch directory is kept, along with what was finished in it.
+    directory = metadata.save_location / f".scrivid-resume-{metadata.video_name}"
+    assert [path.name for path in metadata.save_location.iterdir()] == [directory.name]
+    manifest = json.loads((directory / "manifest.json").read_text())
+    if segments is None:
+        assert manifest["completed"][0][0] == 0
+    else:
+        assert manifest["completed"] == [[0, 1]]
+
+    stats = scrivid.compile_video(instructions, metadata, **arguments)
+    assert [file.name for file in metadata.save_location.iterdir()] == [f"{metadata.video_name}.mp4"]
+
+    # Only what's missing is drawn, and the video is the same as one that was
+    # never stopped.
+    _, whole_metadata = figure_eight.ALL()
+    whole_metadata.save_location = temp_dir / f"resume-{workers}-{segments}-whole"
+    whole_metadata.save_location.mkdir(exist_ok=True)
+    whole_stats = scrivid.compile_video(instructions, whole_metadata, segments=segments, stream=stream, workers=workers)
+
+    assert 0 < stats.frames_drawn < whole_stats.frames_drawn
+    video = metadata.save_location / f"{metadata.video_name}.mp4"
+    whole_video = whole_metadata.save_location / f"{metadata.video_name}.mp4"
+    assert video.read_bytes() == whole_video.read_bytes()
+
+
+@categorize(category="video")
+def test_compile_video_resume_changed(temp_dir):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / "resume-changed"
+    metadata.save_location.mkdir(exist_ok=True)
+    scratch = scrivid.Scratch(resumable=True)
+    cancel = scrivid.CancelToken()
+
+    def progress(current):
+        if current.frames_rendered >= 25:
+            cancel.cancel()
+
+    with pytest.raises(scrivid.errors.RenderCancelled):
+        scrivid.compile_video(instructions, metadata, cancel=cancel, progress=progress, scratch=scratch, stream=False)
+
+    # The frames were drawn for another encoder profile, so none of them are
+    # picked up.
+    metadata.encoder_profile = "draft"
+    stats = scrivid.compile_video(instructions, metadata, scratch=scratch, stream=False)
+    assert stats.frames_drawn + stats.frames_held == 46
+    assert [file.name for file in metadata.save_location.iterdir()] == [f"{metadata.video_name}.mp4"]
+
+
+@categorize(category="video")
+def test_compile_video_resume_single_segment(temp_dir):
+    # The video is too short to be split into segments, so it's compiled as a
+    # single one, which is still resumable.
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / "resume-single-segment"
+    metadata.save_location.mkdir(exist_ok=True)
+    scratch = scrivid.Scratch(resumable=True)
+    cancel = scrivid.CancelToken()
+
+    def progress(current):
+        if current.stage == "join_segments":
+            cancel.cancel()
+
+    with pytest.raises(scrivid.errors.RenderCancelled):
+        scrivid.compile_video(instructions, metadata, cancel=cancel, progress=progress, scratch=scratch, segments=3)
+
+    directory = metadata.save_location / f".scrivid-resume-{metadata.video_name}"
+    assert json.loads((directory / "manifest.json").read_text())["completed"] == [[0, 1]]
+
+    stats = scrivid.compile_video(instructions, metadata, scratch=scratch, segments=3)
+    assert stats.frames_drawn == 0
+    assert [file.name for file in metadata.save_location.iterdir()] == [f"{metadata.video_name}.mp4"]
+
+
+@categorize(category="video")
+def test_compile_video_resume_overlapping(temp_dir):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / "resume-overlapping"
+    metadata.save_location.mkdir(exist_ok=True)
+    scratch = scrivid.Scratch(resumable=True)
+    errors = []
+
+    # Another render of the same video, but with another encoder profile,
+    # starts while the first one is compiling. It would otherwise start the
+    # directory over from under the first one.
+    def progress(current):
+        if current.stage == "draw_frames" and not errors:
+            _, other_metadata = figure_eight.ALL()
+            other_metadata.save_location = metadata.save_location
+            other_metadata.encoder_profile = "draft"
+            with pytest.raises(scrivid.errors.RenderInProgress) as error:
+                scrivid.compile_video(instructions, other_metadata, scratch=scratch, stream=False)
+            errors.append(error.value)
+
+    stats = scrivid.compile_video(instructions, metadata, progress=progress, scratch=scratch, stream=False)
+    assert len(errors) == 1
+    assert stats.frames_drawn + stats.frames_held == 46
+    assert [file.name for file in metadata.save_location.iterdir()] == [f"{metadata.video_name}.mp4"]
+
+    # Once the first render is done, the other one can go ahead.
+    metadata.encoder_profile = "draft"
+    scrivid.compile_video(instructions, metadata, scratch=scratch, stream=False)
+    assert [file.name for file in metadata.save_location.iterdir()] == [f"{metadata.video_name}.mp4"]
+
+
+@parametrize(
+    "scratch, stream, error",
+    [
+        (scrivid.Scratch(resumable=1), False, scrivid.errors.TypeError),
+        (scrivid.Scratch(resumable=True), True, scrivid.errors.ConflictingAttributesError),
+        (scrivid.Scratch(resumable=True, in_memory=True), False, scrivid.errors.ConflictingAttributesError),
+    ],
+    ids=["type", "stream", "in_memory"]
+)
+def test_compile_video_resume_validation(temp_dir, scratch, stream, error):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir
+    with pytest.raises(error):
+        scrivid.compile_video(instructions, metadata, scratch=scratch, stream=stream)
+
+
+@categorize(category="video")
+@parametrize("workers", [None, 2], ids=["serial", "workers"])
+def test_compile_video_frame_cache(temp_dir, workers):
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / f"frame-cache-{workers}"
+    metadata.save_location.mkdir(exist_ok=True)
+    videos = []
+
+    scrivid.caches.frames.directory = metadata.save_location / "frames"
+    try:
+        for attempt in range(2):
+            metadata.video_name = f"frame-cache-{attempt}"
+            stats = scrivid.compile_video(instructions, metadata, workers=workers)
+            videos.append((metadata.save_location / f"{metadata.video_name}.mp4").read_bytes())
+    finally:
+        scrivid.caches.frames.clear()
+        scrivid.caches.frames.directory = None
+
+    # Every frame drawn the first time is read back the second time, and the
+    # video is the same.
+    assert stats.caches["frames"].misses == 0
+    assert stats.caches["frames"].hits == stats.frames_drawn > 0
+    assert videos[0] == videos[1]
+
+
+@categorize(category="video")
+def test_compile_video_segment_cache(temp_dir, monkeypatch):
+    monkeypatch.setattr(_segments, "_MINIMUM_SEGMENT_FRAMES", 8)
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / "segment-cache"
+    metadata.save_location.mkdir(exist_ok=True)
+    # Only the last segment is changed, which moves the block somewhere else
+    # at the end, at the same time as before.
+    changed_instructions = (
+        *instructions[:-1],
+        scrivid.adjustments.move.create("BLOCK", 41, scrivid.properties.Properties(x=240, y=-250), 5)
+    )
+
+    def compile_video(name, instructions):
+        metadata.video_name = name
+        stats = scrivid.compile_video(instructions, metadata, segments=3)
+        return stats, (metadata.save_location / f"{name}.mp4").read_bytes()
+
+    _, uncached = compile_video("uncached", changed_instructions)
+    scrivid.caches.segments.directory = metadata.save_location / "segments"
+    try:
+        compile_video("original", instructions)
+        stats, changed = compile_video("changed", changed_instructions)
+    finally:
+        scrivid.caches.segments.clear()
+        scrivid.caches.segments.directory = None
+
+    assert (stats.caches["segments"].hits, stats.caches["segments"].misses) == (2, 1)
+    assert changed == uncached
+
+
+@categorize(category="video")
+def test_compile_video_segment_cache_resume(temp_dir, monkeypatch):
+    monkeypatch.setattr(_segments, "_MINIMUM_SEGMENT_FRAMES", 8)
+    instructions, metadata = figure_eight.ALL()
+    metadata.save_location = temp_dir / "segment-cache-resume"
+    metadata.save_location.mkdir(exist_ok=True)
+    scratch = scrivid.Scratch(metadata.save_location / "scratch", resumable=True)
+    scratch.location.mkdir()
+    manifests = []
+
+    # The manifest is read as it is on disk once the segments are about to be
+    # joined, which is what's left if the process dies while joining them.
+    def progress(current):
+        if current.stage == "join_segments":
+            manifest_file = scratch.location / f".scrivid-resume-{metadata.video_name}" / "manifest.json"
+            manifests.append(json.loads(manifest_file.read_text()))
+
+    scrivid.caches.segments.directory = metadata.save_location / "segments"
+    try:
+        scrivid.compile_video(instructions, metadata, segments=3)
+        metadata.video_name = "segment-cache-resume"
+        stats = scrivid.compile_video(instructions, metadata, progress=progress, scratch=scratch, segments=3)
+    finally:
+        scrivid.caches.segments.clear()
+        scrivid.caches.segments.directory = None
+
+    # Every segment was copied from the cache, and recorded as it was.
+    assert stats.caches["segments"].hits == 3
+    assert manifests[0]["completed"] == [[0, 3]]